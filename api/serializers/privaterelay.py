@@ -10,6 +10,26 @@ from . import StrictReadOnlyFieldsMixin
 
 
 class ProfileSerializer(StrictReadOnlyFieldsMixin, serializers.ModelSerializer):
+    # The mask statistics are read with one query, instead of one per field
+    emails_blocked = serializers.IntegerField(
+        source="mask_stats.emails_blocked", read_only=True
+    )
+    emails_forwarded = serializers.IntegerField(
+        source="mask_stats.emails_forwarded", read_only=True
+    )
+    emails_replied = serializers.IntegerField(
+        source="mask_stats.emails_replied", read_only=True
+    )
+    level_one_trackers_blocked = serializers.IntegerField(
+        source="mask_stats.level_one_trackers_blocked", read_only=True
+    )
+    total_masks = serializers.IntegerField(
+        source="mask_stats.total_masks", read_only=True
+    )
+    at_mask_limit = serializers.BooleanField(
+        source="mask_stats.at_mask_limit", read_only=True
+    )
+
     class Meta:
         model = Profile
         fields = [
@@ -5,6 +5,7 @@ from django.contrib.sites.models import Site
 
 import pytest
 from allauth.socialaccount.models import SocialApp
+from pytest_django.fixtures import SettingsWrapper
 from rest_framework.test import APIClient
 
 from privaterelay.tests.utils import make_free_test_user, make_premium_test_user
@@ -46,3 +47,24 @@ def fxa_social_app(db: None) -> SocialApp:
     if _created:
         social_app.sites.set((Site.objects.first(),))
     return social_app
+
+
+@pytest.fixture
+def settings_without_sqlcommenter(settings: SettingsWrapper) -> SettingsWrapper:
+    """
+    Remove the sqlcommenter from the middleware.
+
+    For sqlite, it injects two queries into the recorded queries. The
+    first is a plain string, the second is the expected dictionary format.
+    This breaks the tests using django_assert_num_queries
+    First query: "SELECT id, ...
+    Second query: {"sql": "SELECT id, ..."}A
+    """
+    try:
+        settings.MIDDLEWARE.remove(
+            "google.cloud.sqlcommenter.django.middleware.SqlCommenter"
+        )
+    except ValueError:
+        # sqlcommenter not available for Python 3.12 and later
+        pass
+    return settings
@@ -23,27 +23,6 @@ from privaterelay.tests.utils import (
 )
 
 
-@pytest.fixture
-def settings_without_sqlcommenter(settings: SettingsWrapper) -> SettingsWrapper:
-    """
-    Remove the sqlcommenter from the middleware.
-
-    For sqlite, it injects two queries into the recorded queries. The
-    first is a plain string, the second is the expected dictionary format.
-    This breaks the tests using django_assert_num_queries
-    First query: "SELECT id, ...
-    Second query: {"sql": "SELECT id, ..."}A
-    """
-    try:
-        settings.MIDDLEWARE.remove(
-            "google.cloud.sqlcommenter.django.middleware.SqlCommenter"
-        )
-    except ValueError:
-        # sqlcommenter not available for Python 3.12 and later
-        pass
-    return settings
-
-
 def test_post_domainaddress_success(
     prem_api_client: APIClient, premium_user: User, caplog: pytest.LogCaptureFixture
 ) -> None:
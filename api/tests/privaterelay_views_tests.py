@@ -14,6 +14,8 @@ import pytest
 import responses
 from allauth.socialaccount.internal.flows.signup import process_auto_signup
 from allauth.socialaccount.models import SocialAccount, SocialLogin
+from model_bakery import baker
+from pytest_django.fixtures import DjangoAssertNumQueries, SettingsWrapper
 from requests import PreparedRequest
 from requests.exceptions import Timeout
 from rest_framework.test import APIClient, APITestCase
@@ -26,6 +28,7 @@ from api.tests.authentication_tests import (
     setup_fxa_introspection_response,
 )
 from api.views.privaterelay import FXA_PROFILE_URL
+from emails.models import DomainAddress, MaskStatistics, RelayAddress
 from privaterelay.models import Profile
 
 
@@ -125,6 +128,52 @@ def test_profile_list_cache_control(free_api_client: APIClient) -> None:
     assert response["Cache-Control"] == "private, max-age=60"
 
 
+def test_profile_list_num_queries(
+    premium_user: User,
+    prem_api_client: APIClient,
+    settings_without_sqlcommenter: SettingsWrapper,
+    django_assert_max_num_queries: DjangoAssertNumQueries,
+) -> None:
+    """The number of queries does not depend on the number of masks."""
+    baker.make(RelayAddress, user=premium_user, num_forwarded=2, _quantity=20)
+    baker.make(
+        DomainAddress,
+        user=premium_user,
+        num_blocked=3,
+        address=iter(f"mask{i}" for i in range(5)),
+        _quantity=5,
+    )
+    # Profile, social accounts, waffle flags (unless cached), and mask statistics
+    with django_assert_max_num_queries(4):
+        response = prem_api_client.get(reverse("profiles-list"))
+    assert response.status_code == 200
+    [profile_data] = response.json()
+    assert profile_data["total_masks"] == 25
+    assert profile_data["emails_forwarded"] == 40
+    assert profile_data["emails_blocked"] == 15
+    assert profile_data["at_mask_limit"] is False
+
+
+def test_profile_list_without_mask_statistics(
+    premium_user: User,
+    prem_api_client: APIClient,
+    settings_without_sqlcommenter: SettingsWrapper,
+    django_assert_max_num_queries: DjangoAssertNumQueries,
+) -> None:
+    """The mask statistics of a user from before the table are read-only."""
+    settings_without_sqlcommenter.EMAIL_STATISTICS_WRITE_BEHIND = True
+    baker.make(RelayAddress, user=premium_user, num_forwarded=2, _quantity=20)
+    MaskStatistics.objects.filter(user=premium_user).delete()
+    # The 4 queries above, and summing the masks
+    with django_assert_max_num_queries(5):
+        response = prem_api_client.get(reverse("profiles-list"))
+    assert response.status_code == 200
+    [profile_data] = response.json()
+    assert profile_data["total_masks"] == 20
+    assert profile_data["emails_forwarded"] == 40
+    assert not MaskStatistics.objects.filter(user=premium_user).exists()
+
+
 def test_patch_premium_user_subdomain_cannot_be_changed(
     premium_user: User, prem_api_client: Client
 ) -> None:
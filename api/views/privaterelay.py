@@ -79,7 +79,12 @@ class ProfileViewSet(ModelViewSet):
 
     def get_queryset(self) -> QuerySet[Profile]:
         if isinstance(self.request.user, User):
-            return Profile.objects.filter(user=self.request.user)
+            # Profile.fxa reads the prefetched social accounts
+            return (
+                Profile.objects.filter(user=self.request.user)
+                .select_related("user")
+                .prefetch_related("user__socialaccount_set")
+            )
         return Profile.objects.none()
 
     def list(self, request: Request, *args: Any, **kwargs: Any) -> Response:
@@ -0,0 +1,171 @@
+"""
+Answer lookups for unknown and deleted Relay addresses without the database.
+
+Spam is often sent to random addresses on the Relay domains. Each of these
+emails looked for a RelayAddress, and then for a DeletedAddress, before being
+dropped. With ADDRESS_FILTER_ENABLED, two shared structures answer most of
+these lookups:
+
+* A Bloom filter, stored as a Redis bitmap, of the address hashes of every
+  RelayAddress, and of every DeletedAddress. An address hash that is not in the
+  filter has never been used, so an email for it can be dropped, and
+  valid_address() can skip the DeletedAddress query when making a new mask.
+* A negative cache of the address hashes that missed in the database, so that
+  repeated emails to a deleted address (or a false positive of the filter) do
+  not query the database again.
+
+The Bloom filter can have false positives, but no false negatives. Masks add
+their hash to the filter before they are saved, and are removed from the
+negative cache after the save is committed. The filter is not used
+until the build_address_filter command adds the existing addresses. Addresses
+are never removed, and a rebuild only adds to the filter, so it can run
+periodically without a gap. The filter size is part of the Redis key, so a new
+size starts a new filter, unused until it is built.
+
+ADDRESS_FILTER_ENABLED must be set for all processes that create masks.
+"""
+
+from __future__ import annotations
+
+from collections.abc import Iterable, Iterator
+from typing import Literal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .redis_client import get_redis
+
+FILTER_KEY_PREFIX = "address_filter"
+MISSING_KEY_PREFIX = "missing_address"
+# Each hash is a slice of the SHA256 hex digest of the address
+FILTER_HASHES = 7
+FILTER_HASH_DIGITS = 8
+
+MissingReason = Literal["deleted", "unknown"]
+
+
+def address_filter_enabled() -> bool:
+    return bool(settings.ADDRESS_FILTER_ENABLED)
+
+
+def _filter_key() -> str:
+    return f"{FILTER_KEY_PREFIX}:{settings.ADDRESS_FILTER_BITS}"
+
+
+def _bit_offsets(address_hash: str) -> list[int]:
+    size = settings.ADDRESS_FILTER_BITS
+    return [
+        int(address_hash[start : start + FILTER_HASH_DIGITS], 16) % size
+        for start in range(0, FILTER_HASHES * FILTER_HASH_DIGITS, FILTER_HASH_DIGITS)
+    ]
+
+
+def _ready_offset() -> int:
+    """Return the bit, after the filter bits, set when the filter is built."""
+    return int(settings.ADDRESS_FILTER_BITS)
+
+
+def add_address_hashes(address_hashes: Iterable[str]) -> None:
+    """Add address hashes to the Bloom filter."""
+    key = _filter_key()
+    pipeline = get_redis().pipeline(transaction=False)
+    for address_hash in address_hashes:
+        for offset in _bit_offsets(address_hash):
+            pipeline.setbit(key, offset, 1)
+    pipeline.execute()
+
+
+def might_be_used(address_hash: str) -> bool:
+    """
+    Return False if the address hash was never used by a mask.
+
+    Returns True if the address may be used, or if the filter is not built.
+    """
+    key = _filter_key()
+    pipeline = get_redis().pipeline(transaction=False)
+    pipeline.getbit(key, _ready_offset())
+    for offset in _bit_offsets(address_hash):
+        pipeline.getbit(key, offset)
+    ready, *bits = pipeline.execute()
+    return not ready or all(bits)
+
+
+def build_address_filter(chunk_size: int = 10_000) -> int:
+    """
+    Add the existing and deleted addresses to the Bloom filter.
+
+    Returns the number of address hashes added.
+    """
+    count = 0
+    chunk: list[str] = []
+    for address_hash in _all_address_hashes(chunk_size):
+        chunk.append(address_hash)
+        if len(chunk) >= chunk_size:
+            add_address_hashes(chunk)
+            count += len(chunk)
+            chunk = []
+    add_address_hashes(chunk)
+    count += len(chunk)
+    get_redis().setbit(_filter_key(), _ready_offset(), 1)
+    return count
+
+
+def _all_address_hashes(chunk_size: int) -> Iterator[str]:
+    from .models import (
+        DeletedAddress,
+        RelayAddress,
+        address_hash,
+        get_domain_numerical,
+    )
+    from .utils import get_domains_from_settings
+
+    domain_values = {
+        get_domain_numerical(domain): domain
+        for domain in get_domains_from_settings().values()
+    }
+    relay_addresses = RelayAddress.objects.values_list("address", "domain")
+    for address, domain in relay_addresses.iterator(chunk_size=chunk_size):
+        yield address_hash(address, domain=domain_values[domain])
+    deleted_hashes = DeletedAddress.objects.values_list("address_hash", flat=True)
+    yield from deleted_hashes.iterator(chunk_size=chunk_size)
+
+
+def _missing_key(address_hash: str) -> str:
+    return f"{MISSING_KEY_PREFIX}:{address_hash}"
+
+
+def find_missing_address(address_hash: str) -> MissingReason | None:
+    """
+    Return why an address is known to have no RelayAddress, or None to look it up.
+
+    The reason is "deleted" for a deleted address, and "unknown" for an address
+    that was never used.
+    """
+    reason: MissingReason | None = cache.get(_missing_key(address_hash))
+    if reason:
+        return reason
+    if not might_be_used(address_hash):
+        return "unknown"
+    return None
+
+
+def remember_missing_address(address_hash: str, reason: MissingReason) -> None:
+    """Cache an address that was not found in the database."""
+    cache.set(
+        _missing_key(address_hash),
+        reason,
+        timeout=settings.ADDRESS_FILTER_MISSING_CACHE_SECONDS,
+    )
+
+
+def add_new_address(address_hash: str) -> None:
+    """
+    Add the hash of a new mask to the filter, and forget it was missing.
+
+    The hash is added before the mask is saved, so the filter never misses a
+    saved mask. The missing address is forgotten once the mask is committed, so
+    that a lookup before the commit can not cache it as missing again.
+    """
+    add_address_hashes([address_hash])
+    transaction.on_commit(lambda: cache.delete(_missing_key(address_hash)))
@@ -62,6 +62,12 @@ class EmailsConfig(AppConfig):
         )
         self.blocklist = set(self._load_terms("blocklist.text"))
 
+    def ready(self) -> None:
+        from emails.utils import tracker_index
+
+        # Load the tracker lists before the first email needs them
+        tracker_index()
+
     def _load_terms(self, filename: str) -> list[str]:
         """Load a list of terms from a file."""
         terms = []
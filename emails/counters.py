@@ -0,0 +1,264 @@
+"""
+Write-behind buffer for the email statistics of masks and profiles.
+
+Every forwarded, blocked, or replied email updates counters on the mask and the
+last engagement time of the profile. With EMAIL_STATISTICS_WRITE_BEHIND, these
+updates are added to a Redis hash instead of writing the rows for each email.
+flush_statistics() moves the buffered updates to the database, using F()
+expressions so that concurrent writes to the same rows are kept.
+
+A flush claims the buffer by renaming the hash, so increments during a flush go
+to a new hash. A flush that fails before it is done is retried by the next
+flush. After FLUSH_MAX_ATTEMPTS failures, the claimed hash is renamed to a dead
+letter key and kept for inspection, so that newer updates are flushed again.
+Entries that can not be parsed are logged and skipped. The claimed hash is
+deleted just before the database commit, so a flush that stops between the two
+loses its updates, instead of writing them twice. Updates for rows deleted
+before the flush are dropped. The mask counters are also added to the owners'
+MaskStatistics totals.
+
+process_emails_from_sqs flushes on a timer. The web workers that process emails
+from the SNS endpoint call flush_statistics_if_due(), which flushes at most once
+per flush interval across all workers.
+"""
+
+from __future__ import annotations
+
+import logging
+from collections import defaultdict
+from collections.abc import Iterable
+from datetime import UTC, datetime
+from typing import TYPE_CHECKING, Any
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from privaterelay.models import Profile
+
+from .mask_statistics import update_mask_statistics
+from .models import DomainAddress, RelayAddress
+from .redis_client import get_redis
+
+if TYPE_CHECKING:
+    from redis import Redis
+
+logger = logging.getLogger("events")
+
+STATISTICS_KEY = "email_statistics"
+FLUSHING_KEY = "email_statistics:flushing"
+FLUSH_LOCK_KEY = "email_statistics:flush_lock"
+FLUSH_LOCK_TIMEOUT = 300
+FLUSH_LOCK_WAIT_SECONDS = 30
+FLUSH_DUE_KEY = "email_statistics:flush_due"
+FLUSH_ATTEMPTS_KEY = "email_statistics:flush_attempts"
+FLUSH_MAX_ATTEMPTS = 3
+DEAD_LETTER_KEY = "email_statistics:dead_letter"
+
+STATISTICS_MODELS: dict[str, type[RelayAddress | DomainAddress | Profile]] = {
+    "relayaddress": RelayAddress,
+    "domainaddress": DomainAddress,
+    "profile": Profile,
+}
+MASK_MODELS: dict[str, type[RelayAddress | DomainAddress]] = {
+    "relayaddress": RelayAddress,
+    "domainaddress": DomainAddress,
+}
+COUNTER_FIELDS = frozenset(
+    ("num_forwarded", "num_blocked", "num_replied", "num_level_one_trackers_blocked")
+)
+TIMESTAMP_FIELDS = frozenset(("last_used_at", "last_engagement"))
+
+
+def write_behind_enabled() -> bool:
+    return bool(settings.EMAIL_STATISTICS_WRITE_BEHIND)
+
+
+def _hash_field(instance: RelayAddress | DomainAddress | Profile, field: str) -> str:
+    return f"{instance._meta.model_name}:{instance.pk}:{field}"
+
+
+def record_statistics(
+    instance: RelayAddress | DomainAddress | Profile,
+    counters: dict[str, int] | None = None,
+    timestamps: Iterable[str] = (),
+    now: datetime | None = None,
+) -> None:
+    """Buffer counter increments and timestamp updates for a mask or profile."""
+    now = now or datetime.now(UTC)
+    pipeline = get_redis().pipeline(transaction=False)
+    for field, amount in (counters or {}).items():
+        if field not in COUNTER_FIELDS:
+            raise ValueError(f"{field} is not a statistics counter")
+        if amount:
+            pipeline.hincrby(STATISTICS_KEY, _hash_field(instance, field), amount)
+    for field in timestamps:
+        if field not in TIMESTAMP_FIELDS:
+            raise ValueError(f"{field} is not a statistics timestamp")
+        pipeline.hset(STATISTICS_KEY, _hash_field(instance, field), now.timestamp())
+    pipeline.execute()
+
+
+def take_pending_counters(instance: RelayAddress | DomainAddress) -> dict[str, int]:
+    """
+    Remove and return the buffered counters for a mask that will be deleted.
+
+    This includes the counters left by a failed flush. The flush lock is held, so
+    that a running flush does not also write the counters.
+    """
+    fields = sorted(COUNTER_FIELDS)
+    hash_fields = [_hash_field(instance, field) for field in fields]
+    redis = get_redis()
+    with redis.lock(
+        FLUSH_LOCK_KEY,
+        timeout=FLUSH_LOCK_TIMEOUT,
+        blocking_timeout=FLUSH_LOCK_WAIT_SECONDS,
+    ):
+        pipeline = redis.pipeline()
+        for key in (STATISTICS_KEY, FLUSHING_KEY):
+            pipeline.hmget(key, hash_fields)
+            pipeline.hdel(key, *hash_fields)
+        values, _, flushing_values, _ = pipeline.execute()
+    counters: dict[str, int] = {}
+    for field, value, flushing_value in zip(fields, values, flushing_values):
+        if value is not None or flushing_value is not None:
+            counters[field] = int(value or 0) + int(flushing_value or 0)
+    return counters
+
+
+def flush_statistics() -> int:
+    """
+    Write the buffered statistics to the database.
+
+    Returns the number of rows updated. If another process is flushing, this
+    returns 0 without waiting.
+    """
+    redis = get_redis()
+    lock = redis.lock(FLUSH_LOCK_KEY, timeout=FLUSH_LOCK_TIMEOUT)
+    if not lock.acquire(blocking=False):
+        return 0
+    try:
+        # A buffer left by a failed flush is written before claiming a new one
+        if not redis.exists(FLUSHING_KEY):
+            if not redis.exists(STATISTICS_KEY):
+                return 0
+            redis.rename(STATISTICS_KEY, FLUSHING_KEY)
+        pending = redis.hgetall(FLUSHING_KEY)
+        try:
+            with transaction.atomic():
+                updated = _apply_statistics(pending)
+                # Deleted before the commit, so that the counters are not written
+                # twice. If the commit then fails, these counters are lost.
+                redis.delete(FLUSHING_KEY, FLUSH_ATTEMPTS_KEY)
+        except Exception:
+            if redis.exists(FLUSHING_KEY):
+                _record_failed_flush(redis)
+            raise
+    finally:
+        lock.release()
+    return updated
+
+
+def _record_failed_flush(redis: Redis) -> None:
+    """Count a failed flush, and set the claimed hash aside after too many."""
+    attempts = redis.incr(FLUSH_ATTEMPTS_KEY)
+    if attempts < FLUSH_MAX_ATTEMPTS:
+        return
+    dead_letter_key = f"{DEAD_LETTER_KEY}:{datetime.now(UTC):%Y%m%dT%H%M%S}"
+    redis.rename(FLUSHING_KEY, dead_letter_key)
+    redis.delete(FLUSH_ATTEMPTS_KEY)
+    logger.error(
+        "email_statistics_dead_letter",
+        extra={"key": dead_letter_key, "attempts": attempts},
+    )
+
+
+def flush_statistics_if_due() -> int:
+    """
+    Write the buffered statistics, if no process did in the flush interval.
+
+    This is for the web workers that process emails from the SNS endpoint.
+    Returns the number of rows updated.
+    """
+    due = get_redis().set(
+        FLUSH_DUE_KEY,
+        1,
+        nx=True,
+        ex=settings.PROCESS_EMAIL_STATISTICS_FLUSH_INTERVAL,
+    )
+    if not due:
+        return 0
+    return flush_statistics()
+
+
+def _parse_statistics(
+    pending: dict[Any, Any],
+) -> list[tuple[str, int, str, int | datetime]]:
+    """Parse the buffered updates, logging and skipping the invalid entries."""
+    statistics: list[tuple[str, int, str, int | datetime]] = []
+    for raw_key, raw_value in pending.items():
+        try:
+            model_name, raw_pk, field = raw_key.decode().split(":")
+            pk = int(raw_pk)
+        except ValueError:
+            logger.error("email_statistics_bad_key", extra={"key": raw_key})
+            continue
+        if model_name not in STATISTICS_MODELS:
+            logger.error("email_statistics_unknown_model", extra={"key": raw_key})
+            continue
+        if field not in COUNTER_FIELDS | TIMESTAMP_FIELDS:
+            logger.error("email_statistics_unknown_field", extra={"key": raw_key})
+            continue
+        value: int | datetime
+        try:
+            if field in COUNTER_FIELDS:
+                value = int(raw_value)
+            else:
+                value = datetime.fromtimestamp(float(raw_value), UTC)
+        except (ValueError, OverflowError, OSError):
+            logger.error(
+                "email_statistics_bad_value",
+                extra={"key": raw_key, "value": raw_value},
+            )
+            continue
+        statistics.append((model_name, pk, field, value))
+    return statistics
+
+
+def _apply_statistics(pending: dict[Any, Any]) -> int:
+    statistics = _parse_statistics(pending)
+    updates: dict[tuple[str, int], dict[str, Any]] = defaultdict(dict)
+    for model_name, pk, field, value in statistics:
+        if isinstance(value, datetime):
+            when = Value(value)
+            updates[(model_name, pk)][field] = Greatest(Coalesce(F(field), when), when)
+        else:
+            updates[(model_name, pk)][field] = Coalesce(F(field), 0) + value
+
+    updated = 0
+    for (model_name, pk), fields in sorted(updates.items()):
+        model = STATISTICS_MODELS[model_name]
+        updated += model.objects.filter(pk=pk).update(**fields)
+    for user_id, changes in sorted(_mask_statistics_changes(statistics).items()):
+        update_mask_statistics(user_id, changes)
+    return updated
+
+
+def _mask_statistics_changes(
+    statistics: list[tuple[str, int, str, int | datetime]],
+) -> dict[int, dict[str, int]]:
+    """Total the buffered mask counters for each user."""
+    mask_counters: dict[str, dict[int, dict[str, int]]] = defaultdict(dict)
+    for model_name, pk, field, value in statistics:
+        # The counters are the int values, the timestamps are datetimes
+        if model_name in MASK_MODELS and isinstance(value, int):
+            mask_counters[model_name].setdefault(pk, {})[field] = value
+
+    changes: dict[int, dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    for model_name, counters_by_pk in mask_counters.items():
+        owners = MASK_MODELS[model_name].objects.filter(pk__in=counters_by_pk)
+        for pk, user_id in owners.values_list("pk", "user_id"):
+            for field, amount in counters_by_pk[pk].items():
+                changes[user_id][field] += amount
+    return changes
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from emails.address_filter import address_filter_enabled, build_address_filter
+
+
+class Command(BaseCommand):
+    help = "Add the existing and deleted Relay addresses to the address filter"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            default=10_000,
+            type=int,
+            help="Number of addresses to read and add at a time",
+        )
+
+    def handle(self, *args, **options):
+        if not address_filter_enabled():
+            raise CommandError("ADDRESS_FILTER_ENABLED is not set")
+        count = build_address_filter(chunk_size=options["chunk_size"])
+        print(f"Added {count} address hashes to the address filter")
@@ -1,9 +1,11 @@
+import time
 from datetime import UTC, datetime, timedelta
 
-from django.core.management.base import BaseCommand
-from django.db import transaction
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
 
 from ...models import Reply
+from ...utils import incr_if_enabled
 
 
 class Command(BaseCommand):
@@ -11,13 +13,47 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument("days_old", nargs=1, type=int)
+        parser.add_argument(
+            "--batch-size",
+            default=10_000,
+            type=int,
+            help="Size of the id range to delete in each transaction",
+        )
+        parser.add_argument(
+            "--sleep",
+            default=0.0,
+            type=float,
+            help="Seconds to wait between batches",
+        )
 
     def handle(self, *args, **options):
         delete_date = datetime.now(UTC) - timedelta(options["days_old"][0])
-        replies_to_delete = Reply.objects.filter(created_at__lt=delete_date).only("id")
+        batch_size = options["batch_size"]
+        if batch_size < 1:
+            raise CommandError(f"--batch-size must be at least 1, not {batch_size}")
+        # Reply records are created in id order, so the old records are the low
+        # ids. Already deleted records are not in the range, so after a stopped
+        # run, the next run continues where it stopped.
+        id_range = Reply.objects.filter(created_at__lt=delete_date).aggregate(
+            min_id=Min("id"), max_id=Max("id")
+        )
+        if id_range["min_id"] is None:
+            print(f"No reply records older than {delete_date}")
+            return
         print(
-            f"Deleting {len(replies_to_delete)} reply records "
-            f"older than {delete_date}"
+            f"Deleting reply records older than {delete_date}, "
+            f"with ids {id_range['min_id']} to {id_range['max_id']}"
         )
-        with transaction.atomic():
-            replies_to_delete.delete()
+
+        total = 0
+        for start_id in range(id_range["min_id"], id_range["max_id"] + 1, batch_size):
+            if start_id != id_range["min_id"] and options["sleep"]:
+                time.sleep(options["sleep"])
+            end_id = start_id + batch_size - 1
+            deleted, _ = Reply.objects.filter(
+                id__gte=start_id, id__lte=end_id, created_at__lt=delete_date
+            ).delete()
+            total += deleted
+            incr_if_enabled("reply_records_deleted", deleted)
+            print(f"Deleted {deleted} reply records with ids up to {end_id}")
+        print(f"Deleted {total} reply records older than {delete_date}")
@@ -2,7 +2,12 @@ import pathlib
 
 from django.core.management.base import BaseCommand
 
-from emails.utils import download_trackers, shavar_prod_lists_url, store_trackers
+from emails.utils import (
+    build_tracker_index,
+    download_trackers,
+    shavar_prod_lists_url,
+    store_trackers,
+)
 
 EMAILS_FOLDER_PATH = pathlib.Path(__file__).parents[2]
 TRACKER_FOLDER_PATH = EMAILS_FOLDER_PATH / "tracker_lists"
@@ -40,3 +45,10 @@ class Command(BaseCommand):
 
         store_trackers(trackers, TRACKER_FOLDER_PATH, file_name)
         print(f"Added {file_name} in {TRACKER_FOLDER_PATH}")
+
+        # Running processes load the new index on the next tracker lookup
+        index = build_tracker_index(TRACKER_FOLDER_PATH)
+        print(
+            f"Stored tracker index with {len(index.general)} level one and"
+            f" {len(index.strict)} level two trackers"
+        )
@@ -12,11 +12,19 @@ https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/sqs.h
 import gc
 import json
 import logging
+import math
+import os
+import resource
 import shlex
+import threading
 import time
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import UTC, datetime
-from multiprocessing import Pool
-from typing import Any, cast
+from multiprocessing import get_context
+from multiprocessing.pool import AsyncResult, Pool
+from typing import Any, NamedTuple, cast
 from urllib.parse import urlsplit
 
 from django import setup
@@ -32,17 +40,45 @@ from mypy_boto3_sqs.service_resource import Message as SQSMessage
 from mypy_boto3_sqs.service_resource import Queue as SQSQueue
 from sentry_sdk import capture_exception
 
+from emails.counters import flush_statistics, write_behind_enabled
 from emails.management.command_from_django_settings import (
     CommandFromDjangoSettings,
     SettingToLocal,
 )
-from emails.sns import VerificationFailed, verify_from_sns
+from emails.reply_buffer import flush_reply_records, reply_write_behind_enabled
+from emails.sns import (
+    VerificationFailed,
+    prefetch_signing_public_keys,
+    verify_from_sns,
+)
 from emails.utils import gauge_if_enabled, incr_if_enabled
 from emails.views import _sns_inbound_logic, validate_sns_arn_and_type
 
 logger = logging.getLogger("eventsinfo.process_emails_from_sqs")
 
 
+@dataclass
+class MessageTask:
+    """An SQS message that is being processed by the worker pool."""
+
+    message: SQSMessage
+    results: dict[str, Any]
+    future: AsyncResult | None = None
+    start_time: float = 0.0
+    done: bool = False
+
+    def wait(self, timeout: float) -> None:
+        if self.future is not None:
+            self.future.wait(timeout)
+
+    def ready(self) -> bool:
+        return self.future is None or self.future.ready()
+
+
+# A batch of messages and logging context, returned by poll_queue_for_messages
+PollResult = tuple[list[SQSMessage], dict[str, Any]]
+
+
 class Command(CommandFromDjangoSettings):
     help = "Fetch email tasks from SQS and process them."
 
@@ -71,6 +107,24 @@ class Command(CommandFromDjangoSettings):
             "Path to file to write healthcheck data.",
             lambda healthcheck_path: healthcheck_path is not None,
         ),
+        SettingToLocal(
+            "PROCESS_EMAIL_HEALTHCHECK_INTERVAL",
+            "healthcheck_interval",
+            "Time between writes to the healthcheck file.",
+            lambda healthcheck_interval: healthcheck_interval > 0,
+        ),
+        SettingToLocal(
+            "PROCESS_EMAIL_QUEUE_METRICS_INTERVAL",
+            "queue_metrics_interval",
+            "Time between refreshes of the SQS queue count metrics.",
+            lambda queue_metrics_interval: queue_metrics_interval > 0,
+        ),
+        SettingToLocal(
+            "PROCESS_EMAIL_STATISTICS_FLUSH_INTERVAL",
+            "statistics_flush_interval",
+            "Time between flushes of buffered email statistics to the database.",
+            lambda statistics_flush_interval: statistics_flush_interval > 0,
+        ),
         SettingToLocal(
             "PROCESS_EMAIL_DELETE_FAILED_MESSAGES",
             "delete_failed_messages",
@@ -92,6 +146,36 @@ class Command(CommandFromDjangoSettings):
             "Maximum time to process a message before cancelling.",
             lambda max_seconds: max_seconds > 0.0,
         ),
+        SettingToLocal(
+            "PROCESS_EMAIL_CONCURRENCY",
+            "concurrency",
+            "Number of messages to process at the same time, in worker processes.",
+            lambda concurrency: 0 < concurrency <= 10,
+        ),
+        SettingToLocal(
+            "PROCESS_EMAIL_PREFETCH",
+            "prefetch",
+            (
+                "Poll for the next batch of messages while processing the current"
+                " batch, if the visibility timeout allows it."
+            ),
+            lambda prefetch: prefetch in (True, False),
+        ),
+        SettingToLocal(
+            "PROCESS_EMAIL_WORKER_MAX_TASKS",
+            "worker_max_tasks",
+            "Number of messages a worker process handles before it is replaced.",
+            lambda worker_max_tasks: worker_max_tasks > 0,
+        ),
+        SettingToLocal(
+            "PROCESS_EMAIL_WORKER_MAX_RSS_MB",
+            "worker_max_rss_mb",
+            (
+                "Peak memory (RSS) in megabytes before a worker process is replaced,"
+                " or None for no limit."
+            ),
+            lambda max_rss_mb: max_rss_mb is None or max_rss_mb > 0,
+        ),
         SettingToLocal(
             "AWS_REGION",
             "aws_region",
@@ -117,9 +201,16 @@ class Command(CommandFromDjangoSettings):
     wait_seconds: int
     visibility_seconds: int
     healthcheck_path: str
+    healthcheck_interval: int
+    queue_metrics_interval: int
+    statistics_flush_interval: int
     delete_failed_messages: bool
     max_seconds: float | None
     max_seconds_per_message: float
+    concurrency: int
+    prefetch: bool
+    worker_max_tasks: int
+    worker_max_rss_mb: int | None
     aws_region: str
     sqs_url: str
     verbosity: int
@@ -135,9 +226,18 @@ class Command(CommandFromDjangoSettings):
                 "wait_seconds": self.wait_seconds,
                 "visibility_seconds": self.visibility_seconds,
                 "healthcheck_path": self.healthcheck_path,
+                "healthcheck_interval": self.healthcheck_interval,
+                "queue_metrics_interval": self.queue_metrics_interval,
+                "statistics_flush_interval": self.statistics_flush_interval,
+                "statistics_write_behind": write_behind_enabled(),
+                "reply_write_behind": reply_write_behind_enabled(),
                 "delete_failed_messages": self.delete_failed_messages,
                 "max_seconds": self.max_seconds,
                 "max_seconds_per_message": self.max_seconds_per_message,
+                "concurrency": self.concurrency,
+                "prefetch": self.prefetch,
+                "worker_max_tasks": self.worker_max_tasks,
+                "worker_max_rss_mb": self.worker_max_rss_mb,
                 "aws_region": self.aws_region,
                 "sqs_url": self.sqs_url,
                 "verbosity": self.verbosity,
@@ -146,9 +246,19 @@ class Command(CommandFromDjangoSettings):
 
         try:
             self.queue = self.create_client()
+            # boto3 resources are not thread-safe, so each thread uses its own
+            self.monitor_queue = self.create_client()
+            self.prefetch_queue = self.create_client() if self.prefetch else None
         except ClientError as e:
             raise CommandError("Unable to connect to SQS") from e
 
+        if self.prefetch and not self.can_prefetch():
+            logger.warning(
+                "Prefetch disabled, visibility_seconds is too short",
+                extra={"visibility_seconds": self.visibility_seconds},
+            )
+            self.prefetch = False
+
         process_data = self.process_queue()
         logger.info("Exiting process_emails_from_sqs", extra=process_data)
 
@@ -164,6 +274,11 @@ class Command(CommandFromDjangoSettings):
         self.queue_count: int = 0
         self.queue_count_delayed: int = 0
         self.queue_count_not_visible: int = 0
+        self.queue_metrics: dict[str, float | int] = {}
+        self.alive_at: datetime = datetime.now(tz=UTC)
+        self.monitor_stop = threading.Event()
+        self.monitor_thread: threading.Thread | None = None
+        self.pool: Pool | None = None
 
     def create_client(self) -> SQSQueue:
         """Create the SQS client."""
@@ -174,10 +289,31 @@ class Command(CommandFromDjangoSettings):
         sqs_client = boto3.resource("sqs", region_name=self.aws_region)
         return sqs_client.Queue(self.sqs_url)
 
+    def can_prefetch(self) -> bool:
+        """
+        Return True if prefetched messages can be processed before they are visible.
+
+        A prefetched message may wait for the current batch to be processed, and then
+        for the messages ahead of it in its own batch, with each taking up to
+        max_seconds_per_message.
+        """
+        rounds_per_batch = math.ceil(self.batch_size / self.concurrency)
+        max_wait = 2 * rounds_per_batch * self.max_seconds_per_message
+        return max_wait <= self.visibility_seconds
+
     def process_queue(self) -> dict[str, Any]:
         """
         Process the SQS email queue until an exit condition is reached.
 
+        The worker pool is started on the first message, and is shut down on exit.
+        The queue metrics and healthcheck file are updated by a background thread,
+        see run_monitor. The known SNS signing keys are loaded by another background
+        thread, so the first messages do not wait to download them.
+
+        In prefetch mode, when a batch has messages, the next batch is requested in a
+        background thread while the current batch is processed. Prefetched messages
+        that are not processed before exit are made visible again.
+
         Return is a dict suitable for logging context, with these keys:
         * exit_on: Why processing exited - "interrupt", "max_seconds", "unknown"
         * cycles: How many polling cycles completed
@@ -193,6 +329,10 @@ class Command(CommandFromDjangoSettings):
         self.failed_messages = 0
         self.pause_count = 0
         self.start_time = time.monotonic()
+        self.start_monitor()
+        prefetch_signing_public_keys()
+        prefetch_executor = ThreadPoolExecutor(max_workers=1) if self.prefetch else None
+        prefetched: Future[PollResult] | None = None
 
         while not self.halt_requested:
             try:
@@ -200,8 +340,8 @@ class Command(CommandFromDjangoSettings):
                     "cycle_num": self.cycles,
                     "cycle_s": 0.0,
                 }
-                cycle_data.update(self.refresh_and_emit_queue_count_metrics())
-                self.write_healthcheck()
+                cycle_data.update(self.queue_metrics)
+                self.record_alive()
 
                 # Check if we should exit due to time limit
                 if self.max_seconds is not None:
@@ -212,7 +352,16 @@ class Command(CommandFromDjangoSettings):
 
                 # Request and process a chunk of messages
                 with Timer(logger=None) as cycle_timer:
-                    message_batch, queue_data = self.poll_queue_for_messages()
+                    if prefetched:
+                        message_batch, queue_data = prefetched.result()
+                        queue_data["prefetched"] = True
+                        prefetched = None
+                    else:
+                        message_batch, queue_data = self.poll_queue_for_messages()
+                    if prefetch_executor and message_batch:
+                        prefetched = prefetch_executor.submit(
+                            self.poll_queue_for_messages, self.prefetch_queue
+                        )
                     cycle_data.update(queue_data)
                     cycle_data.update(self.process_message_batch(message_batch))
 
@@ -242,6 +391,12 @@ class Command(CommandFromDjangoSettings):
                 self.halt_requested = True
                 exit_on = "interrupt"
 
+        if prefetch_executor:
+            if prefetched:
+                self.release_messages(prefetched)
+            prefetch_executor.shutdown()
+        self.stop_pool()
+        self.stop_monitor()
         process_data = {
             "exit_on": exit_on,
             "cycles": self.cycles,
@@ -254,6 +409,89 @@ class Command(CommandFromDjangoSettings):
             process_data["pause_count"] = self.pause_count
         return process_data
 
+    def start_monitor(self) -> None:
+        """Get the initial queue metrics, and start the background monitor thread."""
+        self.refresh_and_emit_queue_count_metrics()
+        self.record_alive()
+        self.write_healthcheck()
+        self.monitor_stop.clear()
+        self.monitor_thread = threading.Thread(
+            target=self.run_monitor, name="process_emails_monitor", daemon=True
+        )
+        self.monitor_thread.start()
+
+    def run_monitor(self) -> None:
+        """
+        Refresh queue metrics and write the healthcheck file until stopped.
+
+        This runs in a background thread, so that SQS requests and file writes are
+        not in the message processing loop. The healthcheck is written every
+        healthcheck_interval seconds, and has the last time the processing loop was
+        active, so it still detects a stuck loop. Buffered email statistics and Reply
+        records are flushed to the database, if enabled.
+        """
+        refresh_every = max(
+            1, round(self.queue_metrics_interval / self.healthcheck_interval)
+        )
+        flush_every = max(
+            1, round(self.statistics_flush_interval / self.healthcheck_interval)
+        )
+        ticks = 0
+        while not self.monitor_stop.wait(self.healthcheck_interval):
+            ticks += 1
+            if ticks % refresh_every == 0:
+                try:
+                    self.refresh_and_emit_queue_count_metrics()
+                except ClientError as e:
+                    logger.error(
+                        "Unable to refresh queue metrics",
+                        extra=e.response["Error"],
+                    )
+            if ticks % flush_every == 0:
+                self.flush_buffers()
+            self.write_healthcheck()
+        # The thread has its own database connection
+        connection.close()
+
+    def stop_monitor(self) -> None:
+        """
+        Stop the monitor thread, flush statistics and Reply records, and write the
+        healthcheck.
+        """
+        self.monitor_stop.set()
+        if self.monitor_thread is not None:
+            self.monitor_thread.join()
+            self.monitor_thread = None
+        self.flush_buffers()
+        self.write_healthcheck()
+
+    def flush_buffers(self) -> None:
+        """Write buffered email statistics and Reply records, if enabled."""
+        if write_behind_enabled():
+            self.flush_buffer(flush_statistics, "email statistics", "rows_updated")
+        if reply_write_behind_enabled():
+            self.flush_buffer(flush_reply_records, "Reply records", "rows_created")
+
+    def flush_buffer(
+        self, flush: Callable[[], int], buffer_name: str, count_name: str
+    ) -> None:
+        """Run a buffer's flush function, and log the rows written or the error."""
+        try:
+            with Timer(logger=None) as flush_timer:
+                count = flush()
+        except Exception as e:
+            capture_exception(e)
+            logger.exception(f"Unable to flush {buffer_name}")
+            return
+        if count:
+            logger.info(
+                f"Flushed {buffer_name}",
+                extra={
+                    count_name: count,
+                    "flush_s": round(flush_timer.last, 3),
+                },
+            )
+
     def refresh_and_emit_queue_count_metrics(self) -> dict[str, float | int]:
         """
         Query SQS queue attributes, store backlog metrics, and emit them as gauge stats
@@ -267,16 +505,17 @@ class Command(CommandFromDjangoSettings):
 
         """
         # Load attributes from SQS
+        queue = self.monitor_queue
         with Timer(logger=None) as attribute_timer:
-            self.queue.load()
+            queue.load()
 
         # Save approximate queue counts
-        self.queue_count = int(self.queue.attributes["ApproximateNumberOfMessages"])
+        self.queue_count = int(queue.attributes["ApproximateNumberOfMessages"])
         self.queue_count_delayed = int(
-            self.queue.attributes["ApproximateNumberOfMessagesDelayed"]
+            queue.attributes["ApproximateNumberOfMessagesDelayed"]
         )
         self.queue_count_not_visible = int(
-            self.queue.attributes["ApproximateNumberOfMessagesNotVisible"]
+            queue.attributes["ApproximateNumberOfMessagesNotVisible"]
         )
 
         # Emit gauges for approximate queue counts
@@ -291,26 +530,29 @@ class Command(CommandFromDjangoSettings):
             tags=[queue_tag],
         )
 
-        return {
+        self.queue_metrics = {
             "queue_load_s": round(attribute_timer.last, 3),
             "queue_count": self.queue_count,
             "queue_count_delayed": self.queue_count_delayed,
             "queue_count_not_visible": self.queue_count_not_visible,
         }
+        return self.queue_metrics
 
-    def poll_queue_for_messages(
-        self,
-    ) -> tuple[list[SQSMessage], dict[str, float | int]]:
+    def poll_queue_for_messages(self, queue: SQSQueue | None = None) -> PollResult:
         """Request a batch of messages, using the long-poll method.
 
+        Arguments:
+        * queue - the SQS queue to poll, defaults to self.queue
+
         Return is a tuple:
         * message_batch: a list of messages, which may be empty
         * data: A dict suitable for logging context, with these keys:
             - message_count: the number of messages
             - sqs_poll_s: The poll time, in seconds with millisecond precision
         """
+        queue = queue or self.queue
         with Timer(logger=None) as poll_timer:
-            message_batch = self.queue.receive_messages(
+            message_batch = queue.receive_messages(
                 MaxNumberOfMessages=self.batch_size,
                 VisibilityTimeout=self.visibility_seconds,
                 WaitTimeSeconds=self.wait_seconds,
@@ -323,10 +565,34 @@ class Command(CommandFromDjangoSettings):
             },
         )
 
+    def release_messages(self, prefetched: Future[PollResult]) -> None:
+        """Make unprocessed prefetched messages visible to other receivers."""
+        try:
+            message_batch, _ = prefetched.result()
+        except (ClientError, KeyboardInterrupt):
+            return
+        for message in message_batch:
+            try:
+                message.change_visibility(VisibilityTimeout=0)
+            except ClientError as e:
+                logger.warning(
+                    "Unable to release prefetched message",
+                    extra={"sqs_message_id": message.message_id, "error": str(e)},
+                )
+
     def process_message_batch(self, message_batch: list[SQSMessage]) -> dict[str, Any]:
         """
         Process a batch of messages.
 
+        Up to self.concurrency messages are processed at the same time by the worker
+        pool. If a message times out or a worker is due to be replaced, no new
+        messages are started until the in-flight messages are done, and then the
+        worker pool is replaced.
+
+        Messages are deleted together when the batch is done. Until then, the
+        visibility timeout of unfinished and to-be-deleted messages is extended every
+        half a visibility timeout, so they are not delivered again.
+
         Arguments:
         * messages - a list of SQS messages, possibly empty
 
@@ -343,23 +609,54 @@ class Command(CommandFromDjangoSettings):
         failed_count = 0
         pause_time = 0.0
         pause_count = 0
-        process_time = 0.0
-        for message in message_batch:
-            self.write_healthcheck()
-            with Timer(logger=None) as message_timer:
-                message_data = self.process_message(message)
-                if not message_data["success"]:
-                    failed_count += 1
-                if message_data["success"] or self.delete_failed_messages:
-                    message.delete()
-                pause_time += message_data.get("pause_s", 0.0)
-                pause_count += message_data.get("pause_count", 0)
-
-            message_data["message_process_time_s"] = round(message_timer.last, 3)
-            process_time += message_timer.last
-            logger.log(logging.INFO, "Message processed", extra=message_data)
-
-        batch_data = {"process_s": round((process_time - pause_time), 3)}
+        pending = list(message_batch)
+        in_flight: list[MessageTask] = []
+        to_delete: list[SQSMessage] = []
+        recycle_pool = False
+        extended_at: float | None = None  # Set at the first check, soon after receipt
+        with Timer(logger=None) as batch_timer:
+            while pending or in_flight:
+                if recycle_pool and not in_flight:
+                    self.stop_pool()
+                    recycle_pool = False
+                while (
+                    pending and not recycle_pool and len(in_flight) < self.concurrency
+                ):
+                    self.record_alive()
+                    in_flight.append(self.start_message(pending.pop(0)))
+
+                now = self.wait_for_messages(in_flight)
+                for task in [task for task in in_flight if task.done]:
+                    in_flight.remove(task)
+                    message_data = task.results
+                    if not message_data["success"]:
+                        failed_count += 1
+                    if message_data["success"] or self.delete_failed_messages:
+                        to_delete.append(task.message)
+                    if "worker_recycled" in message_data:
+                        recycle_pool = True
+                    pause_time += message_data.get("pause_s", 0.0)
+                    pause_count += message_data.get("pause_count", 0)
+                    logger.log(logging.INFO, "Message processed", extra=message_data)
+
+                # Heartbeat to keep unfinished and to-be-deleted messages invisible
+                if now is None:
+                    continue
+                if extended_at is None:
+                    extended_at = now
+                elif (pending or in_flight) and (
+                    now - extended_at >= self.visibility_seconds / 2
+                ):
+                    self.extend_visibility(
+                        pending + [task.message for task in in_flight] + to_delete
+                    )
+                    extended_at = now
+            if recycle_pool:
+                self.stop_pool()
+            if to_delete:
+                self.delete_messages(to_delete)
+
+        batch_data = {"process_s": round((batch_timer.last - pause_time), 3)}
         if pause_count:
             batch_data["pause_count"] = pause_count
             batch_data["pause_s"] = round(pause_time, 3)
@@ -367,11 +664,16 @@ class Command(CommandFromDjangoSettings):
             batch_data["failed_count"] = failed_count
         return batch_data
 
-    def process_message(self, message: SQSMessage) -> dict[str, Any]:
+    def start_message(self, message: SQSMessage) -> MessageTask:
         """
-        Process an SQS message, which may include sending an email.
+        Start processing an SQS message, which may include sending an email.
 
-        Return is a dict suitable for logging context, with these keys:
+        The message is checked, and then sent to the worker pool. The returned task
+        is done if the message failed the checks. Otherwise, use wait_for_messages
+        until it is done.
+
+        When done, task.results is a dict suitable for logging context, with these
+        keys:
         * success: True if message was processed successfully
         * error: The processing error, omitted on success
         * message_body_quoted: Set if the message was non-JSON, omitted for valid JSON
@@ -381,6 +683,8 @@ class Command(CommandFromDjangoSettings):
         * pause_error: The temporary error, or omitted if no temp error
         * client_error_code: The error code for non-temp or retry error,
           omitted on success
+        * worker_recycled: Why the worker pool should be replaced, omitted if it
+          can be reused
         """
         incr_if_enabled("process_message_from_sqs", 1)
         results = {"success": True, "sqs_message_id": message.message_id}
@@ -391,14 +695,14 @@ class Command(CommandFromDjangoSettings):
             results["success"] = False
             results["error"] = f"Failed to load message.body: {e}"
             results["message_body_quoted"] = shlex.quote(raw_body)
-            return results
+            return MessageTask(message=message, results=results, done=True)
         try:
             verified_json_body = verify_from_sns(json_body)
         except (KeyError, VerificationFailed) as e:
             logger.error("Failed SNS verification", extra={"error": str(e)})
             results["success"] = False
             results["error"] = f"Failed SNS verification: {e}"
-            return results
+            return MessageTask(message=message, results=results, done=True)
 
         topic_arn = verified_json_body["TopicArn"]
         message_type = verified_json_body["Type"]
@@ -406,12 +710,12 @@ class Command(CommandFromDjangoSettings):
         if error_details:
             results["success"] = False
             results.update(error_details)
-            return results
+            return MessageTask(message=message, results=results, done=True)
 
-        def success_callback(result: HttpResponse) -> None:
+        def success_callback(result: WorkerResult) -> None:
             """Handle return from successful call to _sns_inbound_logic"""
             # TODO: extract data from _sns_inbound_logic return
-            pass
+            results["worker_max_rss_kb"] = result.max_rss_kb
 
         def error_callback(exc_info: BaseException) -> None:
             """Handle exception raised by _sns_inbound_logic"""
@@ -429,54 +733,182 @@ class Command(CommandFromDjangoSettings):
                 results["error_type"] = type(exc_info).__name__
 
         # Run in a multiprocessing Pool
-        # This will start a subprocess, which needs to run django.setup
-        # The benefit is that the subprocess can be terminated
-        # The penalty is that is is slower to start
+        # The worker subprocess runs django.setup once, and then handles messages
+        # until it is recycled. The benefit is that the subprocess can be terminated
+        # The penalty is that it is slow to start, so it is kept between messages
         pool_start_time = time.monotonic()
-        with Pool(1, initializer=setup) as pool:
-            future = pool.apply_async(
-                run_sns_inbound_logic,
-                [topic_arn, message_type, verified_json_body],
-                callback=success_callback,
-                error_callback=error_callback,
-            )
-            setup_time = time.monotonic() - pool_start_time
-            results["subprocess_setup_time_s"] = round(setup_time, 3)
-
-            message_start_time = time.monotonic()
-            message_duration = 0.0
-            while message_duration < self.max_seconds_per_message:
-                self.write_healthcheck()
-                future.wait(1.0)
-                message_duration = time.monotonic() - message_start_time
-                if future.ready():
-                    break
+        pool = self.get_pool()
+        future = pool.apply_async(
+            run_sns_inbound_logic,
+            [topic_arn, message_type, verified_json_body],
+            callback=success_callback,
+            error_callback=error_callback,
+        )
+        setup_time = time.monotonic() - pool_start_time
+        results["subprocess_setup_time_s"] = round(setup_time, 3)
+        return MessageTask(
+            message=message,
+            results=results,
+            future=future,
+            start_time=time.monotonic(),
+        )
 
-            results["message_process_time_s"] = round(message_duration, 3)
-            if not future.ready():
+    def wait_for_messages(self, in_flight: list[MessageTask]) -> float | None:
+        """
+        Wait up to a second for in-flight messages, and update the finished ones.
+
+        The second is split between the running messages. A message that is still
+        running after max_seconds_per_message is marked as failed. The worker may be
+        hung, so it should be replaced.
+
+        Return is the time (from time.monotonic) the messages were checked, or None
+        if no messages were running.
+        """
+        running = [task for task in in_flight if not task.done]
+        if not running:
+            return None
+        self.record_alive()
+        for task in running:
+            task.wait(1.0 / len(running))
+        now = time.monotonic()
+        for task in running:
+            message_duration = now - task.start_time
+            results = task.results
+            if task.ready():
+                task.done = True
+            elif message_duration >= self.max_seconds_per_message:
+                task.done = True
                 error = f"Timed out after {self.max_seconds_per_message:0.1f} seconds."
                 results["success"] = False
                 results["error"] = error
-        return results
+                results["worker_recycled"] = "timeout"
+            if not task.done:
+                continue
+            results["message_process_time_s"] = round(message_duration, 3)
+            max_rss_kb = results.get("worker_max_rss_kb")
+            if (
+                self.worker_max_rss_mb is not None
+                and isinstance(max_rss_kb, int)
+                and max_rss_kb > self.worker_max_rss_mb * 1024
+            ):
+                results["worker_recycled"] = "max_rss"
+        return now
+
+    def delete_messages(self, messages: list[SQSMessage]) -> None:
+        """
+        Delete up to 10 messages from the queue with one request.
+
+        If the request fails, the messages are not deleted. They are logged, and SQS
+        will deliver them again after the visibility timeout.
+        """
+        try:
+            response = self.queue.delete_messages(
+                Entries=[
+                    {"Id": str(num), "ReceiptHandle": message.receipt_handle}
+                    for num, message in enumerate(messages)
+                ]
+            )
+        except ClientError as e:
+            logger.error(
+                "Failed to delete messages",
+                extra={
+                    "sqs_message_ids": [message.message_id for message in messages],
+                    "error": e.response["Error"],
+                },
+            )
+            return
+        for failure in response.get("Failed", []):
+            message = messages[int(failure["Id"])]
+            logger.error(
+                "Failed to delete message",
+                extra={"sqs_message_id": message.message_id, "error": failure},
+            )
+
+    def extend_visibility(self, messages: list[SQSMessage]) -> None:
+        """
+        Reset the visibility timeout of up to 10 messages with one request.
+
+        If the request fails, it is logged, and the next heartbeat tries again.
+        """
+        try:
+            response = self.queue.change_message_visibility_batch(
+                Entries=[
+                    {
+                        "Id": str(num),
+                        "ReceiptHandle": message.receipt_handle,
+                        "VisibilityTimeout": self.visibility_seconds,
+                    }
+                    for num, message in enumerate(messages)
+                ]
+            )
+        except ClientError as e:
+            logger.warning(
+                "Failed to extend messages visibility",
+                extra={
+                    "sqs_message_ids": [message.message_id for message in messages],
+                    "error": e.response["Error"],
+                },
+            )
+            return
+        incr_if_enabled("email_queue_visibility_extended", len(messages))
+        for failure in response.get("Failed", []):
+            message = messages[int(failure["Id"])]
+            logger.warning(
+                "Failed to extend message visibility",
+                extra={"sqs_message_id": message.message_id, "error": failure},
+            )
+
+    def get_pool(self) -> Pool:
+        """
+        Get the worker pool, starting it if needed.
+
+        Workers run django.setup when they start, and are replaced by the pool after
+        handling worker_max_tasks messages.
+
+        Workers are started by a forkserver process, not forked from this process.
+        The monitor and prefetch threads may hold locks for logging, network, Redis
+        or database I/O, and a worker forked at that time could deadlock on them.
+        """
+        if self.pool is None:
+            self.pool = Pool(
+                self.concurrency,
+                initializer=setup,
+                maxtasksperchild=self.worker_max_tasks,
+                context=get_context("forkserver"),
+            )
+        return self.pool
+
+    def stop_pool(self) -> None:
+        """Terminate the worker pool, if running."""
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+    def record_alive(self) -> None:
+        """Record that the processing loop is active, for the next healthcheck."""
+        self.alive_at = datetime.now(tz=UTC)
 
     def write_healthcheck(self) -> None:
-        """Update the healthcheck file with operations data, if path is set."""
+        """
+        Update the healthcheck file with operations data.
+
+        The data is written to a temporary file that replaces the healthcheck file,
+        so that a reader never sees a partially written file.
+        """
         data: dict[str, str | int] = {
-            "timestamp": datetime.now(tz=UTC).isoformat(),
+            "timestamp": self.alive_at.isoformat(),
             "cycles": self.cycles,
             "total_messages": self.total_messages,
             "failed_messages": self.failed_messages,
             "pause_count": self.pause_count,
-            "queue_count": int(self.queue.attributes["ApproximateNumberOfMessages"]),
-            "queue_count_delayed": int(
-                self.queue.attributes["ApproximateNumberOfMessagesDelayed"]
-            ),
-            "queue_count_not_visible": int(
-                self.queue.attributes["ApproximateNumberOfMessagesNotVisible"]
-            ),
+            "queue_count": self.queue_count,
+            "queue_count_delayed": self.queue_count_delayed,
+            "queue_count_not_visible": self.queue_count_not_visible,
         }
-        with open(self.healthcheck_path, "w", encoding="utf-8") as healthcheck_file:
+        temp_path = f"{self.healthcheck_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as healthcheck_file:
             json.dump(data, healthcheck_file)
+        os.replace(temp_path, self.healthcheck_path)
 
     def pluralize(self, value: int, singular: str, plural: str | None = None) -> str:
         """Returns 's' suffix to make plural, like 's' in tasks"""
@@ -486,9 +918,16 @@ class Command(CommandFromDjangoSettings):
             return f"{value} {plural or (singular + 's')}"
 
 
+class WorkerResult(NamedTuple):
+    """The result of processing a message in a worker process."""
+
+    response: HttpResponse
+    max_rss_kb: int  # Peak memory of the worker process, in kilobytes
+
+
 def run_sns_inbound_logic(
     topic_arn: str, message_type: str, json_body: str
-) -> HttpResponse:
+) -> WorkerResult:
     # Reset any exiting connection, verify it is usable
     with connection.cursor() as cursor:
         cursor.db.queries_log.clear()
@@ -497,4 +936,5 @@ def run_sns_inbound_logic(
 
     result = cast(HttpResponse, _sns_inbound_logic(topic_arn, message_type, json_body))
     connection.close()
-    return result
+    max_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return WorkerResult(response=result, max_rss_kb=max_rss_kb)
@@ -0,0 +1,59 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from emails.mask_statistics import COUNTER_FIELDS, compute_mask_statistics
+from emails.models import MaskStatistics
+
+
+class Command(BaseCommand):
+    help = "Check the MaskStatistics totals against the masks, and fix them"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rebuild",
+            action="store_true",
+            help="Replace the totals that do not match the masks, and add missing rows",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            default=1_000,
+            type=int,
+            help="Number of rows to read at a time",
+        )
+
+    def handle(self, *args, **options):
+        rows = MaskStatistics.objects.select_related("user__profile").order_by("id")
+        checked = 0
+        mismatched = 0
+        for stats in rows.iterator(chunk_size=options["chunk_size"]):
+            checked += 1
+            totals = compute_mask_statistics(stats.user)
+            expected = {field: totals[field] for field in COUNTER_FIELDS}
+            differences = {
+                field: (getattr(stats, field), value)
+                for field, value in expected.items()
+                if getattr(stats, field) != value
+            }
+            if not differences:
+                continue
+            mismatched += 1
+            print(f"User {stats.user_id} totals do not match the masks: {differences}")
+            if options["rebuild"]:
+                MaskStatistics.objects.filter(id=stats.id).update(**expected)
+
+        fixed = " and rebuilt them" if options["rebuild"] and mismatched else ""
+        print(f"Checked {checked} MaskStatistics, found {mismatched} mismatched{fixed}")
+
+        users = User.objects.filter(maskstatistics=None).select_related("profile")
+        missing = 0
+        for user in users.order_by("id").iterator(chunk_size=options["chunk_size"]):
+            missing += 1
+            if options["rebuild"]:
+                totals = compute_mask_statistics(user)
+                MaskStatistics.objects.get_or_create(
+                    user=user,
+                    defaults={field: totals[field] for field in COUNTER_FIELDS},
+                )
+        if missing:
+            added = " and added them" if options["rebuild"] else ""
+            print(f"Found {missing} users without MaskStatistics{added}")
@@ -0,0 +1,129 @@
+"""
+Per-user lifetime totals for the masks, kept up to date by the write-behind flush.
+
+The totals of forwarded, blocked, and replied emails, and of removed trackers,
+are lifetime totals that include the deleted masks. They are summed from every
+mask of the user, plus the num_*_in_deleted_address fields on the Profile, in
+one query. The number of masks is counted in the same query, so the mask limit
+is checked against the masks themselves.
+
+With EMAIL_STATISTICS_WRITE_BEHIND, the MaskStatistics row of a user keeps the
+totals, so they are read from one row, however many masks the user has. The
+flush adds the mask counters to the row with an F() expression, once per user,
+instead of updating it for each email. Deleting a mask adds its counters that
+were not flushed yet, and a new mask adds its counters, which are usually 0.
+Without write-behind, the row is not updated for each email, and not read.
+
+Reading the totals never writes the row. The row is created with the user, and
+a user without a row gets the totals summed from the masks. Run
+rebuild_mask_statistics --rebuild before enabling write-behind, to create the
+missing rows and fix the rows that were not updated. Changes that skip these
+paths, like QuerySet.update() on the masks, are also found and fixed by it.
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any
+
+from django.contrib.auth.models import User
+from django.db.models import Count, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import DomainAddress, MaskStatistics, RelayAddress
+
+if TYPE_CHECKING:
+    from django.db.models.query import QuerySet
+
+# The mask counters that are totaled, with the same names on MaskStatistics
+COUNTER_FIELDS = (
+    "num_forwarded",
+    "num_blocked",
+    "num_replied",
+    "num_level_one_trackers_blocked",
+)
+MASK_COUNT_FIELDS: dict[type[RelayAddress | DomainAddress], str] = {
+    RelayAddress: "num_relay_addresses",
+    DomainAddress: "num_domain_addresses",
+}
+
+
+def get_mask_statistics(user: User) -> dict[str, int]:
+    """Get the mask counts and lifetime totals for the user's masks."""
+    from .counters import write_behind_enabled
+
+    if not write_behind_enabled():
+        return compute_mask_statistics(user)
+    mask_counts = {
+        count_field: Coalesce(
+            Subquery(
+                model.objects.filter(user=OuterRef("user"))
+                .order_by()
+                .values("user")
+                .annotate(count=Count("id"))
+                .values("count")
+            ),
+            0,
+        )
+        for model, count_field in MASK_COUNT_FIELDS.items()
+    }
+    totals: dict[str, int] | None = (
+        MaskStatistics.objects.filter(user=user)
+        .annotate(**mask_counts)
+        .values(*MASK_COUNT_FIELDS.values(), *COUNTER_FIELDS)
+        .first()
+    )
+    if totals is None:
+        totals = compute_mask_statistics(user)
+    return totals
+
+
+def compute_mask_statistics(user: User) -> dict[str, int]:
+    """Sum the totals for the user's masks, with one query on the masks."""
+
+    def totals_query(
+        masks: QuerySet[RelayAddress] | QuerySet[DomainAddress], count_field: str
+    ) -> QuerySet[Any]:
+        return (
+            masks.filter(user=user)
+            .order_by()
+            .values("user_id")
+            .annotate(
+                count_field=Value(count_field),
+                count=Count("id"),
+                **{field: Sum(field, default=0) for field in COUNTER_FIELDS},
+            )
+            .values_list("count_field", "count", *COUNTER_FIELDS)
+        )
+
+    profile = user.profile
+    totals = {count_field: 0 for count_field in MASK_COUNT_FIELDS.values()}
+    totals.update(
+        num_forwarded=profile.num_email_forwarded_in_deleted_address,
+        num_blocked=profile.num_email_blocked_in_deleted_address,
+        num_replied=profile.num_email_replied_in_deleted_address,
+        num_level_one_trackers_blocked=(
+            profile.num_level_one_trackers_blocked_in_deleted_address or 0
+        ),
+    )
+    relay_totals = totals_query(RelayAddress.objects.all(), "num_relay_addresses")
+    domain_totals = totals_query(DomainAddress.objects.all(), "num_domain_addresses")
+    for count_field, count, *counters in relay_totals.union(domain_totals, all=True):
+        totals[count_field] = count
+        for field, amount in zip(COUNTER_FIELDS, counters):
+            totals[field] += amount
+    return totals
+
+
+def update_mask_statistics(user_id: int, changes: dict[str, int]) -> None:
+    """Add changes to the totals for the user's masks, if the row exists."""
+    updates = {field: F(field) + amount for field, amount in changes.items() if amount}
+    if updates:
+        MaskStatistics.objects.filter(user_id=user_id).update(**updates)
+
+
+def record_mask_created(mask: RelayAddress | DomainAddress) -> None:
+    """Add the counters of a new mask to the totals, which are usually 0."""
+    update_mask_statistics(
+        mask.user_id,
+        {field: getattr(mask, field) or 0 for field in COUNTER_FIELDS},
+    )
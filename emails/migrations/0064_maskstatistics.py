@@ -0,0 +1,47 @@
+# Generated by Django 5.2.15 on 2026-10-18 07:26
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("emails", "0063_set_verbose_name_plural"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MaskStatistics",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("num_forwarded", models.PositiveIntegerField(default=0)),
+                ("num_blocked", models.PositiveIntegerField(default=0)),
+                ("num_replied", models.PositiveIntegerField(default=0)),
+                (
+                    "num_level_one_trackers_blocked",
+                    models.PositiveIntegerField(default=0),
+                ),
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "mask statistics",
+            },
+        ),
+    ]
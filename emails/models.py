@@ -14,6 +14,11 @@ from django.core.validators import MinLengthValidator
 from django.db import models, transaction
 from django.db.models.base import ModelBase
 
+from .address_filter import (
+    add_address_hashes,
+    add_new_address,
+    address_filter_enabled,
+)
 from .exceptions import (
     DomainAddrDuplicateException,
     DomainAddrUnavailableException,
@@ -121,6 +126,13 @@ class RelayAddress(models.Model):
         return self.address
 
     def delete(self, *args: Any, **kwargs: Any) -> tuple[int, dict[str, int]]:
+        from .counters import take_pending_counters, write_behind_enabled
+        from .mask_statistics import update_mask_statistics
+
+        pending_counters = take_pending_counters(self) if write_behind_enabled() else {}
+        # Include statistics that are not flushed to the database yet
+        for field, amount in pending_counters.items():
+            setattr(self, field, (getattr(self, field) or 0) + amount)
         # TODO: create hard bounce receipt rule in AWS for the address
         deleted_address = DeletedAddress.objects.create(
             address_hash=address_hash(self.address, domain=self.domain_value),
@@ -143,7 +155,9 @@ class RelayAddress(models.Model):
         profile.num_deleted_relay_addresses += 1
         profile.last_engagement = datetime.now(UTC)
         profile.save()
-        return super().delete(*args, **kwargs)
+        deleted = super().delete(*args, **kwargs)
+        update_mask_statistics(self.user_id, pending_counters)
+        return deleted
 
     def save(
         self,
@@ -154,7 +168,10 @@ class RelayAddress(models.Model):
     ) -> None:
         from privaterelay.models import Profile
 
-        if self._state.adding:
+        from .mask_statistics import record_mask_created
+
+        adding = self._state.adding
+        if adding:
             with transaction.atomic():
                 locked_profile = Profile.objects.select_for_update().get(user=self.user)
                 check_user_can_make_another_address(locked_profile.user)
@@ -181,12 +198,16 @@ class RelayAddress(models.Model):
             self.block_list_emails = False
             if update_fields is not None:
                 update_fields = {"block_list_emails"}.union(update_fields)
+        if adding and address_filter_enabled():
+            add_new_address(address_hash(self.address, domain=self.domain_value))
         super().save(
             force_insert=force_insert,
             force_update=force_update,
             using=using,
             update_fields=update_fields,
         )
+        if adding:
+            record_mask_created(self)
 
     @property
     def domain_value(self) -> str:
@@ -253,7 +274,10 @@ class DomainAddress(models.Model):
         using: str | None = None,
         update_fields: Iterable[str] | None = None,
     ) -> None:
-        if self._state.adding:
+        from .mask_statistics import record_mask_created
+
+        adding = self._state.adding
+        if adding:
             check_user_can_make_domain_address(self.user)
             domain_address_valid = valid_address(
                 self.address, self.domain_value, self.user.profile.subdomain
@@ -301,6 +325,8 @@ class DomainAddress(models.Model):
             using=using,
             update_fields=update_fields,
         )
+        if adding:
+            record_mask_created(self)
 
     @staticmethod
     def make_domain_address(
@@ -325,11 +351,21 @@ class DomainAddress(models.Model):
         return domain_address
 
     def delete(self, *args, **kwargs):
+        from .counters import take_pending_counters, write_behind_enabled
+        from .mask_statistics import update_mask_statistics
+
+        pending_counters = take_pending_counters(self) if write_behind_enabled() else {}
+        # Include statistics that are not flushed to the database yet
+        for field, amount in pending_counters.items():
+            setattr(self, field, (getattr(self, field) or 0) + amount)
         # TODO: create hard bounce receipt rule in AWS for the address
+        deleted_hash = address_hash(
+            self.address, self.user.profile.subdomain, self.domain_value
+        )
+        if address_filter_enabled():
+            add_address_hashes([deleted_hash])
         deleted_address = DeletedAddress.objects.create(
-            address_hash=address_hash(
-                self.address, self.user.profile.subdomain, self.domain_value
-            ),
+            address_hash=deleted_hash,
             num_forwarded=self.num_forwarded,
             num_blocked=self.num_blocked,
             num_replied=self.num_replied,
@@ -349,7 +385,9 @@ class DomainAddress(models.Model):
         profile.num_deleted_domain_addresses += 1
         profile.last_engagement = datetime.now(UTC)
         profile.save()
-        return super().delete(*args, **kwargs)
+        deleted = super().delete(*args, **kwargs)
+        update_mask_statistics(self.user_id, pending_counters)
+        return deleted
 
     @property
     def domain_value(self) -> str:
@@ -371,6 +409,26 @@ class DomainAddress(models.Model):
         return f"D{self.id}"
 
 
+class MaskStatistics(models.Model):
+    """
+    The lifetime totals for a user's masks, including the deleted masks.
+
+    See emails.mask_statistics for how they are kept up to date.
+    """
+
+    user = models.OneToOneField(User, on_delete=models.CASCADE)
+    num_forwarded = models.PositiveIntegerField(default=0)
+    num_blocked = models.PositiveIntegerField(default=0)
+    num_replied = models.PositiveIntegerField(default=0)
+    num_level_one_trackers_blocked = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = "mask statistics"
+
+    def __str__(self):
+        return f"Mask statistics for {self.user}"
+
+
 class Reply(models.Model):
     relay_address = models.ForeignKey(
         RelayAddress, on_delete=models.CASCADE, blank=True, null=True
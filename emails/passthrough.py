@@ -0,0 +1,207 @@
+"""
+Pass the large non-text parts of an email through as the original bytes.
+
+Forwarding an email parses the full MIME tree, and generates it again. For an
+email with large attachments, this holds several copies of each attachment: the
+incoming bytes, the parsed payload, and the generated output.
+
+split_passthrough_parts() finds the bodies of the non-text leaf parts in the
+raw email, and replaces the large ones with short placeholders before parsing.
+The text and HTML bodies, and all the headers, are parsed and converted as
+before. PassthroughEmailMessage.as_bytes() generates the email with the
+placeholders, and then joins the original part bodies back in, with one copy
+of each. The attachment bodies are never decoded.
+
+message_as_bytes() generates any email as bytes for SES, with a generator that
+writes each part body at once, instead of line by line.
+
+Only leaf parts of a multipart message are passed through, and never text/*,
+message/*, or multipart/* parts, which the conversion may read or change. The
+passed through bodies keep their line endings, which the generator would
+otherwise change to the policy's line separator.
+"""
+
+from __future__ import annotations
+
+import re
+from email import message_from_bytes
+from email.generator import BytesGenerator
+from email.message import EmailMessage, Message
+from email.parser import BytesHeaderParser
+from email.policy import Policy
+from io import BytesIO
+from uuid import uuid4
+
+from .policy import relay_policy
+
+# The blank line at the end of the headers
+_HEADERS_END_RE = re.compile(rb"\r?\n\r?\n")
+_KEEP_PARSED_MAINTYPES = ("text", "message", "multipart")
+# Line breaks, as matched by email.generator
+_NEWLINE_RE = re.compile(r"\r\n|\r|\n")
+
+PassthroughParts = dict[bytes, memoryview]
+
+
+class PassthroughEmailMessage(EmailMessage):
+    """An EmailMessage with some part bodies kept as the original bytes."""
+
+    def __init__(self, policy: Policy | None = None) -> None:
+        super().__init__(policy=policy)
+        self.passthrough_parts: PassthroughParts = {}
+        self.passthrough_pattern: re.Pattern[bytes] | None = None
+
+    def as_bytes(self, unixfrom: bool = False, policy: Policy | None = None) -> bytes:
+        generated = super().as_bytes(unixfrom=unixfrom, policy=policy)
+        return self.join_passthrough_parts(generated)
+
+    def join_passthrough_parts(self, generated: bytes) -> bytes:
+        """Replace the placeholders in the generated email with the part bodies."""
+        if self.passthrough_pattern is None:
+            return generated
+        return join_passthrough_parts(
+            generated, self.passthrough_pattern, self.passthrough_parts
+        )
+
+    def as_string(
+        self,
+        unixfrom: bool = False,
+        maxheaderlen: int | None = None,
+        policy: Policy | None = None,
+    ) -> str:
+        return self.as_bytes(unixfrom=unixfrom, policy=policy).decode(
+            "utf-8", "surrogateescape"
+        )
+
+
+class RelayBytesGenerator(BytesGenerator):
+    """A BytesGenerator that writes each part body with one write."""
+
+    def _write_lines(self, lines: str) -> None:
+        # Same output as Generator._write_lines, which writes line by line
+        if not lines:
+            return
+        if self.policy is None:
+            raise ValueError("self.policy must be set by flatten()")
+        self.write(_NEWLINE_RE.sub(self.policy.linesep, lines))
+
+
+def message_as_bytes(message: Message) -> bytes:
+    """
+    Generate an email as bytes, including any passed through part bodies.
+
+    Like Message.as_string(), parsed 8-bit content is encoded for 7-bit transport.
+    """
+    output = BytesIO()
+    policy = message.policy.clone(cte_type="7bit")
+    RelayBytesGenerator(output, mangle_from_=False, policy=policy).flatten(message)
+    generated = output.getvalue()
+    if isinstance(message, PassthroughEmailMessage):
+        return message.join_passthrough_parts(generated)
+    return generated
+
+
+def message_from_bytes_with_passthrough(
+    email_bytes: bytes, min_part_size: int
+) -> PassthroughEmailMessage:
+    """Parse an email, keeping the large non-text part bodies as bytes."""
+    reduced_bytes, pattern, parts = split_passthrough_parts(email_bytes, min_part_size)
+    policy = relay_policy.clone(message_factory=PassthroughEmailMessage)
+    email = message_from_bytes(reduced_bytes, policy=policy)
+    if not isinstance(email, PassthroughEmailMessage):
+        raise TypeError("email must be type PassthroughEmailMessage")
+    if parts:
+        email.passthrough_parts = parts
+        email.passthrough_pattern = pattern
+    return email
+
+
+def split_passthrough_parts(
+    email_bytes: bytes, min_part_size: int
+) -> tuple[bytes, re.Pattern[bytes], PassthroughParts]:
+    """
+    Replace the large non-text part bodies with placeholders.
+
+    Returns the email with placeholders, a pattern that matches the placeholders,
+    and the original part body for each placeholder.
+    """
+    ranges: list[tuple[int, int]] = []
+    _find_passthrough_ranges(email_bytes, 0, len(email_bytes), min_part_size, ranges)
+    prefix = f"relay-passthrough-{uuid4().hex}-".encode()
+    pattern = re.compile(re.escape(prefix) + rb"\d+")
+    if not ranges:
+        return email_bytes, pattern, {}
+
+    data = memoryview(email_bytes)
+    chunks: list[bytes | memoryview] = []
+    parts: PassthroughParts = {}
+    position = 0
+    for number, (start, end) in enumerate(ranges):
+        placeholder = prefix + str(number).encode()
+        chunks.extend((data[position:start], placeholder))
+        parts[placeholder] = data[start:end]
+        position = end
+    chunks.append(data[position:])
+    return b"".join(chunks), pattern, parts
+
+
+def join_passthrough_parts(
+    generated: bytes, pattern: re.Pattern[bytes], parts: PassthroughParts
+) -> bytes:
+    """Replace the placeholders in a generated email with the original bodies."""
+    chunks: list[bytes | memoryview] = []
+    position = 0
+    for match in pattern.finditer(generated):
+        chunks.extend((generated[position : match.start()], parts[match.group()]))
+        position = match.end()
+    chunks.append(generated[position:])
+    return b"".join(chunks)
+
+
+def _find_passthrough_ranges(
+    data: bytes,
+    start: int,
+    end: int,
+    min_part_size: int,
+    ranges: list[tuple[int, int]],
+    in_multipart: bool = False,
+) -> None:
+    """Add the ranges of the part bodies to pass through in data[start:end]."""
+    headers_end = _HEADERS_END_RE.search(data, start, end)
+    if headers_end is None or data.startswith((b"\r\n", b"\n"), start, end):
+        # Parts without headers or a body are kept
+        return
+    headers = BytesHeaderParser().parsebytes(data[start : headers_end.end()])
+    body_start = headers_end.end()
+
+    maintype = headers.get_content_maintype()
+    if maintype != "multipart":
+        if (
+            in_multipart
+            and maintype not in _KEEP_PARSED_MAINTYPES
+            and end - body_start >= min_part_size
+        ):
+            ranges.append((body_start, end))
+        return
+
+    boundary = headers.get_boundary()
+    if not boundary:
+        return
+    delimiter_re = re.compile(
+        rb"(?m)^--"
+        + re.escape(boundary.encode("ascii", "surrogateescape"))
+        + rb"(--)?[ \t]*\r?$"
+    )
+    part_start: int | None = None
+    for delimiter in delimiter_re.finditer(data, body_start, end):
+        if part_start is not None:
+            part_end = delimiter.start()
+            # The line break before the delimiter is part of the delimiter
+            part_end -= 2 if data.startswith(b"\r\n", part_end - 2) else 1
+            _find_passthrough_ranges(
+                data, part_start, part_end, min_part_size, ranges, True
+            )
+        if delimiter.group(1):
+            # The close delimiter
+            return
+        part_start = delimiter.end() + 1
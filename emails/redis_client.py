@@ -0,0 +1,16 @@
+"""The Redis connection shared by the email buffers and the address filter."""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from redis import Redis
+
+
+def get_redis() -> Redis:
+    """Get the Redis connection of the default cache."""
+    from django_redis import get_redis_connection
+
+    connection: Redis = get_redis_connection("default")
+    return connection
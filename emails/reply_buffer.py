@@ -0,0 +1,146 @@
+"""
+Write-behind buffer for the Reply records of forwarded emails.
+
+After an email is forwarded, a Reply record is stored so that replies can be
+sent back to the sender. With REPLY_RECORD_WRITE_BEHIND, the encrypted record
+is added to a Redis list instead of inserting a row for each email.
+flush_reply_records() moves the buffered records to the database in batches,
+with bulk_create.
+
+Workers add records to the tail of the list. A flush reads a batch from the
+head, inserts it, and then removes it from the list. If a flush stops after the
+insert and before the removal, the next flush reads the same batch again. The
+encrypted metadata has a random nonce, so a record that is already in the
+database is found by its lookup and encrypted metadata, and is not inserted
+twice. Records for masks deleted before the flush are dropped. The flush lock
+timeout is reset for each batch. If the lock expired anyway, another flush may
+be reading the same batch, so the flush stops.
+
+A reply to a forwarded email is only found after its record is flushed, so the
+flush interval should be short compared to the time it takes to reply.
+process_emails_from_sqs flushes on a timer, and the SNS endpoint calls
+flush_reply_records_if_due().
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+from contextlib import suppress
+from typing import Any
+
+from django.conf import settings
+from django.db import transaction
+
+from redis.exceptions import LockNotOwnedError
+
+from .models import DomainAddress, RelayAddress, Reply
+from .redis_client import get_redis
+
+logger = logging.getLogger("events")
+
+REPLY_RECORDS_KEY = "reply_records"
+FLUSH_LOCK_KEY = "reply_records:flush_lock"
+FLUSH_LOCK_TIMEOUT = 300
+FLUSH_DUE_KEY = "reply_records:flush_due"
+
+
+def reply_write_behind_enabled() -> bool:
+    return bool(settings.REPLY_RECORD_WRITE_BEHIND)
+
+
+def buffer_reply_record(
+    lookup: str, encrypted_metadata: str, address: RelayAddress | DomainAddress
+) -> None:
+    """Add a Reply record to the buffer."""
+    record: dict[str, Any] = {
+        "lookup": lookup,
+        "encrypted_metadata": encrypted_metadata,
+    }
+    if isinstance(address, DomainAddress):
+        record["domain_address_id"] = address.id
+    else:
+        record["relay_address_id"] = address.id
+    get_redis().rpush(REPLY_RECORDS_KEY, json.dumps(record))
+
+
+def flush_reply_records(batch_size: int | None = None) -> int:
+    """
+    Write the buffered Reply records to the database.
+
+    Returns the number of records created. If another process is flushing, this
+    returns 0 without waiting.
+    """
+    batch_size = batch_size or settings.REPLY_RECORD_FLUSH_BATCH_SIZE
+    redis = get_redis()
+    lock = redis.lock(FLUSH_LOCK_KEY, timeout=FLUSH_LOCK_TIMEOUT)
+    if not lock.acquire(blocking=False):
+        return 0
+    created = 0
+    try:
+        while batch := redis.lrange(REPLY_RECORDS_KEY, 0, batch_size - 1):
+            # Raises LockNotOwnedError if the lock expired
+            lock.reacquire()
+            created += _create_replies(batch)
+            redis.ltrim(REPLY_RECORDS_KEY, len(batch), -1)
+    except LockNotOwnedError:
+        logger.warning("reply_records_flush_lock_lost", extra={"num_created": created})
+    finally:
+        with suppress(LockNotOwnedError):
+            lock.release()
+    return created
+
+
+def flush_reply_records_if_due() -> int:
+    """
+    Write the buffered Reply records, if no process did in the flush interval.
+
+    This is for the web workers that process emails from the SNS endpoint.
+    Returns the number of records created.
+    """
+    due = get_redis().set(
+        FLUSH_DUE_KEY,
+        1,
+        nx=True,
+        ex=settings.PROCESS_EMAIL_STATISTICS_FLUSH_INTERVAL,
+    )
+    if not due:
+        return 0
+    return flush_reply_records()
+
+
+def _create_replies(batch: list[bytes | str]) -> int:
+    records = [json.loads(raw_record) for raw_record in batch]
+    relay_address_ids = set(
+        RelayAddress.objects.filter(
+            id__in=[r["relay_address_id"] for r in records if "relay_address_id" in r]
+        ).values_list("id", flat=True)
+    )
+    domain_address_ids = set(
+        DomainAddress.objects.filter(
+            id__in=[r["domain_address_id"] for r in records if "domain_address_id" in r]
+        ).values_list("id", flat=True)
+    )
+    replies = [
+        Reply(**record)
+        for record in records
+        if record.get("relay_address_id") in relay_address_ids
+        or record.get("domain_address_id") in domain_address_ids
+    ]
+    if len(replies) < len(records):
+        logger.info(
+            "reply_records_dropped", extra={"count": len(records) - len(replies)}
+        )
+    with transaction.atomic():
+        # Skip the records inserted by a flush that stopped before the removal
+        existing = set(
+            Reply.objects.filter(
+                lookup__in={reply.lookup for reply in replies}
+            ).values_list("lookup", "encrypted_metadata")
+        )
+        new_replies = [
+            reply
+            for reply in replies
+            if (reply.lookup, reply.encrypted_metadata) not in existing
+        ]
+        return len(Reply.objects.bulk_create(new_replies))
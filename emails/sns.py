@@ -3,11 +3,13 @@
 
 import base64
 import logging
+import threading
+from functools import lru_cache
 from typing import Any
 from urllib.request import urlopen
 
 from django.conf import settings
-from django.core.cache import caches
+from django.core.cache import BaseCache, caches
 from django.core.exceptions import SuspiciousOperation
 
 from cryptography import x509
@@ -67,6 +69,10 @@ SUPPORTED_SNS_TYPES = [
     "Notification",
 ]
 
+# The SigningCertURLs that have been downloaded, to prefetch when a process starts
+KNOWN_CERT_URLS_CACHE_KEY = "sns_signing_cert_urls"
+KNOWN_CERT_URLS_MAX = 16
+
 
 class VerificationFailed(ValueError):
     pass
@@ -111,6 +117,35 @@ def _get_hash_format(json_body: dict[str, Any]) -> str:
     return SUBSCRIPTION_HASH_FORMAT
 
 
+def prefetch_signing_public_keys() -> threading.Thread:
+    """
+    Load the public keys of the known signing certificates in a background thread.
+
+    This avoids downloading and parsing a certificate when the first messages are
+    verified. Errors are logged, and the key is loaded again when it is needed.
+    """
+
+    def prefetch() -> None:
+        for cert_url in _key_cache().get(KNOWN_CERT_URLS_CACHE_KEY, []):
+            try:
+                _get_signing_public_key(cert_url)
+            except Exception as e:
+                logger.warning(
+                    "sns_signing_key_prefetch_failed",
+                    extra={"cert_url": cert_url, "error": repr(e)},
+                )
+
+    thread = threading.Thread(
+        target=prefetch, name="sns_signing_key_prefetch", daemon=True
+    )
+    thread.start()
+    return thread
+
+
+def _key_cache() -> BaseCache:
+    return caches[getattr(settings, "AWS_SNS_KEY_CACHE", "default")]
+
+
 def _get_signing_public_key(cert_url: str) -> rsa.RSAPublicKey:
     """
     Download the signing certificate and return the public key.
@@ -122,8 +157,18 @@ def _get_signing_public_key(cert_url: str) -> rsa.RSAPublicKey:
         raise SuspiciousOperation(
             f'SNS SigningCertURL "{cert_url}" did not start with "{cert_url_origin}"'
         )
+    return _load_signing_public_key(cert_url)
+
 
-    key_cache = caches[getattr(settings, "AWS_SNS_KEY_CACHE", "default")]
+@lru_cache(maxsize=KNOWN_CERT_URLS_MAX)
+def _load_signing_public_key(cert_url: str) -> rsa.RSAPublicKey:
+    """
+    Load the public key from the shared cache, or download the certificate.
+
+    The certificate at a SigningCertURL does not change, so the parsed key is also
+    kept in the process. Failures raise an exception, and are not kept.
+    """
+    key_cache = _key_cache()
     cache_key = f"{cert_url}:public_key"
     public_pem = key_cache.get(cache_key)
 
@@ -155,4 +200,8 @@ def _get_signing_public_key(cert_url: str) -> rsa.RSAPublicKey:
 
     if set_cache:
         key_cache.set(cache_key, public_pem)
+        known_urls = key_cache.get(KNOWN_CERT_URLS_CACHE_KEY, [])
+        if cert_url not in known_urls:
+            known_urls = [*known_urls, cert_url][-KNOWN_CERT_URLS_MAX:]
+            key_cache.set(KNOWN_CERT_URLS_CACHE_KEY, known_urls, timeout=None)
     return cert_pubkey
@@ -0,0 +1,180 @@
+"""Tests for emails/address_filter.py"""
+
+from collections.abc import Iterator
+from typing import Any
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test import override_settings
+
+import pytest
+from model_bakery import baker
+from pytest_django import DjangoAssertNumQueries
+
+from privaterelay.tests.utils import make_free_test_user, make_premium_test_user
+
+from ..address_filter import build_address_filter, might_be_used
+from ..models import DeletedAddress, DomainAddress, RelayAddress, address_hash
+from ..validators import valid_address
+from ..views import _get_address
+
+
+class FakePipeline:
+    def __init__(self, redis: "FakeRedis") -> None:
+        self.redis = redis
+        self.commands: list[tuple[str, tuple[Any, ...]]] = []
+
+    def __getattr__(self, name: str) -> Any:
+        def queue_command(*args: Any) -> None:
+            self.commands.append((name, args))
+
+        return queue_command
+
+    def execute(self) -> list[Any]:
+        return [getattr(self.redis, name)(*args) for name, args in self.commands]
+
+
+class FakeRedis:
+    """The parts of redis.Redis used by emails.address_filter"""
+
+    def __init__(self) -> None:
+        self.bitmaps: dict[str, set[int]] = {}
+
+    def pipeline(self, transaction: bool = True) -> FakePipeline:
+        return FakePipeline(self)
+
+    def setbit(self, name: str, offset: int, value: int) -> int:
+        bits = self.bitmaps.setdefault(name, set())
+        old = int(offset in bits)
+        if value:
+            bits.add(offset)
+        else:
+            bits.discard(offset)
+        return old
+
+    def getbit(self, name: str, offset: int) -> int:
+        return int(offset in self.bitmaps.get(name, set()))
+
+
+@pytest.fixture()
+def fake_redis() -> Iterator[FakeRedis]:
+    redis = FakeRedis()
+    cache.clear()
+    with (
+        patch("emails.address_filter.get_redis", return_value=redis),
+        override_settings(ADDRESS_FILTER_ENABLED=True, ADDRESS_FILTER_BITS=2**16),
+    ):
+        yield redis
+    cache.clear()
+
+
+@pytest.fixture()
+def relay_address(fake_redis: FakeRedis, db: None) -> RelayAddress:
+    user = make_free_test_user()
+    address: RelayAddress = baker.make(RelayAddress, user=user, address="filtered")
+    return address
+
+
+def test_filter_not_built_might_be_used(fake_redis: FakeRedis) -> None:
+    assert might_be_used(address_hash("unknown", domain="test.com"))
+
+
+def test_build_address_filter(fake_redis: FakeRedis, db: None) -> None:
+    user = make_free_test_user()
+    with override_settings(ADDRESS_FILTER_ENABLED=False):
+        baker.make(RelayAddress, user=user, address="existing")
+    deleted_hash = address_hash("deleted", domain="test.com")
+    baker.make(DeletedAddress, address_hash=deleted_hash)
+
+    assert build_address_filter(chunk_size=1) == 2
+    assert might_be_used(address_hash("existing", domain="test.com"))
+    assert might_be_used(deleted_hash)
+    assert not might_be_used(address_hash("unknown", domain="test.com"))
+
+
+def test_new_address_added_to_built_filter(
+    fake_redis: FakeRedis, relay_address: RelayAddress
+) -> None:
+    build_address_filter()
+    new_address = baker.make(RelayAddress, user=relay_address.user, address="new")
+    assert might_be_used(address_hash(new_address.address, domain="test.com"))
+
+
+def test_get_address_unknown_without_queries(
+    fake_redis: FakeRedis,
+    relay_address: RelayAddress,
+    django_assert_num_queries: DjangoAssertNumQueries,
+) -> None:
+    build_address_filter()
+    with django_assert_num_queries(0), pytest.raises(RelayAddress.DoesNotExist):
+        _get_address("unknown@test.com")
+    assert _get_address("filtered@test.com") == relay_address
+
+
+def test_get_address_deleted_cached(
+    fake_redis: FakeRedis,
+    relay_address: RelayAddress,
+    django_assert_num_queries: DjangoAssertNumQueries,
+) -> None:
+    build_address_filter()
+    relay_address.delete()
+    with django_assert_num_queries(2), pytest.raises(RelayAddress.DoesNotExist):
+        _get_address("filtered@test.com")
+    with django_assert_num_queries(0), pytest.raises(RelayAddress.DoesNotExist):
+        _get_address("filtered@test.com")
+
+
+def test_new_address_forgets_missing_address(
+    fake_redis: FakeRedis,
+    relay_address: RelayAddress,
+    django_capture_on_commit_callbacks: Any,
+) -> None:
+    # The filter is not built, so the miss is found in the database
+    with pytest.raises(RelayAddress.DoesNotExist):
+        _get_address("later@test.com")
+    missing_key = f"missing_address:{address_hash('later', domain='test.com')}"
+    with django_capture_on_commit_callbacks(execute=True):
+        later = baker.make(RelayAddress, user=relay_address.user, address="later")
+        # Until the mask is committed, the address is still missing
+        assert cache.get(missing_key) == "unknown"
+    assert cache.get(missing_key) is None
+    assert _get_address("later@test.com") == later
+
+
+def test_valid_address_skips_query_for_unused_address(
+    fake_redis: FakeRedis,
+    relay_address: RelayAddress,
+    django_assert_num_queries: DjangoAssertNumQueries,
+) -> None:
+    build_address_filter()
+    with django_assert_num_queries(0):
+        assert valid_address("unused", "test.com")
+
+
+def test_valid_address_rejects_deleted_domain_address(
+    fake_redis: FakeRedis, db: None
+) -> None:
+    build_address_filter()
+    user = make_premium_test_user()
+    user.profile.subdomain = "filtered"
+    user.profile.save()
+    domain_address = DomainAddress.make_domain_address(user, "deleted")
+    domain_address.delete()
+    assert not valid_address("deleted", "test.com", "filtered")
+
+
+def test_build_address_filter_command(
+    fake_redis: FakeRedis,
+    relay_address: RelayAddress,
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    call_command("build_address_filter")
+    assert capsys.readouterr().out == "Added 1 address hashes to the address filter\n"
+    assert not might_be_used(address_hash("unknown", domain="test.com"))
+
+
+@override_settings(ADDRESS_FILTER_ENABLED=False)
+def test_build_address_filter_command_disabled() -> None:
+    with pytest.raises(CommandError, match="ADDRESS_FILTER_ENABLED is not set"):
+        call_command("build_address_filter")
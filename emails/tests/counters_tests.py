@@ -0,0 +1,386 @@
+"""Tests for emails/counters.py"""
+
+from collections.abc import Iterator
+from datetime import UTC, datetime, timedelta
+from typing import Any
+from unittest.mock import patch
+
+from django.test import override_settings
+
+import pytest
+from model_bakery import baker
+from redis.exceptions import LockError, ResponseError
+
+from privaterelay.tests.utils import make_free_test_user
+
+from ..counters import (
+    DEAD_LETTER_KEY,
+    FLUSH_MAX_ATTEMPTS,
+    FLUSHING_KEY,
+    STATISTICS_KEY,
+    flush_statistics,
+    flush_statistics_if_due,
+    record_statistics,
+)
+from ..models import DeletedAddress, MaskStatistics, RelayAddress
+from ..views import _flush_buffers_if_due, _record_forwarded_email
+
+
+class FakeLock:
+    def __init__(self, redis: "FakeRedis", name: str) -> None:
+        self.redis = redis
+        self.name = name
+
+    def acquire(self, blocking: bool = True) -> bool:
+        if self.name in self.redis.locks:
+            return False
+        self.redis.locks.add(self.name)
+        return True
+
+    def release(self) -> None:
+        self.redis.locks.remove(self.name)
+
+    def __enter__(self) -> "FakeLock":
+        if not self.acquire():
+            raise LockError("Unable to acquire lock")
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.release()
+
+
+class FakePipeline:
+    def __init__(self, redis: "FakeRedis") -> None:
+        self.redis = redis
+        self.commands: list[tuple[str, tuple[Any, ...]]] = []
+
+    def __getattr__(self, name: str) -> Any:
+        def queue_command(*args: Any) -> None:
+            self.commands.append((name, args))
+
+        return queue_command
+
+    def execute(self) -> list[Any]:
+        return [getattr(self.redis, name)(*args) for name, args in self.commands]
+
+
+class FakeRedis:
+    """The parts of redis.Redis used by emails.counters"""
+
+    def __init__(self) -> None:
+        self.hashes: dict[str, dict[bytes, bytes]] = {}
+        self.locks: set[str] = set()
+        self.values: dict[str, int] = {}
+
+    def pipeline(self, transaction: bool = True) -> FakePipeline:
+        return FakePipeline(self)
+
+    def lock(
+        self,
+        name: str,
+        timeout: float | None = None,
+        blocking_timeout: float | None = None,
+    ) -> FakeLock:
+        return FakeLock(self, name)
+
+    def set(self, name: str, value: int, nx: bool = False, ex: int = 0) -> bool:
+        if nx and name in self.values:
+            return False
+        self.values[name] = value
+        return True
+
+    def hincrby(self, name: str, key: str, amount: int = 1) -> int:
+        hash_ = self.hashes.setdefault(name, {})
+        value = int(hash_.get(key.encode(), 0)) + amount
+        hash_[key.encode()] = str(value).encode()
+        return value
+
+    def hset(self, name: str, key: str, value: float) -> int:
+        self.hashes.setdefault(name, {})[key.encode()] = str(value).encode()
+        return 1
+
+    def hmget(self, name: str, keys: list[str]) -> list[bytes | None]:
+        hash_ = self.hashes.get(name, {})
+        return [hash_.get(key.encode()) for key in keys]
+
+    def hdel(self, name: str, *keys: str) -> int:
+        hash_ = self.hashes.get(name, {})
+        deleted = len(
+            [hash_.pop(key.encode()) for key in keys if key.encode() in hash_]
+        )
+        if name in self.hashes and not hash_:
+            del self.hashes[name]
+        return deleted
+
+    def hgetall(self, name: str) -> dict[bytes, bytes]:
+        return dict(self.hashes.get(name, {}))
+
+    def exists(self, name: str) -> int:
+        return int(bool(self.hashes.get(name)))
+
+    def rename(self, src: str, dst: str) -> bool:
+        if src not in self.hashes:
+            raise ResponseError("no such key")
+        self.hashes[dst] = self.hashes.pop(src)
+        return True
+
+    def incr(self, name: str) -> int:
+        self.values[name] = self.values.get(name, 0) + 1
+        return self.values[name]
+
+    def delete(self, *names: str) -> int:
+        return sum(
+            int(
+                self.hashes.pop(name, None) is not None
+                or self.values.pop(name, None) is not None
+            )
+            for name in names
+        )
+
+
+@pytest.fixture()
+def fake_redis() -> Iterator[FakeRedis]:
+    redis = FakeRedis()
+    with (
+        patch("emails.counters.get_redis", return_value=redis),
+        override_settings(EMAIL_STATISTICS_WRITE_BEHIND=True),
+    ):
+        yield redis
+
+
+@pytest.fixture()
+def relay_address(db: None) -> RelayAddress:
+    user = make_free_test_user()
+    address: RelayAddress = baker.make(RelayAddress, user=user, address="counted")
+    return address
+
+
+def test_flush_statistics_applies_buffered_counters(
+    fake_redis: FakeRedis, relay_address: RelayAddress
+) -> None:
+    relay_address.num_forwarded = 5
+    relay_address.save()
+    used_at = datetime.now(UTC) + timedelta(hours=1)
+    engaged_at = datetime.now(UTC) + timedelta(hours=2)
+    for _ in range(3):
+        record_statistics(
+            relay_address,
+            {"num_forwarded": 1, "num_level_one_trackers_blocked": 2},
+            ["last_used_at"],
+            now=used_at,
+        )
+    profile = relay_address.user.profile
+    record_statistics(profile, timestamps=["last_engagement"], now=engaged_at)
+
+    # Nothing is written until the flush
+    relay_address.refresh_from_db()
+    assert relay_address.num_forwarded == 5
+
+    assert flush_statistics() == 2
+    relay_address.refresh_from_db()
+    assert relay_address.num_forwarded == 8
+    assert relay_address.num_level_one_trackers_blocked == 6
+    assert relay_address.last_used_at == used_at
+    profile.refresh_from_db()
+    assert profile.last_engagement == engaged_at
+    assert fake_redis.hashes == {}
+
+
+def test_flush_statistics_updates_mask_statistics(
+    fake_redis: FakeRedis, relay_address: RelayAddress
+) -> None:
+    user = relay_address.user
+    other_address = baker.make(RelayAddress, user=user, address="other")
+    record_statistics(relay_address, {"num_forwarded": 2, "num_blocked": 1})
+    record_statistics(other_address, {"num_forwarded": 3})
+    record_statistics(user.profile, timestamps=["last_engagement"])
+
+    assert flush_statistics() == 3
+    stats = MaskStatistics.objects.get(user=user)
+    assert stats.num_forwarded == 5
+    assert stats.num_blocked == 1
+
+
+def test_flush_statistics_keeps_later_timestamp(
+    fake_redis: FakeRedis, relay_address: RelayAddress
+) -> None:
+    later = datetime.now(UTC) + timedelta(days=1)
+    relay_address.last_used_at = later
+    relay_address.save()
+    record_statistics(relay_address, timestamps=["last_used_at"])
+    assert flush_statistics() == 1
+    relay_address.refresh_from_db()
+    assert relay_address.last_used_at == later
+
+
+def test_flush_statistics_locked_does_nothing(
+    fake_redis: FakeRedis, relay_address: RelayAddress
+) -> None:
+    record_statistics(relay_address, {"num_blocked": 1})
+    fake_redis.locks.add("email_statistics:flush_lock")
+    assert flush_statistics() == 0
+    assert STATISTICS_KEY in fake_redis.hashes
+
+
+def test_flush_statistics_retries_failed_flush(
+    fake_redis: FakeRedis, relay_address: RelayAddress
+) -> None:
+    record_statistics(relay_address, {"num_blocked": 1})
+    fake_redis.rename(STATISTICS_KEY, FLUSHING_KEY)
+    record_statistics(relay_address, {"num_blocked": 2})
+
+    assert flush_statistics() == 1
+    relay_address.refresh_from_db()
+    assert relay_address.num_blocked == 1
+    assert flush_statistics() == 1
+    relay_address.refresh_from_db()
+    assert relay_address.num_blocked == 3
+
+
+def test_flush_statistics_not_written_twice(
+    fake_redis: FakeRedis, relay_address: RelayAddress
+) -> None:
+    """If the buffer is not deleted, the updates are rolled back and retried."""
+    record_statistics(relay_address, {"num_blocked": 1})
+    with (
+        patch.object(fake_redis, "delete", side_effect=ConnectionError("lost")),
+        pytest.raises(ConnectionError),
+    ):
+        flush_statistics()
+    relay_address.refresh_from_db()
+    assert relay_address.num_blocked == 0
+    assert FLUSHING_KEY in fake_redis.hashes
+
+    assert flush_statistics() == 1
+    relay_address.refresh_from_db()
+    assert relay_address.num_blocked == 1
+    assert fake_redis.hashes == {}
+
+
+def test_flush_statistics_skips_invalid_entries(
+    fake_redis: FakeRedis,
+    relay_address: RelayAddress,
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    record_statistics(relay_address, {"num_blocked": 1})
+    fake_redis.hashes[STATISTICS_KEY].update(
+        {
+            b"no-colons": b"1",
+            b"relayaddress:not-a-pk:num_blocked": b"1",
+            f"relayaddress:{relay_address.id}:num_forwarded".encode(): b"many",
+            f"relayaddress:{relay_address.id}:last_used_at".encode(): b"1e300",
+        }
+    )
+    assert flush_statistics() == 1
+    relay_address.refresh_from_db()
+    assert relay_address.num_blocked == 1
+    assert relay_address.num_forwarded == 0
+    assert relay_address.last_used_at is None
+    assert fake_redis.hashes == {}
+    assert [record.msg for record in caplog.records] == [
+        "email_statistics_bad_key",
+        "email_statistics_bad_key",
+        "email_statistics_bad_value",
+        "email_statistics_bad_value",
+    ]
+
+
+def test_flush_statistics_dead_letter_after_failures(
+    fake_redis: FakeRedis,
+    relay_address: RelayAddress,
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    record_statistics(relay_address, {"num_blocked": 1})
+    with patch(
+        "emails.counters._apply_statistics", side_effect=RuntimeError("bad data")
+    ):
+        for _ in range(FLUSH_MAX_ATTEMPTS):
+            record_statistics(relay_address, {"num_forwarded": 1})
+            with pytest.raises(RuntimeError):
+                flush_statistics()
+    assert FLUSHING_KEY not in fake_redis.hashes
+    [dead_letter_key] = fake_redis.hashes.keys() - {STATISTICS_KEY}
+    assert dead_letter_key.startswith(f"{DEAD_LETTER_KEY}:")
+    assert caplog.records[-1].msg == "email_statistics_dead_letter"
+
+    # The updates after the first failure are still flushed
+    assert flush_statistics() == 1
+    relay_address.refresh_from_db()
+    assert relay_address.num_forwarded == FLUSH_MAX_ATTEMPTS - 1
+    assert relay_address.num_blocked == 0
+    assert fake_redis.values == {}
+
+
+def test_flush_statistics_if_due(
+    fake_redis: FakeRedis, relay_address: RelayAddress
+) -> None:
+    record_statistics(relay_address, {"num_blocked": 1})
+    assert flush_statistics_if_due() == 1
+    record_statistics(relay_address, {"num_blocked": 1})
+    assert flush_statistics_if_due() == 0
+    relay_address.refresh_from_db()
+    assert relay_address.num_blocked == 1
+
+
+def test_flush_buffers_if_due_error_is_logged(
+    fake_redis: FakeRedis, caplog: pytest.LogCaptureFixture
+) -> None:
+    with patch(
+        "emails.views.flush_statistics_if_due", side_effect=ValueError("oops")
+    ) as mock_flush:
+        _flush_buffers_if_due()
+    mock_flush.assert_called_once_with()
+    assert caplog.records[-1].msg == "Unable to flush email statistics"
+
+
+def test_flush_statistics_drops_deleted_rows(fake_redis: FakeRedis, db: None) -> None:
+    user = make_free_test_user()
+    address = baker.make(RelayAddress, user=user)
+    record_statistics(address, {"num_forwarded": 1})
+    RelayAddress.objects.filter(id=address.id).delete()
+    assert flush_statistics() == 0
+    assert fake_redis.hashes == {}
+
+
+def test_record_forwarded_email_write_behind(
+    fake_redis: FakeRedis, relay_address: RelayAddress
+) -> None:
+    profile = relay_address.user.profile
+    _record_forwarded_email(relay_address, profile, 0)
+    relay_address.refresh_from_db()
+    assert relay_address.num_forwarded == 0
+    assert fake_redis.hincrby(
+        STATISTICS_KEY, f"relayaddress:{relay_address.id}:num_forwarded", 0
+    )
+    assert flush_statistics() == 2
+    relay_address.refresh_from_db()
+    assert relay_address.num_forwarded == 1
+    assert relay_address.num_level_one_trackers_blocked == 0
+    assert relay_address.last_used_at is not None
+
+
+def test_delete_includes_pending_counters(
+    fake_redis: FakeRedis, relay_address: RelayAddress
+) -> None:
+    record_statistics(relay_address, {"num_forwarded": 2, "num_blocked": 1})
+    relay_address.delete()
+    deleted = DeletedAddress.objects.get()
+    assert deleted.num_forwarded == 2
+    assert deleted.num_blocked == 1
+    profile = relay_address.user.profile
+    profile.refresh_from_db()
+    assert profile.num_email_forwarded_in_deleted_address == 2
+    assert fake_redis.hashes == {}
+
+
+def test_delete_includes_counters_of_failed_flush(
+    fake_redis: FakeRedis, relay_address: RelayAddress
+) -> None:
+    record_statistics(relay_address, {"num_forwarded": 2})
+    fake_redis.rename(STATISTICS_KEY, FLUSHING_KEY)
+    record_statistics(relay_address, {"num_forwarded": 1, "num_blocked": 1})
+    relay_address.delete()
+    deleted = DeletedAddress.objects.get()
+    assert deleted.num_forwarded == 3
+    assert deleted.num_blocked == 1
+    assert fake_redis.hashes == {}
@@ -0,0 +1,160 @@
+"""Tests for emails/mask_statistics.py"""
+
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+
+import pytest
+from model_bakery import baker
+from pytest_django.fixtures import DjangoAssertNumQueries
+
+from privaterelay.tests.utils import make_premium_test_user
+
+from ..mask_statistics import (
+    COUNTER_FIELDS,
+    compute_mask_statistics,
+    get_mask_statistics,
+)
+from ..models import DomainAddress, MaskStatistics, RelayAddress, Reply
+from ..views import _record_blocked_email, _record_forwarded_email
+
+
+@pytest.fixture()
+def user(db: None) -> User:
+    user = make_premium_test_user()
+    user.profile.subdomain = "stats"
+    user.profile.save()
+    return user
+
+
+def _totals(user: User) -> dict[str, int]:
+    stats = MaskStatistics.objects.get(user=user)
+    return {field: getattr(stats, field) for field in COUNTER_FIELDS}
+
+
+def _expected_totals(user: User) -> dict[str, int]:
+    totals = compute_mask_statistics(user)
+    return {field: totals[field] for field in COUNTER_FIELDS}
+
+
+def test_new_user_has_totals(user: User) -> None:
+    assert _totals(user) == dict.fromkeys(COUNTER_FIELDS, 0)
+
+
+@override_settings(EMAIL_STATISTICS_WRITE_BEHIND=True)
+def test_get_mask_statistics_without_row(user: User) -> None:
+    profile = user.profile
+    profile.num_email_forwarded_in_deleted_address = 1
+    profile.num_level_one_trackers_blocked_in_deleted_address = None
+    profile.save()
+    baker.make(RelayAddress, user=user, num_forwarded=2, num_blocked=3, _quantity=2)
+    baker.make(DomainAddress, user=user, address="built", num_replied=4)
+    # A user from before the MaskStatistics table
+    MaskStatistics.objects.filter(user=user).delete()
+
+    assert get_mask_statistics(user) == {
+        "num_relay_addresses": 2,
+        "num_domain_addresses": 1,
+        "num_forwarded": 5,
+        "num_blocked": 6,
+        "num_replied": 4,
+        "num_level_one_trackers_blocked": 0,
+    }
+    assert not MaskStatistics.objects.filter(user=user).exists()
+
+
+def test_get_mask_statistics_without_write_behind_skips_row(user: User) -> None:
+    baker.make(RelayAddress, user=user, num_forwarded=2)
+    MaskStatistics.objects.filter(user=user).update(num_forwarded=100)
+    stats = get_mask_statistics(user)
+    assert stats["num_relay_addresses"] == 1
+    assert stats["num_forwarded"] == 2
+
+
+@override_settings(EMAIL_STATISTICS_WRITE_BEHIND=True)
+def test_get_mask_statistics_one_query(
+    user: User, django_assert_num_queries: DjangoAssertNumQueries
+) -> None:
+    baker.make(RelayAddress, user=user, num_forwarded=2, _quantity=3)
+    with django_assert_num_queries(1):
+        stats = get_mask_statistics(user)
+    assert stats["num_relay_addresses"] == 3
+    assert stats["num_forwarded"] == 6
+
+
+@override_settings(EMAIL_STATISTICS_WRITE_BEHIND=True)
+def test_mask_counts_are_read_from_the_masks(user: User) -> None:
+    baker.make(RelayAddress, user=user, num_forwarded=2, _quantity=2)
+    # Deleted without RelayAddress.delete(), as in the CASCADE of a deleted user
+    RelayAddress.objects.filter(user=user).delete()
+    stats = get_mask_statistics(user)
+    assert stats["num_relay_addresses"] == 0
+    assert stats["num_forwarded"] == 4
+
+
+def test_new_mask_counters_update_totals(user: User) -> None:
+    baker.make(RelayAddress, user=user, num_blocked=1)
+    DomainAddress.make_domain_address(user, "counted")
+    assert _totals(user) == _expected_totals(user)
+    assert _totals(user)["num_blocked"] == 1
+
+
+def test_email_counters_do_not_update_totals(user: User) -> None:
+    relay_address = baker.make(RelayAddress, user=user)
+    domain_address = DomainAddress.make_domain_address(user, "counted")
+    reply = baker.make(Reply, domain_address=domain_address)
+
+    # Without write-behind, the emails are counted on the masks only
+    with CaptureQueriesContext(connection) as queries:
+        _record_forwarded_email(relay_address, user.profile, 5)
+        _record_forwarded_email(domain_address, user.profile, 0)
+        _record_blocked_email(relay_address, user.profile)
+        Reply.objects.select_related("domain_address").get(
+            id=reply.id
+        ).increment_num_replied()
+    assert not [query for query in queries if "emails_maskstatistics" in query["sql"]]
+
+    stats = get_mask_statistics(user)
+    assert {field: stats[field] for field in COUNTER_FIELDS} == {
+        "num_forwarded": 2,
+        "num_blocked": 1,
+        "num_replied": 1,
+        "num_level_one_trackers_blocked": 5,
+    }
+
+
+def test_mask_save_does_not_update_totals(user: User) -> None:
+    relay_address = baker.make(RelayAddress, user=user)
+    relay_address.description = "Only the description is changed"
+    with CaptureQueriesContext(connection) as queries:
+        relay_address.save()
+    assert not [query for query in queries if "emails_maskstatistics" in query["sql"]]
+
+
+def test_delete_keeps_lifetime_totals(user: User) -> None:
+    relay_address = baker.make(RelayAddress, user=user, num_forwarded=2)
+    domain_address = baker.make(DomainAddress, user=user, address="gone", num_blocked=3)
+
+    relay_address.delete()
+    domain_address.delete()
+
+    stats = get_mask_statistics(user)
+    assert stats["num_relay_addresses"] == 0
+    assert stats["num_domain_addresses"] == 0
+    assert stats["num_forwarded"] == 2
+    assert stats["num_blocked"] == 3
+    assert _totals(user) == _expected_totals(user)
+
+
+@override_settings(EMAIL_STATISTICS_WRITE_BEHIND=True)
+def test_delete_adds_pending_counters(user: User) -> None:
+    relay_address = baker.make(RelayAddress, user=user, num_forwarded=2)
+    with patch(
+        "emails.counters.take_pending_counters", return_value={"num_forwarded": 4}
+    ):
+        relay_address.delete()
+    assert _totals(user)["num_forwarded"] == 6
+    assert _totals(user) == _expected_totals(user)
@@ -0,0 +1,91 @@
+from datetime import date, timedelta
+from unittest.mock import call, patch
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+import pytest
+from model_bakery import baker
+
+from emails.models import RelayAddress, Reply
+
+COMMAND_NAME = "delete_old_reply_records"
+MOCK_BASE = f"emails.management.commands.{COMMAND_NAME}"
+
+
+def _make_replies(count: int, days_old: int) -> list[int]:
+    relay_address = baker.make(RelayAddress)
+    replies = baker.make(Reply, relay_address=relay_address, _quantity=count)
+    ids = [reply.id for reply in replies]
+    Reply.objects.filter(id__in=ids).update(
+        created_at=date.today() - timedelta(days=days_old)
+    )
+    return ids
+
+
+@pytest.mark.django_db
+def test_delete_old_reply_records_in_batches(
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    old_ids = _make_replies(5, days_old=100)
+    new_ids = _make_replies(2, days_old=10)
+    with (
+        patch(f"{MOCK_BASE}.time.sleep") as mock_sleep,
+        patch(f"{MOCK_BASE}.incr_if_enabled") as mock_incr,
+    ):
+        call_command(COMMAND_NAME, "90", "--batch-size", "2", "--sleep", "0.5")
+
+    assert list(Reply.objects.values_list("id", flat=True).order_by("id")) == new_ids
+    assert mock_sleep.call_args_list == [call(0.5), call(0.5)]
+    assert mock_incr.call_args_list == [
+        call("reply_records_deleted", 2),
+        call("reply_records_deleted", 2),
+        call("reply_records_deleted", 1),
+    ]
+    output = capsys.readouterr().out
+    assert f"with ids {old_ids[0]} to {old_ids[-1]}" in output
+    assert output.splitlines()[-1].startswith("Deleted 5 reply records older than ")
+
+
+@pytest.mark.django_db
+def test_delete_old_reply_records_keeps_new_records_in_range() -> None:
+    """A new record with an id between old records is kept."""
+    old_ids = _make_replies(3, days_old=100)
+    Reply.objects.filter(id=old_ids[1]).update(created_at=date.today())
+    call_command(COMMAND_NAME, "90")
+    assert list(Reply.objects.values_list("id", flat=True)) == [old_ids[1]]
+
+
+@pytest.mark.django_db
+def test_delete_old_reply_records_none_to_delete(
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    _make_replies(2, days_old=10)
+    with patch(f"{MOCK_BASE}.incr_if_enabled") as mock_incr:
+        call_command(COMMAND_NAME, "90")
+    assert Reply.objects.count() == 2
+    mock_incr.assert_not_called()
+    assert capsys.readouterr().out.startswith("No reply records older than ")
+
+
+@pytest.mark.django_db
+def test_delete_old_reply_records_resumes() -> None:
+    """A stopped run deletes some batches, and the next run deletes the rest."""
+    _make_replies(4, days_old=100)
+    with (
+        patch(f"{MOCK_BASE}.time.sleep", side_effect=KeyboardInterrupt),
+        pytest.raises(KeyboardInterrupt),
+    ):
+        call_command(COMMAND_NAME, "90", "--batch-size", "2", "--sleep", "1")
+    assert Reply.objects.count() == 2
+    call_command(COMMAND_NAME, "90", "--batch-size", "2")
+    assert Reply.objects.count() == 0
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("batch_size", ["0", "-1"])
+def test_delete_old_reply_records_rejects_bad_batch_size(batch_size: str) -> None:
+    _make_replies(2, days_old=100)
+    with pytest.raises(CommandError, match="--batch-size must be at least 1"):
+        call_command(COMMAND_NAME, "90", "--batch-size", batch_size)
+    assert Reply.objects.count() == 2
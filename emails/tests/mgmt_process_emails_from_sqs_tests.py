@@ -1,6 +1,7 @@
 import json
 from collections.abc import Callable, Iterator
 from datetime import UTC, datetime
+from itertools import chain, repeat
 from pathlib import Path
 from typing import TYPE_CHECKING, Any
 from unittest.mock import Mock, patch
@@ -8,7 +9,6 @@ from uuid import uuid4
 
 from django.core.management import call_command
 from django.core.management.base import CommandError
-from django.http import HttpResponse
 
 import pytest
 from botocore.exceptions import ClientError
@@ -16,6 +16,7 @@ from markus.testing import MetricsMock
 from pytest import LogCaptureFixture
 from pytest_django.fixtures import SettingsWrapper
 
+from emails.management.commands.process_emails_from_sqs import Command
 from emails.sns import VerificationFailed
 from emails.tests.views_tests import EMAIL_SNS_BODIES
 from privaterelay.tests.utils import log_extra, omit_markus_logs
@@ -111,11 +112,19 @@ def test_settings(settings: SettingsWrapper, tmp_path: Path) -> SettingsWrapper:
     settings.PROCESS_EMAIL_BATCH_SIZE = 10
     settings.PROCESS_EMAIL_DELETE_FAILED_MESSAGES = False
     settings.PROCESS_EMAIL_HEALTHCHECK_PATH = str(tmp_path / "healthcheck.json")
+    settings.PROCESS_EMAIL_HEALTHCHECK_INTERVAL = 5
+    settings.PROCESS_EMAIL_QUEUE_METRICS_INTERVAL = 30
+    settings.PROCESS_EMAIL_STATISTICS_FLUSH_INTERVAL = 10
+    settings.EMAIL_STATISTICS_WRITE_BEHIND = False
     settings.PROCESS_EMAIL_MAX_SECONDS = 3
     settings.PROCESS_EMAIL_VERBOSITY = 2
     settings.PROCESS_EMAIL_VISIBILITY_SECONDS = 120
     settings.PROCESS_EMAIL_WAIT_SECONDS = 5
     settings.PROCESS_EMAIL_MAX_SECONDS_PER_MESSAGE = 3
+    settings.PROCESS_EMAIL_CONCURRENCY = 1
+    settings.PROCESS_EMAIL_PREFETCH = False
+    settings.PROCESS_EMAIL_WORKER_MAX_TASKS = 100
+    settings.PROCESS_EMAIL_WORKER_MAX_RSS_MB = None
     return settings
 
 
@@ -137,60 +146,68 @@ def mock_sqs_client() -> Iterator[Mock]:
         yield mock_queue.Queue
 
 
+@pytest.fixture
+def mock_process_pool() -> Iterator[Mock]:
+    """Replace multiprocessing.Pool with a mock, return the mocked Pool class."""
+    with patch(MOCK_BASE + ".Pool", spec=True) as mock_pool_cls:
+        yield mock_pool_cls
+
+
 @pytest.fixture(autouse=True)
-def mock_process_pool_future() -> Iterator[Mock]:
+def mock_process_pool_future(mock_process_pool: Mock) -> Iterator[Mock]:
     """
-    Replace multiprocessing.Pool with a mock, return mocked future.
+    Use the mocked multiprocessing.Pool, return the mocked future settings.
 
     The mocked pool.apply_async returns a mocked future that does not start a
     new subproccess. By default, running ".wait()" runs the (mocked) _sns_inbound_logic.
-    The timeout is appended to future._timeouts, and future.ready() will return True.
+    The timeout is appended to mock_future._timeouts, and future.ready() will return
+    True.
 
-    If mock_future.stalled returns False, then future.wait() will return without
-    running _sns_inbound_logic. This can emulate a slow-running process (use a
-    side_effect to return False then True) or a hung process (always return False).
+    If mock_future._is_stalled(json_body) returns True, then future.wait() will return
+    without running _sns_inbound_logic. This can emulate a slow-running process (use a
+    side_effect to return True then False) or a hung process (always return True).
     """
 
-    with patch(MOCK_BASE + ".Pool", spec=True) as mock_pool_cls:
-        mock_pool = Mock(spec_set=["__enter__", "__exit__", "apply_async", "terminate"])
-        mock_pool.__enter__ = Mock(return_value=mock_pool)
-        mock_pool.__exit__ = Mock(side_effect=mock_pool.terminate())
-
-        mock_future = Mock()
-        mock_future._timeouts = []
-        mock_future._is_stalled.return_value = False
-        mock_future._ready = False
-
-        def mock_apply_async(
-            func: Callable[[str, str, Any], HttpResponse],
-            args: tuple[str, str, Any],
-            kwargs: dict[str, Any] | None = None,
-            callback: Callable[[Any], None] | None = None,
-            error_callback: Callable[[BaseException], None] | None = None,
-        ) -> Mock:
-            def call_wait(timeout: float) -> None:
-                mock_future._timeouts.append(timeout)
-                if not mock_future._is_stalled():
-                    mock_future._ready = True
-                    try:
-                        ret = func(*args)
-                    except BaseException as e:
-                        if error_callback:
-                            error_callback(e)
-                    else:
-                        if callback:
-                            callback(ret)
-
-            def call_ready() -> bool:
-                return bool(mock_future._ready)
-
-            mock_future.wait.side_effect = call_wait
-            mock_future.ready.side_effect = call_ready
-            return mock_future
-
-        mock_pool_cls.return_value = mock_pool
-        mock_pool.apply_async.side_effect = mock_apply_async
-        yield mock_future
+    mock_pool = Mock(spec_set=["apply_async", "terminate"])
+    mock_process_pool.return_value = mock_pool
+
+    mock_future = Mock()
+    mock_future._timeouts = []
+    mock_future._is_stalled.return_value = False
+
+    def mock_apply_async(
+        func: Callable[[str, str, Any], Any],
+        args: tuple[str, str, Any],
+        kwargs: dict[str, Any] | None = None,
+        callback: Callable[[Any], None] | None = None,
+        error_callback: Callable[[BaseException], None] | None = None,
+    ) -> Mock:
+        future = Mock(spec_set=["wait", "ready"])
+        is_ready = False
+
+        def call_wait(timeout: float) -> None:
+            nonlocal is_ready
+            mock_future._timeouts.append(timeout)
+            if not mock_future._is_stalled(args[2]):
+                is_ready = True
+                try:
+                    ret = func(*args)
+                except BaseException as e:
+                    if error_callback:
+                        error_callback(e)
+                else:
+                    if callback:
+                        callback(ret)
+
+        def call_ready() -> bool:
+            return is_ready
+
+        future.wait.side_effect = call_wait
+        future.ready.side_effect = call_ready
+        return future
+
+    mock_pool.apply_async.side_effect = mock_apply_async
+    yield mock_future
 
 
 def fake_queue(*message_lists: list[Mock] | BaseException) -> Mock:
@@ -200,7 +217,15 @@ def fake_queue(*message_lists: list[Mock] | BaseException) -> Mock:
     Arguments:
     message_lists: A list of lists of messages, None if no messages
     """
-    queue = Mock(spec_set=("receive_messages", "load", "attributes"))
+    queue = Mock(
+        spec_set=(
+            "receive_messages",
+            "load",
+            "attributes",
+            "delete_messages",
+            "change_message_visibility_batch",
+        )
+    )
     queue.attributes = {
         "ApproximateNumberOfMessages": 1,
         "ApproximateNumberOfMessagesDelayed": 2,
@@ -210,9 +235,25 @@ def fake_queue(*message_lists: list[Mock] | BaseException) -> Mock:
         queue.receive_messages.side_effect = message_lists
     else:
         queue.receive_messages.return_value = []
+
+    def all_successful(Entries: list[dict[str, Any]]) -> dict[str, Any]:
+        return {"Successful": [{"Id": entry["Id"]} for entry in Entries], "Failed": []}
+
+    queue.delete_messages.side_effect = all_successful
+    queue.change_message_visibility_batch.side_effect = all_successful
     return queue
 
 
+def deleted_receipt_handles(mock_sqs_client: Mock) -> list[str]:
+    """Get the receipt handles of messages deleted from the mocked queue."""
+    queue = mock_sqs_client.return_value
+    return [
+        entry["ReceiptHandle"]
+        for call in queue.delete_messages.call_args_list
+        for entry in call.kwargs["Entries"]
+    ]
+
+
 def fake_sqs_message(body: str) -> Mock:
     """
     Create a fake SQS message
@@ -220,7 +261,16 @@ def fake_sqs_message(body: str) -> Mock:
     Only includes some attributes. For full spec, see:
     https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/sqs.html#message
     """
-    msg = Mock(spec_set=("queue_url", "receipt_handle", "body", "message_id", "delete"))
+    msg = Mock(
+        spec_set=(
+            "queue_url",
+            "receipt_handle",
+            "body",
+            "message_id",
+            "delete",
+            "change_visibility",
+        )
+    )
     msg.queue_url = (
         "https://sqs.us-east-1.amazonaws.example.com/123456789012/queue-name"
     )
@@ -256,14 +306,23 @@ def test_no_messages(caplog: LogCaptureFixture, test_settings: SettingsWrapper)
     assert log_extra(rec1) == {
         "aws_region": "us-east-1",
         "batch_size": 10,
+        "concurrency": 1,
         "delete_failed_messages": False,
         "healthcheck_path": test_settings.PROCESS_EMAIL_HEALTHCHECK_PATH,
+        "healthcheck_interval": 5,
+        "queue_metrics_interval": 30,
+        "statistics_flush_interval": 10,
+        "statistics_write_behind": False,
+        "reply_write_behind": False,
         "max_seconds": 3,
         "max_seconds_per_message": 3,
+        "prefetch": False,
         "sqs_url": "https://sqs.us-east-1.amazonaws.example.com/111222333/queue-name",
         "verbosity": 2,
         "visibility_seconds": 120,
         "wait_seconds": 5,
+        "worker_max_rss_mb": None,
+        "worker_max_tasks": 100,
     }
 
     assert rec2.getMessage() == "Cycle 0: processed 0 messages"
@@ -322,6 +381,7 @@ def test_one_message(
         "sqs_message_id",
         "success",
         "subprocess_setup_time_s",
+        "worker_max_rss_kb",
     }
     assert msg_extra["success"]
 
@@ -358,7 +418,7 @@ def test_no_body(mock_sqs_client: Mock, caplog: LogCaptureFixture) -> None:
     summary = summary_from_exit_log(caplog)
     assert summary["failed_messages"] == 1
     assert summary["cycles"] == 2
-    msg.delete.assert_not_called()
+    assert msg.receipt_handle not in deleted_receipt_handles(mock_sqs_client)
 
 
 def test_no_body_deleted(
@@ -372,7 +432,7 @@ def test_no_body_deleted(
     summary = summary_from_exit_log(caplog)
     assert summary["failed_messages"] == 1
     assert summary["cycles"] == 2
-    msg.delete.assert_called_once_with()
+    assert msg.receipt_handle in deleted_receipt_handles(mock_sqs_client)
 
 
 def test_ses_temp_failure(
@@ -398,7 +458,7 @@ def test_ses_temp_failure(
     summary = summary_from_exit_log(caplog)
     assert summary["total_messages"] == 1
     assert summary["failed_messages"] == 1
-    msg.delete.assert_not_called()
+    assert msg.receipt_handle not in deleted_receipt_handles(mock_sqs_client)
 
 
 def test_ses_generic_failure(
@@ -413,7 +473,7 @@ def test_ses_generic_failure(
     summary = summary_from_exit_log(caplog)
     assert summary["total_messages"] == 1
     assert summary["failed_messages"] == 1
-    msg.delete.assert_not_called()
+    assert msg.receipt_handle not in deleted_receipt_handles(mock_sqs_client)
 
 
 def test_ses_python_error(
@@ -431,7 +491,7 @@ def test_ses_python_error(
     summary = summary_from_exit_log(caplog)
     assert summary["total_messages"] == 1
     assert summary["failed_messages"] == 1
-    msg.delete.assert_not_called()
+    assert msg.receipt_handle not in deleted_receipt_handles(mock_sqs_client)
     rec2 = omit_markus_logs(caplog)[1]
     assert rec2.msg == "Message processed"
     rec2_extra = log_extra(rec2)
@@ -454,7 +514,7 @@ def test_ses_slow(
     call_command(COMMAND_NAME)
     summary = summary_from_exit_log(caplog)
     assert summary["total_messages"] == 1
-    msg.delete.assert_called()
+    assert msg.receipt_handle in deleted_receipt_handles(mock_sqs_client)
     rec2 = omit_markus_logs(caplog)[1]
     assert rec2.msg == "Message processed"
     rec2_extra = log_extra(rec2)
@@ -480,7 +540,7 @@ def test_ses_timeout(
     summary = summary_from_exit_log(caplog)
     assert summary["total_messages"] == 1
     assert summary["failed_messages"] == 1
-    msg.delete.assert_not_called()
+    assert msg.receipt_handle not in deleted_receipt_handles(mock_sqs_client)
     rec2 = omit_markus_logs(caplog)[1]
     assert rec2.msg == "Message processed"
     rec2_extra = log_extra(rec2)
@@ -491,6 +551,343 @@ def test_ses_timeout(
     assert mock_process_pool_future._timeouts == [1.0] * 120
 
 
+def test_worker_pool_reused(
+    mock_sqs_client: Mock,
+    mock_process_pool: Mock,
+    test_settings: SettingsWrapper,
+    caplog: LogCaptureFixture,
+) -> None:
+    """The worker pool is started once, and shut down when the command exits."""
+    test_settings.PROCESS_EMAIL_MAX_SECONDS = 20
+    msgs = [fake_sqs_message(json.dumps(TEST_SNS_MESSAGE)) for _ in range(3)]
+    queue = fake_queue()
+    queue.receive_messages.side_effect = chain([msgs[:2], msgs[2:]], repeat([]))
+    mock_sqs_client.return_value = queue
+    call_command(COMMAND_NAME)
+    summary = summary_from_exit_log(caplog)
+    assert summary["total_messages"] == 3
+    assert "failed_messages" not in summary
+    mock_process_pool.assert_called_once()
+    assert mock_process_pool.call_args.kwargs["maxtasksperchild"] == 100
+    # Workers are not forked from the process running the monitor thread
+    context = mock_process_pool.call_args.kwargs["context"]
+    assert context.get_start_method() == "forkserver"
+    mock_pool = mock_process_pool.return_value
+    assert mock_pool.apply_async.call_count == 3
+    mock_pool.terminate.assert_called_once_with()
+
+
+def test_worker_pool_replaced_after_timeout(
+    mock_sqs_client: Mock,
+    mock_process_pool: Mock,
+    mock_process_pool_future: Mock,
+    test_settings: SettingsWrapper,
+    caplog: LogCaptureFixture,
+) -> None:
+    """A hung worker is terminated, and a new pool is started for the next message."""
+    test_settings.PROCESS_EMAIL_MAX_SECONDS = 10
+    msg1 = fake_sqs_message(json.dumps(TEST_SNS_MESSAGE))
+    msg2 = fake_sqs_message(json.dumps(TEST_SNS_MESSAGE))
+    mock_sqs_client.return_value = fake_queue([msg1, msg2], [], [], [], [])
+    mock_process_pool_future._is_stalled.side_effect = [True] * 3 + [False]
+    call_command(COMMAND_NAME)
+    summary = summary_from_exit_log(caplog)
+    assert summary["total_messages"] == 2
+    assert summary["failed_messages"] == 1
+    assert msg1.receipt_handle not in deleted_receipt_handles(mock_sqs_client)
+    assert msg2.receipt_handle in deleted_receipt_handles(mock_sqs_client)
+    rec2 = omit_markus_logs(caplog)[1]
+    assert log_extra(rec2)["worker_recycled"] == "timeout"
+    assert mock_process_pool.call_count == 2
+    assert mock_process_pool.return_value.terminate.call_count == 2
+
+
+def test_worker_pool_replaced_after_max_rss(
+    mock_sqs_client: Mock,
+    mock_process_pool: Mock,
+    test_settings: SettingsWrapper,
+    caplog: LogCaptureFixture,
+) -> None:
+    """A worker that has grown past the memory limit is replaced."""
+    test_settings.PROCESS_EMAIL_WORKER_MAX_RSS_MB = 1
+    msg = fake_sqs_message(json.dumps(TEST_SNS_MESSAGE))
+    mock_sqs_client.return_value = fake_queue([msg], [])
+    with patch(f"{MOCK_BASE}.resource.getrusage") as mock_getrusage:
+        mock_getrusage.return_value.ru_maxrss = 2048
+        call_command(COMMAND_NAME)
+    assert msg.receipt_handle in deleted_receipt_handles(mock_sqs_client)
+    rec2 = omit_markus_logs(caplog)[1]
+    rec2_extra = log_extra(rec2)
+    assert rec2_extra["success"] is True
+    assert rec2_extra["worker_max_rss_kb"] == 2048
+    assert rec2_extra["worker_recycled"] == "max_rss"
+    mock_process_pool.return_value.terminate.assert_called_once_with()
+
+
+def test_concurrent_messages(
+    mock_sqs_client: Mock,
+    mock_process_pool: Mock,
+    mock_process_pool_future: Mock,
+    mock_sns_inbound_logic: Mock,
+    test_settings: SettingsWrapper,
+    caplog: LogCaptureFixture,
+) -> None:
+    """Messages in a batch are sent to the worker pool without waiting."""
+    test_settings.PROCESS_EMAIL_CONCURRENCY = 2
+    mock_pool = mock_process_pool.return_value
+    started_at_wait: list[int] = []
+
+    def is_stalled(json_body: dict[str, Any]) -> bool:
+        started_at_wait.append(mock_pool.apply_async.call_count)
+        return False
+
+    mock_process_pool_future._is_stalled.side_effect = is_stalled
+    msgs = [fake_sqs_message(json.dumps(TEST_SNS_MESSAGE)) for _ in range(3)]
+    mock_sqs_client.return_value = fake_queue(msgs, [])
+    call_command(COMMAND_NAME)
+
+    summary = summary_from_exit_log(caplog)
+    assert summary["total_messages"] == 3
+    assert "failed_messages" not in summary
+    assert mock_process_pool.call_args.args == (2,)
+    assert mock_sns_inbound_logic.call_count == 3
+    # Two messages are in-flight at the first wait, then the third is started
+    assert started_at_wait == [2, 2, 3]
+    for msg in msgs:
+        assert msg.receipt_handle in deleted_receipt_handles(mock_sqs_client)
+
+
+def test_concurrent_messages_timeout(
+    mock_sqs_client: Mock,
+    mock_process_pool: Mock,
+    mock_process_pool_future: Mock,
+    test_settings: SettingsWrapper,
+    caplog: LogCaptureFixture,
+) -> None:
+    """After a timeout, in-flight messages finish before the pool is replaced."""
+    test_settings.PROCESS_EMAIL_CONCURRENCY = 2
+    test_settings.PROCESS_EMAIL_MAX_SECONDS = 20
+    mock_pool = mock_process_pool.return_value
+    mock_process_pool_future._is_stalled.side_effect = lambda json_body: (
+        json_body["MessageId"] == "hung"
+    )
+    msgs = [
+        fake_sqs_message(json.dumps(TEST_SNS_MESSAGE | {"MessageId": msg_id}))
+        for msg_id in ("hung", "ok1", "ok2")
+    ]
+    queue = fake_queue()
+    queue.receive_messages.side_effect = chain([msgs], repeat([]))
+    mock_sqs_client.return_value = queue
+    call_command(COMMAND_NAME)
+
+    summary = summary_from_exit_log(caplog)
+    assert summary["total_messages"] == 3
+    assert summary["failed_messages"] == 1
+    assert msgs[0].receipt_handle not in deleted_receipt_handles(mock_sqs_client)
+    assert msgs[1].receipt_handle in deleted_receipt_handles(mock_sqs_client)
+    assert msgs[2].receipt_handle in deleted_receipt_handles(mock_sqs_client)
+    assert mock_process_pool.call_count == 2
+    assert mock_pool.apply_async.call_count == 3
+    assert mock_pool.terminate.call_count == 2
+
+
+def test_prefetch_next_batch(
+    mock_sqs_client: Mock, test_settings: SettingsWrapper, caplog: LogCaptureFixture
+) -> None:
+    """In prefetch mode, the next batch is requested while processing a batch."""
+    test_settings.PROCESS_EMAIL_PREFETCH = True
+    test_settings.PROCESS_EMAIL_MAX_SECONDS = 20
+    msg1 = fake_sqs_message(json.dumps(TEST_SNS_MESSAGE))
+    msg2 = fake_sqs_message(json.dumps(TEST_SNS_MESSAGE))
+    queue = fake_queue()
+    queue.receive_messages.side_effect = chain([[msg1], [msg2]], repeat([]))
+    mock_sqs_client.return_value = queue
+    call_command(COMMAND_NAME)
+
+    summary = summary_from_exit_log(caplog)
+    assert summary["total_messages"] == 2
+    assert msg1.receipt_handle in deleted_receipt_handles(mock_sqs_client)
+    assert msg2.receipt_handle in deleted_receipt_handles(mock_sqs_client)
+    cycle_logs = [
+        log_extra(rec)
+        for rec in omit_markus_logs(caplog)
+        if rec.getMessage().startswith("Cycle ")
+    ]
+    assert "prefetched" not in cycle_logs[0]
+    assert cycle_logs[1]["prefetched"] is True
+    assert cycle_logs[1]["message_count"] == 1
+    # The empty batch after msg2 was prefetched, then polling is not prefetched
+    assert cycle_logs[2]["prefetched"] is True
+    assert cycle_logs[2]["message_count"] == 0
+    assert "prefetched" not in cycle_logs[3]
+
+
+def test_prefetch_released_on_exit(
+    mock_sqs_client: Mock,
+    mock_verify_from_sns: Mock,
+    test_settings: SettingsWrapper,
+    caplog: LogCaptureFixture,
+) -> None:
+    """Prefetched messages are made visible again when the command exits."""
+    test_settings.PROCESS_EMAIL_PREFETCH = True
+    mock_verify_from_sns.side_effect = KeyboardInterrupt()
+    msg1 = fake_sqs_message(json.dumps(TEST_SNS_MESSAGE))
+    msg2 = fake_sqs_message(json.dumps(TEST_SNS_MESSAGE))
+    mock_sqs_client.return_value = fake_queue([msg1], [msg2])
+    call_command(COMMAND_NAME)
+
+    summary = summary_from_exit_log(caplog)
+    assert summary["exit_on"] == "interrupt"
+    assert msg1.receipt_handle not in deleted_receipt_handles(mock_sqs_client)
+    assert msg2.receipt_handle not in deleted_receipt_handles(mock_sqs_client)
+    msg2.change_visibility.assert_called_once_with(VisibilityTimeout=0)
+
+
+def test_prefetch_disabled_for_short_visibility(
+    mock_sqs_client: Mock, test_settings: SettingsWrapper, caplog: LogCaptureFixture
+) -> None:
+    """Prefetch is disabled if prefetched messages could become visible again."""
+    test_settings.PROCESS_EMAIL_PREFETCH = True
+    test_settings.PROCESS_EMAIL_VISIBILITY_SECONDS = 30
+    msg = fake_sqs_message(json.dumps(TEST_SNS_MESSAGE))
+    mock_sqs_client.return_value = fake_queue([msg], [])
+    call_command(COMMAND_NAME)
+
+    records = omit_markus_logs(caplog)
+    messages = [rec.getMessage() for rec in records]
+    assert "Prefetch disabled, visibility_seconds is too short" in messages
+    assert summary_from_exit_log(caplog)["total_messages"] == 1
+    assert not any("prefetched" in log_extra(rec) for rec in records)
+
+
+def test_batch_deleted_together(
+    mock_sqs_client: Mock, mock_verify_from_sns: Mock, caplog: LogCaptureFixture
+) -> None:
+    """The successful messages in a batch are deleted with one request."""
+    msgs = [fake_sqs_message(json.dumps(TEST_SNS_MESSAGE)) for _ in range(3)]
+    bad_msg = fake_sqs_message("I am a string, not JSON")
+    mock_sqs_client.return_value = fake_queue([msgs[0], bad_msg, *msgs[1:]], [])
+    call_command(COMMAND_NAME)
+
+    summary = summary_from_exit_log(caplog)
+    assert summary["total_messages"] == 4
+    assert summary["failed_messages"] == 1
+    queue = mock_sqs_client.return_value
+    queue.delete_messages.assert_called_once_with(
+        Entries=[
+            {"Id": "0", "ReceiptHandle": msgs[0].receipt_handle},
+            {"Id": "1", "ReceiptHandle": msgs[1].receipt_handle},
+            {"Id": "2", "ReceiptHandle": msgs[2].receipt_handle},
+        ]
+    )
+
+
+def test_batch_delete_failure_logged(
+    mock_sqs_client: Mock, caplog: LogCaptureFixture
+) -> None:
+    """A message that fails to delete is logged."""
+    msg = fake_sqs_message(json.dumps(TEST_SNS_MESSAGE))
+    queue = fake_queue([msg], [])
+    failure = {"Id": "0", "SenderFault": False, "Code": "InternalError"}
+    queue.delete_messages.side_effect = None
+    queue.delete_messages.return_value = {"Successful": [], "Failed": [failure]}
+    mock_sqs_client.return_value = queue
+    call_command(COMMAND_NAME)
+
+    failed_log = next(
+        rec for rec in caplog.records if rec.getMessage() == "Failed to delete message"
+    )
+    assert log_extra(failed_log) == {
+        "sqs_message_id": msg.message_id,
+        "error": failure,
+    }
+
+
+def test_batch_delete_error_logged(
+    mock_sqs_client: Mock, caplog: LogCaptureFixture
+) -> None:
+    """A failed delete request is logged, and processing continues."""
+    msg = fake_sqs_message(json.dumps(TEST_SNS_MESSAGE))
+    queue = fake_queue([msg], [])
+    queue.delete_messages.side_effect = make_client_error(code="RequestThrottled")
+    mock_sqs_client.return_value = queue
+    call_command(COMMAND_NAME)
+
+    assert summary_from_exit_log(caplog)["total_messages"] == 1
+    failed_log = next(
+        rec for rec in caplog.records if rec.getMessage() == "Failed to delete messages"
+    )
+    assert log_extra(failed_log) == {
+        "sqs_message_ids": [msg.message_id],
+        "error": {"Message": "Unknown", "Code": "RequestThrottled"},
+    }
+
+
+def test_visibility_heartbeat(
+    mock_sqs_client: Mock,
+    mock_process_pool_future: Mock,
+    test_settings: SettingsWrapper,
+    caplog: LogCaptureFixture,
+) -> None:
+    """The visibility timeout is extended for messages that take a long time."""
+    test_settings.PROCESS_EMAIL_VISIBILITY_SECONDS = 10
+    test_settings.PROCESS_EMAIL_MAX_SECONDS_PER_MESSAGE = 30
+    msg1 = fake_sqs_message(json.dumps(TEST_SNS_MESSAGE))
+    msg2 = fake_sqs_message(json.dumps(TEST_SNS_MESSAGE))
+    mock_sqs_client.return_value = fake_queue([msg1, msg2], [], [])
+    mock_process_pool_future._is_stalled.side_effect = [True] * 12 + [False] * 2
+    call_command(COMMAND_NAME)
+
+    summary = summary_from_exit_log(caplog)
+    assert summary["total_messages"] == 2
+    assert "failed_messages" not in summary
+    queue = mock_sqs_client.return_value
+    heartbeat_calls = queue.change_message_visibility_batch.call_args_list
+    assert len(heartbeat_calls) == 2
+    for heartbeat_call in heartbeat_calls:
+        assert heartbeat_call.kwargs["Entries"] == [
+            {"Id": "0", "ReceiptHandle": msg2.receipt_handle, "VisibilityTimeout": 10},
+            {"Id": "1", "ReceiptHandle": msg1.receipt_handle, "VisibilityTimeout": 10},
+        ]
+    assert deleted_receipt_handles(mock_sqs_client) == [
+        msg1.receipt_handle,
+        msg2.receipt_handle,
+    ]
+
+
+def test_visibility_heartbeat_error_logged(
+    mock_sqs_client: Mock,
+    mock_process_pool_future: Mock,
+    test_settings: SettingsWrapper,
+    caplog: LogCaptureFixture,
+) -> None:
+    """A failed visibility request is logged, and the message is still processed."""
+    test_settings.PROCESS_EMAIL_VISIBILITY_SECONDS = 10
+    test_settings.PROCESS_EMAIL_MAX_SECONDS_PER_MESSAGE = 30
+    msg = fake_sqs_message(json.dumps(TEST_SNS_MESSAGE))
+    queue = fake_queue([msg], [], [])
+    queue.change_message_visibility_batch.side_effect = make_client_error(
+        code="RequestThrottled"
+    )
+    mock_sqs_client.return_value = queue
+    mock_process_pool_future._is_stalled.side_effect = [True] * 12 + [False]
+    call_command(COMMAND_NAME)
+
+    summary = summary_from_exit_log(caplog)
+    assert summary["total_messages"] == 1
+    assert "failed_messages" not in summary
+    assert deleted_receipt_handles(mock_sqs_client) == [msg.receipt_handle]
+    failed_log = next(
+        rec
+        for rec in caplog.records
+        if rec.getMessage() == "Failed to extend messages visibility"
+    )
+    assert log_extra(failed_log) == {
+        "sqs_message_ids": [msg.message_id],
+        "error": {"Message": "Unknown", "Code": "RequestThrottled"},
+    }
+
+
 def test_db_is_unusable_is_closed(
     mock_sqs_client: Mock, mock_django_db_connection: Mock, caplog: LogCaptureFixture
 ) -> None:
@@ -501,7 +898,7 @@ def test_db_is_unusable_is_closed(
     call_command(COMMAND_NAME)
     summary = summary_from_exit_log(caplog)
     assert summary["total_messages"] == 1
-    msg.delete.assert_called()
+    assert msg.receipt_handle in deleted_receipt_handles(mock_sqs_client)
     rec2 = omit_markus_logs(caplog)[1]
     assert rec2.msg == "Message processed"
     rec2_extra = log_extra(rec2)
@@ -571,6 +968,112 @@ def test_writes_healthcheck_file(test_settings: SettingsWrapper) -> None:
     assert 0.0 < duration < 0.5
 
 
+def test_queue_metrics_not_loaded_per_cycle(mock_sqs_client: Mock) -> None:
+    """The queue metrics are loaded at startup, and then by the monitor thread."""
+    call_command(COMMAND_NAME)
+    mock_sqs_client.return_value.load.assert_called_once_with()
+
+
+def test_monitor_refreshes_metrics_and_writes_healthcheck(
+    mock_sqs_client: Mock, test_settings: SettingsWrapper
+) -> None:
+    """The monitor writes the healthcheck, and refreshes metrics less often."""
+    test_settings.PROCESS_EMAIL_QUEUE_METRICS_INTERVAL = 10
+    command = Command()
+    command.init_from_settings(verbosity=1)
+    command.init_locals()
+    command.monitor_queue = fake_queue()
+    stalled_at = datetime(2024, 5, 1, 12, tzinfo=UTC)
+    command.alive_at = stalled_at
+
+    with (
+        patch.object(command.monitor_stop, "wait") as mock_wait,
+        patch.object(command, "write_healthcheck") as mock_write,
+    ):
+        mock_wait.side_effect = [False, False, False, True]
+        command.run_monitor()
+    mock_wait.assert_called_with(5)
+    assert mock_write.call_count == 3
+    command.monitor_queue.load.assert_called_once_with()
+    assert command.queue_count == 1
+
+    command.write_healthcheck()
+    healthcheck_path = test_settings.PROCESS_EMAIL_HEALTHCHECK_PATH
+    with open(healthcheck_path, encoding="utf-8") as healthcheck_file:
+        content = json.load(healthcheck_file)
+    # The timestamp is when the processing loop was last active
+    assert content["timestamp"] == stalled_at.isoformat()
+    assert content["queue_count"] == 1
+
+
+def test_monitor_flushes_statistics(
+    mock_sqs_client: Mock, test_settings: SettingsWrapper
+) -> None:
+    """The monitor flushes buffered email statistics, and again on stop."""
+    test_settings.EMAIL_STATISTICS_WRITE_BEHIND = True
+    command = Command()
+    command.init_from_settings(verbosity=1)
+    command.init_locals()
+    command.monitor_queue = fake_queue()
+
+    with (
+        patch.object(command.monitor_stop, "wait") as mock_wait,
+        patch(f"{MOCK_BASE}.flush_statistics", return_value=3) as mock_flush,
+    ):
+        mock_wait.side_effect = [False, False, False, False, True]
+        command.run_monitor()
+        assert mock_flush.call_count == 2
+        command.stop_monitor()
+        assert mock_flush.call_count == 3
+
+
+def test_monitor_flush_statistics_error_is_logged(
+    mock_sqs_client: Mock, test_settings: SettingsWrapper, caplog: LogCaptureFixture
+) -> None:
+    test_settings.EMAIL_STATISTICS_WRITE_BEHIND = True
+    command = Command()
+    command.init_from_settings(verbosity=1)
+    command.init_locals()
+    with patch(f"{MOCK_BASE}.flush_statistics", side_effect=ValueError("oops")):
+        command.flush_buffers()
+    assert caplog.records[-1].msg == "Unable to flush email statistics"
+
+
+def test_monitor_flushes_reply_records(
+    mock_sqs_client: Mock, test_settings: SettingsWrapper, caplog: LogCaptureFixture
+) -> None:
+    """The monitor flushes buffered Reply records, and again on stop."""
+    test_settings.REPLY_RECORD_WRITE_BEHIND = True
+    command = Command()
+    command.init_from_settings(verbosity=1)
+    command.init_locals()
+    command.monitor_queue = fake_queue()
+
+    with (
+        patch.object(command.monitor_stop, "wait") as mock_wait,
+        patch(f"{MOCK_BASE}.flush_reply_records", return_value=3) as mock_flush,
+    ):
+        mock_wait.side_effect = [False, False, False, False, True]
+        command.run_monitor()
+        assert mock_flush.call_count == 2
+        command.stop_monitor()
+        assert mock_flush.call_count == 3
+    assert caplog.records[-1].msg == "Flushed Reply records"
+    assert getattr(caplog.records[-1], "rows_created") == 3
+
+
+def test_monitor_flush_reply_records_error_is_logged(
+    mock_sqs_client: Mock, test_settings: SettingsWrapper, caplog: LogCaptureFixture
+) -> None:
+    test_settings.REPLY_RECORD_WRITE_BEHIND = True
+    command = Command()
+    command.init_from_settings(verbosity=1)
+    command.init_locals()
+    with patch(f"{MOCK_BASE}.flush_reply_records", side_effect=ValueError("oops")):
+        command.flush_buffers()
+    assert caplog.records[-1].msg == "Unable to flush Reply records"
+
+
 def test_connection_closed_after_message_processed(
     mock_sqs_client: Mock,
 ) -> None:
@@ -0,0 +1,58 @@
+from django.core.management import call_command
+
+import pytest
+from model_bakery import baker
+
+from emails.models import MaskStatistics, RelayAddress
+from privaterelay.tests.utils import make_free_test_user
+
+COMMAND_NAME = "rebuild_mask_statistics"
+
+
+@pytest.fixture()
+def relay_address(db: None) -> RelayAddress:
+    user = make_free_test_user()
+    address: RelayAddress = baker.make(RelayAddress, user=user, num_forwarded=2)
+    # An update that skips RelayAddress.save()
+    RelayAddress.objects.filter(id=address.id).update(num_forwarded=5)
+    return address
+
+
+def test_verify_reports_mismatch(
+    relay_address: RelayAddress, capsys: pytest.CaptureFixture[str]
+) -> None:
+    call_command(COMMAND_NAME)
+    output = capsys.readouterr().out
+    assert f"User {relay_address.user_id} totals do not match" in output
+    assert "'num_forwarded': (2, 5)" in output
+    assert output.endswith("Checked 1 MaskStatistics, found 1 mismatched\n")
+    assert MaskStatistics.objects.get(user=relay_address.user).num_forwarded == 2
+
+
+def test_rebuild_fixes_mismatch(
+    relay_address: RelayAddress, capsys: pytest.CaptureFixture[str]
+) -> None:
+    call_command(COMMAND_NAME, "--rebuild")
+    assert capsys.readouterr().out.endswith(
+        "Checked 1 MaskStatistics, found 1 mismatched and rebuilt them\n"
+    )
+    assert MaskStatistics.objects.get(user=relay_address.user).num_forwarded == 5
+
+    call_command(COMMAND_NAME)
+    assert capsys.readouterr().out == "Checked 1 MaskStatistics, found 0 mismatched\n"
+
+
+def test_rebuild_adds_missing_rows(
+    relay_address: RelayAddress, capsys: pytest.CaptureFixture[str]
+) -> None:
+    # A user from before the MaskStatistics table
+    MaskStatistics.objects.filter(user=relay_address.user).delete()
+    call_command(COMMAND_NAME)
+    assert capsys.readouterr().out.endswith("Found 1 users without MaskStatistics\n")
+    assert not MaskStatistics.objects.exists()
+
+    call_command(COMMAND_NAME, "--rebuild")
+    assert capsys.readouterr().out.endswith(
+        "Found 1 users without MaskStatistics and added them\n"
+    )
+    assert MaskStatistics.objects.get(user=relay_address.user).num_forwarded == 5
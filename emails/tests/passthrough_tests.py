@@ -0,0 +1,143 @@
+"""Tests for emails/passthrough.py"""
+
+from email import message_from_bytes
+from email.message import EmailMessage
+from pathlib import Path
+from unittest.mock import Mock, patch
+
+from django.test import override_settings
+
+import pytest
+
+from ..passthrough import (
+    PassthroughEmailMessage,
+    message_as_bytes,
+    message_from_bytes_with_passthrough,
+    split_passthrough_parts,
+)
+from ..policy import relay_policy
+from ..utils import ses_send_raw_email
+
+FIXTURES_PATH = Path(__file__).parent / "fixtures"
+INLINE_IMAGE = (FIXTURES_PATH / "inline_image_incoming.email").read_bytes()
+# The start of the base64-encoded image in the inline image email
+IMAGE_START = b"iVBORw0KGgo"
+
+ATTACHMENT_EMAIL = b"""\
+From: sender@example.com\r
+To: mask@test.com\r
+Subject: An attachment\r
+MIME-Version: 1.0\r
+Content-Type: multipart/mixed; boundary="outer"\r
+\r
+--outer\r
+Content-Type: text/plain; charset="utf-8"\r
+\r
+See attached.\r
+--outer\r
+Content-Type: application/octet-stream\r
+Content-Transfer-Encoding: base64\r
+Content-Disposition: attachment; filename="data.bin"\r
+\r
+AAECAwQFBgcICQoLDA0ODxAREhMUFRYXGBkaGxwdHh8=\r
+ICEiIyQlJicoKSorLC0uLzAxMjM0NTY3ODk6Ozw9Pj8=\r
+--outer\r
+Content-Type: text/plain; charset="utf-8"\r
+Content-Disposition: attachment; filename="notes.txt"\r
+\r
+Text attachments are parsed.\r
+--outer--\r
+"""
+
+
+def test_split_passthrough_parts_finds_large_non_text_parts() -> None:
+    reduced, pattern, parts = split_passthrough_parts(ATTACHMENT_EMAIL, 10)
+    assert len(parts) == 1
+    [(placeholder, body)] = parts.items()
+    assert pattern.fullmatch(placeholder)
+    assert bytes(body) == (
+        b"AAECAwQFBgcICQoLDA0ODxAREhMUFRYXGBkaGxwdHh8=\r\n"
+        b"ICEiIyQlJicoKSorLC0uLzAxMjM0NTY3ODk6Ozw9Pj8="
+    )
+    assert reduced == ATTACHMENT_EMAIL.replace(bytes(body), placeholder)
+
+
+def test_split_passthrough_parts_keeps_small_parts() -> None:
+    reduced, _, parts = split_passthrough_parts(ATTACHMENT_EMAIL, 1000)
+    assert parts == {}
+    assert reduced is ATTACHMENT_EMAIL
+
+
+def test_split_passthrough_parts_nested_multipart() -> None:
+    reduced, _, parts = split_passthrough_parts(INLINE_IMAGE, 1)
+    assert len(parts) == 1
+    assert bytes(next(iter(parts.values()))).startswith(IMAGE_START)
+    assert IMAGE_START not in reduced
+
+
+def test_split_passthrough_parts_single_part_email() -> None:
+    email = b"Content-Type: application/pdf\n\n%PDF-1.4\n"
+    assert split_passthrough_parts(email, 1)[2] == {}
+
+
+@pytest.mark.parametrize(
+    "email_bytes", (INLINE_IMAGE, ATTACHMENT_EMAIL.replace(b"\r\n", b"\n"))
+)
+def test_message_from_bytes_with_passthrough_same_output(email_bytes: bytes) -> None:
+    expected = message_from_bytes(email_bytes, policy=relay_policy)
+    email = message_from_bytes_with_passthrough(email_bytes, 1)
+    assert email.passthrough_parts
+    assert email.as_bytes() == expected.as_bytes()
+    assert email.as_string() == expected.as_string()
+
+
+def test_message_from_bytes_with_passthrough_changed_body() -> None:
+    """The parsed parts are generated, and the passed through parts are unchanged."""
+    email = message_from_bytes_with_passthrough(ATTACHMENT_EMAIL, 1)
+    text_body = email.get_body("plain")
+    assert isinstance(text_body, EmailMessage)
+    text_body.set_content("Changed text")
+    del email["Subject"]
+    email["Subject"] = "Forwarded"
+
+    output = email.as_bytes()
+    assert b"Subject: Forwarded\n" in output
+    assert b"Changed text\n" in output
+    assert (
+        b"AAECAwQFBgcICQoLDA0ODxAREhMUFRYXGBkaGxwdHh8=\r\n"
+        b"ICEiIyQlJicoKSorLC0uLzAxMjM0NTY3ODk6Ozw9Pj8=\n--outer\n"
+    ) in output
+    assert b"relay-passthrough-" not in output
+
+
+@pytest.mark.parametrize(
+    "fixture_name",
+    ("inline_image_incoming.email", "russian_spam_incoming.email"),
+)
+def test_message_as_bytes_same_as_string(fixture_name: str) -> None:
+    email_bytes = (FIXTURES_PATH / fixture_name).read_bytes()
+    email = message_from_bytes(email_bytes, policy=relay_policy)
+    assert message_as_bytes(email) == email.as_string().encode()
+
+
+def test_message_as_bytes_encodes_8bit_text() -> None:
+    email = message_from_bytes(
+        "Content-Type: text/plain; charset=utf-8\n"
+        "Content-Transfer-Encoding: 8bit\n\nEmoji 😀\n".encode(),
+        policy=relay_policy,
+    )
+    output = message_as_bytes(email)
+    assert output == email.as_string().encode()
+    assert b"Content-Transfer-Encoding: base64" in output
+
+
+@override_settings(AWS_SES_CONFIGSET="configset")
+def test_ses_send_raw_email_sends_passthrough_bytes() -> None:
+    email = message_from_bytes_with_passthrough(INLINE_IMAGE, 1)
+    assert isinstance(email, PassthroughEmailMessage)
+    mock_client = Mock(spec_set=["send_raw_email"])
+    with patch("emails.utils.ses_client", return_value=mock_client):
+        ses_send_raw_email("from@test.com", "to@example.com", email)
+    data = mock_client.send_raw_email.call_args[1]["RawMessage"]["Data"]
+    assert data == email.as_bytes() == message_as_bytes(email)
+    assert IMAGE_START in data
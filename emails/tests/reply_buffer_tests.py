@@ -0,0 +1,254 @@
+"""Tests for emails/reply_buffer.py"""
+
+import json
+from collections.abc import Iterator
+from unittest.mock import patch
+
+from django.test import override_settings
+
+import pytest
+from model_bakery import baker
+from redis.exceptions import LockNotOwnedError
+
+from privaterelay.tests.utils import make_premium_test_user
+
+from ..models import DomainAddress, RelayAddress, Reply
+from ..reply_buffer import (
+    FLUSH_LOCK_KEY,
+    REPLY_RECORDS_KEY,
+    flush_reply_records,
+    flush_reply_records_if_due,
+)
+from ..utils import decrypt_reply_metadata
+from ..views import (
+    _flush_buffers_if_due,
+    _get_reply_from_headers,
+    _store_reply_record,
+)
+
+
+class FakeLock:
+    def __init__(self, redis: "FakeRedis", name: str) -> None:
+        self.redis = redis
+        self.name = name
+
+    def acquire(self, blocking: bool = True) -> bool:
+        if self.name in self.redis.locks:
+            return False
+        self.redis.locks.add(self.name)
+        return True
+
+    def reacquire(self) -> bool:
+        if self.name not in self.redis.locks:
+            raise LockNotOwnedError("Cannot reacquire a lock that's no longer owned")
+        return True
+
+    def release(self) -> None:
+        if self.name not in self.redis.locks:
+            raise LockNotOwnedError("Cannot release a lock that's no longer owned")
+        self.redis.locks.remove(self.name)
+
+
+class FakeRedis:
+    """The parts of redis.Redis used by emails.reply_buffer"""
+
+    def __init__(self) -> None:
+        self.lists: dict[str, list[bytes]] = {}
+        self.locks: set[str] = set()
+        self.values: dict[str, int] = {}
+
+    def lock(self, name: str, timeout: float | None = None) -> FakeLock:
+        return FakeLock(self, name)
+
+    def set(self, name: str, value: int, nx: bool = False, ex: int = 0) -> bool:
+        if nx and name in self.values:
+            return False
+        self.values[name] = value
+        return True
+
+    def rpush(self, name: str, value: str) -> int:
+        list_ = self.lists.setdefault(name, [])
+        list_.append(value.encode())
+        return len(list_)
+
+    def lrange(self, name: str, start: int, end: int) -> list[bytes]:
+        return self.lists.get(name, [])[start : end + 1]
+
+    def ltrim(self, name: str, start: int, end: int) -> bool:
+        if end != -1:
+            raise NotImplementedError("Only trimming the head is supported")
+        self.lists[name] = self.lists.get(name, [])[start:]
+        return True
+
+
+@pytest.fixture()
+def fake_redis() -> Iterator[FakeRedis]:
+    redis = FakeRedis()
+    with (
+        patch("emails.reply_buffer.get_redis", return_value=redis),
+        override_settings(REPLY_RECORD_WRITE_BEHIND=True),
+    ):
+        yield redis
+
+
+@pytest.fixture()
+def relay_address(db: None) -> RelayAddress:
+    address: RelayAddress = baker.make(RelayAddress, user=make_premium_test_user())
+    return address
+
+
+def _mail(message_id: str) -> dict:
+    return {
+        "headers": [
+            {"name": "Message-ID", "value": message_id},
+            {"name": "From", "value": "sender@example.com"},
+        ]
+    }
+
+
+def test_store_reply_record_buffered(
+    fake_redis: FakeRedis, relay_address: RelayAddress
+) -> None:
+    message_id = "<forwarded@test.com>"
+    _store_reply_record(_mail("<original@example.com>"), message_id, relay_address)
+    assert not Reply.objects.exists()
+    assert len(fake_redis.lists[REPLY_RECORDS_KEY]) == 1
+
+    assert flush_reply_records() == 1
+    assert fake_redis.lists[REPLY_RECORDS_KEY] == []
+    headers = [{"name": "In-Reply-To", "value": message_id}]
+    reply, encryption_key = _get_reply_from_headers(headers)
+    assert reply.relay_address == relay_address
+    assert json.loads(
+        decrypt_reply_metadata(encryption_key, reply.encrypted_metadata)
+    ) == {"message-id": "<original@example.com>", "from": "sender@example.com"}
+
+
+def test_store_reply_record_buffered_domain_address(
+    fake_redis: FakeRedis, relay_address: RelayAddress
+) -> None:
+    user = relay_address.user
+    user.profile.subdomain = "buffered"
+    user.profile.save()
+    domain_address = DomainAddress.make_domain_address(user, "replies")
+    _store_reply_record(
+        _mail("<original@example.com>"), "<fwd@test.com>", domain_address
+    )
+    assert flush_reply_records() == 1
+    assert Reply.objects.get().domain_address == domain_address
+
+
+def test_flush_reply_records_in_batches(
+    fake_redis: FakeRedis, relay_address: RelayAddress
+) -> None:
+    for number in range(5):
+        _store_reply_record(
+            _mail(f"<{number}@example.com>"), "<fwd@test.com>", relay_address
+        )
+    with patch(
+        "emails.reply_buffer.Reply.objects.bulk_create", wraps=Reply.objects.bulk_create
+    ) as mock_create:
+        assert flush_reply_records(batch_size=2) == 5
+    assert [len(call.args[0]) for call in mock_create.call_args_list] == [2, 2, 1]
+    assert Reply.objects.count() == 5
+
+
+def test_flush_reply_records_drops_deleted_masks(
+    fake_redis: FakeRedis, relay_address: RelayAddress
+) -> None:
+    deleted_address = baker.make(RelayAddress, user=relay_address.user)
+    _store_reply_record(_mail("<1@example.com>"), "<fwd1@test.com>", relay_address)
+    _store_reply_record(_mail("<2@example.com>"), "<fwd2@test.com>", deleted_address)
+    deleted_address.delete()
+    assert flush_reply_records() == 1
+    assert Reply.objects.get().relay_address == relay_address
+
+
+def test_flush_reply_records_failure_keeps_buffer(
+    fake_redis: FakeRedis, relay_address: RelayAddress
+) -> None:
+    _store_reply_record(_mail("<1@example.com>"), "<fwd@test.com>", relay_address)
+    with (
+        patch(
+            "emails.reply_buffer.Reply.objects.bulk_create",
+            side_effect=RuntimeError("database is down"),
+        ),
+        pytest.raises(RuntimeError),
+    ):
+        flush_reply_records()
+    assert len(fake_redis.lists[REPLY_RECORDS_KEY]) == 1
+    assert not fake_redis.locks
+    assert flush_reply_records() == 1
+
+
+def test_flush_reply_records_stopped_before_removal(
+    fake_redis: FakeRedis, relay_address: RelayAddress
+) -> None:
+    """A batch inserted by a flush that stopped before removing it is not copied."""
+    for number in range(2):
+        _store_reply_record(
+            _mail(f"<{number}@example.com>"), "<fwd@test.com>", relay_address
+        )
+    with (
+        patch.object(fake_redis, "ltrim", side_effect=RuntimeError("lost Redis")),
+        pytest.raises(RuntimeError),
+    ):
+        flush_reply_records()
+    assert Reply.objects.count() == 2
+    assert len(fake_redis.lists[REPLY_RECORDS_KEY]) == 2
+
+    _store_reply_record(_mail("<2@example.com>"), "<fwd@test.com>", relay_address)
+    assert flush_reply_records() == 1
+    assert Reply.objects.count() == 3
+    assert fake_redis.lists[REPLY_RECORDS_KEY] == []
+
+
+def test_flush_reply_records_stops_when_lock_lost(
+    fake_redis: FakeRedis,
+    relay_address: RelayAddress,
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    for number in range(3):
+        _store_reply_record(
+            _mail(f"<{number}@example.com>"), "<fwd@test.com>", relay_address
+        )
+    bulk_create = Reply.objects.bulk_create
+
+    def expire_lock(replies: list[Reply]) -> list[Reply]:
+        fake_redis.locks.discard(FLUSH_LOCK_KEY)
+        return bulk_create(replies)
+
+    with patch("emails.reply_buffer.Reply.objects.bulk_create", expire_lock):
+        assert flush_reply_records(batch_size=1) == 1
+    assert len(fake_redis.lists[REPLY_RECORDS_KEY]) == 2
+    assert caplog.records[-1].msg == "reply_records_flush_lock_lost"
+
+    assert flush_reply_records() == 2
+    assert Reply.objects.count() == 3
+
+
+def test_flush_reply_records_when_locked(
+    fake_redis: FakeRedis, relay_address: RelayAddress
+) -> None:
+    _store_reply_record(_mail("<1@example.com>"), "<fwd@test.com>", relay_address)
+    fake_redis.locks.add(FLUSH_LOCK_KEY)
+    assert flush_reply_records() == 0
+    assert len(fake_redis.lists[REPLY_RECORDS_KEY]) == 1
+
+
+def test_flush_reply_records_if_due(
+    fake_redis: FakeRedis, relay_address: RelayAddress
+) -> None:
+    _store_reply_record(_mail("<1@example.com>"), "<fwd1@test.com>", relay_address)
+    assert flush_reply_records_if_due() == 1
+    _store_reply_record(_mail("<2@example.com>"), "<fwd2@test.com>", relay_address)
+    assert flush_reply_records_if_due() == 0
+    assert Reply.objects.count() == 1
+
+
+def test_flush_buffers_if_due_flushes_reply_records(
+    fake_redis: FakeRedis, relay_address: RelayAddress
+) -> None:
+    _store_reply_record(_mail("<1@example.com>"), "<fwd1@test.com>", relay_address)
+    _flush_buffers_if_due()
+    assert Reply.objects.count() == 1
@@ -17,11 +17,14 @@ from cryptography.x509.oid import NameOID
 from pytest_django.fixtures import SettingsWrapper
 
 from ..sns import (
+    KNOWN_CERT_URLS_CACHE_KEY,
     NOTIFICATION_HASH_FORMAT,
     NOTIFICATION_WITHOUT_SUBJECT_HASH_FORMAT,
     SUBSCRIPTION_HASH_FORMAT,
     VerificationFailed,
     _get_signing_public_key,
+    _load_signing_public_key,
+    prefetch_signing_public_keys,
     verify_from_sns,
 )
 
@@ -31,12 +34,14 @@ def key_cache(settings: SettingsWrapper) -> Iterator[BaseCache]:
     """
     Return the cache used for signing certificates.
 
-    Clear the cache before and after tests.
+    Clear the cache and the in-process keys before and after tests.
     """
     key_cache = caches[getattr(settings, "AWS_SNS_KEY_CACHE", "default")]
     key_cache.clear()
+    _load_signing_public_key.cache_clear()
     yield key_cache
     key_cache.clear()
+    _load_signing_public_key.cache_clear()
 
 
 @pytest.fixture
@@ -131,6 +136,58 @@ def test_get_signing_public_key_reads_from_cache(
     mock_urlopen.assert_not_called()
 
 
+def test_get_signing_public_key_kept_in_process(
+    mock_urlopen: Mock,
+    key_and_cert: tuple[rsa.RSAPrivateKey, x509.Certificate],
+    key_cache: BaseCache,
+    settings: SettingsWrapper,
+) -> None:
+    cert_url = f"https://sns.{settings.AWS_REGION}.amazonaws.com/cert.pem"
+    _, cert = key_and_cert
+    mock_urlopen.return_value = BytesIO(cert.public_bytes(serialization.Encoding.PEM))
+    public_key = _get_signing_public_key(cert_url)
+    assert key_cache.get(KNOWN_CERT_URLS_CACHE_KEY) == [cert_url]
+
+    key_cache.delete(_cache_key(cert_url))
+    with patch("emails.sns.serialization.load_pem_public_key") as mock_load:
+        assert _get_signing_public_key(cert_url) is public_key
+    mock_load.assert_not_called()
+    mock_urlopen.assert_called_once_with(cert_url)
+
+
+def test_prefetch_signing_public_keys(
+    mock_urlopen: Mock,
+    key_and_cert: tuple[rsa.RSAPrivateKey, x509.Certificate],
+    key_cache: BaseCache,
+    settings: SettingsWrapper,
+) -> None:
+    cert_url = f"https://sns.{settings.AWS_REGION}.amazonaws.com/cert.pem"
+    _, cert = key_and_cert
+    key_cache.set(_cache_key(cert_url), _public_pem(cert))
+    key_cache.set(KNOWN_CERT_URLS_CACHE_KEY, [cert_url])
+
+    prefetch_signing_public_keys().join()
+    key_cache.clear()
+    assert _get_signing_public_key(cert_url) == cert.public_key()
+    mock_urlopen.assert_not_called()
+
+
+def test_prefetch_signing_public_keys_logs_failure(
+    mock_urlopen: Mock,
+    key_cache: BaseCache,
+    settings: SettingsWrapper,
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    cert_url = f"https://sns.{settings.AWS_REGION}.amazonaws.com/cert.pem"
+    key_cache.set(KNOWN_CERT_URLS_CACHE_KEY, [cert_url])
+    mock_urlopen.side_effect = OSError("Network is down")
+
+    prefetch_signing_public_keys().join()
+    assert [record.msg for record in caplog.records] == [
+        "sns_signing_key_prefetch_failed"
+    ]
+
+
 def test_get_signing_public_key_cert_chain_fails(
     mock_urlopen: Mock,
     key_and_cert: tuple[rsa.RSAPrivateKey, x509.Certificate],
@@ -3,23 +3,35 @@ import json
 import random
 import zlib
 from base64 import b64encode
+from pathlib import Path
 from typing import Literal, TypedDict
 from unittest.mock import patch
 from urllib.parse import quote_plus
 
 from django.test import TestCase, override_settings
 
+import jwcrypto.jwe
+import jwcrypto.jwk
 import pytest
 
 from emails.utils import (
     InvalidFromHeader,
+    TrackerIndex,
+    TrackerMatcher,
+    build_tracker_index,
+    count_tracker,
     decode_dict_gza85,
+    decrypt_reply_metadata,
+    derive_reply_keys,
     encode_dict_gza85,
+    encrypt_reply_metadata,
     generate_from_header,
     get_domains_from_settings,
     get_email_domain_from_settings,
     parse_email_header,
     remove_trackers,
+    store_tracker_index,
+    tracker_index,
 )
 
 
@@ -249,17 +261,19 @@ class RemoveTrackers(TestCase):
         )
 
     def setUp(self):
-        self.patcher1 = patch(
-            "emails.utils.general_trackers",
-            return_value=["trckr.com", "open.tracker.com"],
+        general = ("trckr.com", "open.tracker.com")
+        strict = ("strict.tracker.com",)
+        self.patcher = patch(
+            "emails.utils.tracker_index",
+            return_value=TrackerIndex(general, strict, TrackerMatcher(general, strict)),
         )
-        self.patcher2 = patch(
-            "emails.utils.strict_trackers", return_value=["strict.tracker.com"]
-        )
-        self.mock_general_trackers = self.patcher1.start()
-        self.mock_strict_trackers = self.patcher2.start()
-        self.addCleanup(self.patcher1.stop)
-        self.addCleanup(self.patcher2.stop)
+        self.mock_tracker_index = self.patcher.start()
+        self.addCleanup(self.patcher.stop)
+
+    def test_tracker_index_read_once(self):
+        content = '<a href="https://open.tracker.com/foo/bar.html">A link</a>'
+        remove_trackers(content, self.from_address, self.datetime_now)
+        self.mock_tracker_index.assert_called_once_with()
 
     def test_simple_general_tracker_replaced_with_relay_content(self):
         content = (
@@ -392,6 +406,95 @@ class RemoveTrackers(TestCase):
         assert general_removed == 0
         assert general_count == 0
 
+    def test_strict_tracker_counted_in_level_two(self):
+        content = (
+            '<a href="https://strict.tracker.com/foo/bar.html">A link</a>\n'
+            + '<img src="https://open.tracker.com/foo/bar.jpg">An image</img>'
+        )
+        with self.assertLogs("eventsinfo") as logs:
+            _, tracker_details = remove_trackers(
+                content, self.from_address, self.datetime_now
+            )
+
+        assert tracker_details["tracker_removed"] == 1
+        assert tracker_details["level_one"] == {
+            "count": 1,
+            "trackers": {"open.tracker.com": 1},
+        }
+        assert getattr(logs.records[0], "level_two") == {
+            "count": 1,
+            "trackers": {"strict.tracker.com": 1},
+        }
+
+
+def test_tracker_matcher_finds_domains_in_links() -> None:
+    matcher = TrackerMatcher(["trckr.com", "open.tracker.com"], ["tracker.com"])
+    content = (
+        '<a href="https://foo.open.tracker.com/bar">Link</a>'
+        " trckr.com is not in a link"
+        " <img src='http://notrckr.com/pixel.gif'>"
+    )
+    assert matcher.find(content) == {"open.tracker.com", "tracker.com"}
+
+
+def test_count_tracker_counts_in_list_order() -> None:
+    content = (
+        "<a href='https://open.tracker.com/?src=x.trckr.com'>Link</a>"
+        "<img src='https://trckr.com/pixel.gif'>"
+    )
+    assert count_tracker(content, ["trckr.com", "open.tracker.com"]) == {
+        "count": 2,
+        "trackers": {"trckr.com": 2},
+    }
+    assert count_tracker(content, ["open.tracker.com", "trckr.com"]) == {
+        "count": 2,
+        "trackers": {"open.tracker.com": 1, "trckr.com": 1},
+    }
+
+
+def test_build_tracker_index_stores_lists(tmp_path: Path) -> None:
+    (tmp_path / "level-one-trackers.json").write_text('["trckr.com"]')
+    (tmp_path / "level-two-trackers.json").write_text('["strict.tracker.com"]')
+
+    index = build_tracker_index(tmp_path)
+
+    assert index.general == ("trckr.com",)
+    assert index.strict == ("strict.tracker.com",)
+    assert index.file_key is not None
+    assert json.loads((tmp_path / "tracker-index.json").read_text()) == {
+        "general": ["trckr.com"],
+        "strict": ["strict.tracker.com"],
+    }
+
+
+def test_tracker_index_without_lists_does_not_download(tmp_path: Path) -> None:
+    with (
+        patch("emails.utils.TRACKER_FOLDER_PATH", tmp_path),
+        patch("emails.utils._tracker_index", None),
+        patch("emails.utils.requests.get") as mock_get,
+    ):
+        index = tracker_index()
+    assert index.general == ()
+    assert index.strict == ()
+    assert index.file_key is None
+    mock_get.assert_not_called()
+
+
+def test_tracker_index_reloads_replaced_index(tmp_path: Path) -> None:
+    store_tracker_index(["trckr.com"], [], tmp_path)
+    with (
+        patch("emails.utils.TRACKER_FOLDER_PATH", tmp_path),
+        patch("emails.utils._tracker_index", None),
+    ):
+        index = tracker_index()
+        assert tracker_index() is index
+        store_tracker_index(["trckr.com", "open.tracker.com"], ["strict.com"], tmp_path)
+        new_index = tracker_index()
+    assert index.general == ("trckr.com",)
+    assert new_index.general == ("trckr.com", "open.tracker.com")
+    assert new_index.strict == ("strict.com",)
+    assert new_index.matcher.domains == {"trckr.com", "open.tracker.com", "strict.com"}
+
 
 def test_encode_dict_gza85() -> None:
     data = {"key": "value"}
@@ -446,3 +549,59 @@ def test_decode_dict_gza85_invalid_encoded_raises(
 ):
     with pytest.raises(expected_error, match=expected_regex):
         decode_dict_gza85(invalid_encoded)
+
+
+REPLY_MESSAGE_ID = b"<forwarded@test.com>"
+REPLY_METADATA = {
+    "message-id": "<original@example.com>",
+    "from": "Sender <sender@example.com>",
+}
+# Reply.encrypted_metadata values encrypted by jwcrypto, with the key for
+# REPLY_MESSAGE_ID. The second has a different protected header.
+JWCRYPTO_REPLY_METADATA = (
+    "eyJhbGciOiAiZGlyIiwgImVuYyI6ICJBMjU2R0NNIn0..I7X5KQkt_YTiZLFa.CDAmbF8MVMJJAc14qpLE"
+    "8PxLyNDMU51JIT1ItE-QqnafMgRya_7aimWAmidwiZv1FsYoBMKmbR2Yxj8W5CCdAF0Nn0SYOsqWmIe5V"
+    "X4WJw.at8IGgqt4aDAw-OSu3_r_Q"
+)
+JWCRYPTO_REPLY_METADATA_OTHER_HEADER = (
+    "eyJlbmMiOiAiQTI1NkdDTSIsICJhbGciOiAiZGlyIiwgImtpZCI6ICJ4In0..eCJUuXoVT5v8vU4p.hO"
+    "iQhA-qPyWS9gJL1awRkW2BNEKaEKf7R6aEiY_P1BJZ-bsZSpORSokCYs-r7-rcR0gNxJdsrbVlOcdKdZ"
+    "BU-DuSKJwsKsDLzu5d43Gapg.n4hQDxBAn6p4_qA-FS2KPg"
+)
+
+
+def _jwcrypto_key(key: bytes) -> jwcrypto.jwk.JWK:
+    return jwcrypto.jwk.JWK(
+        kty="oct", k=base64.urlsafe_b64encode(key).rstrip(b"=").decode("ascii")
+    )
+
+
+@pytest.mark.parametrize(
+    "jwe", (JWCRYPTO_REPLY_METADATA, JWCRYPTO_REPLY_METADATA_OTHER_HEADER)
+)
+def test_decrypt_reply_metadata_from_jwcrypto(jwe: str) -> None:
+    _, key = derive_reply_keys(REPLY_MESSAGE_ID)
+    assert json.loads(decrypt_reply_metadata(key, jwe)) == REPLY_METADATA
+
+
+def test_encrypt_reply_metadata_same_format_as_jwcrypto() -> None:
+    _, key = derive_reply_keys(REPLY_MESSAGE_ID)
+    encrypted = encrypt_reply_metadata(key, REPLY_METADATA)
+    assert encrypted.split(".")[:2] == JWCRYPTO_REPLY_METADATA.split(".")[:2]
+    jwe = jwcrypto.jwe.JWE()
+    jwe.deserialize(encrypted)
+    jwe.decrypt(_jwcrypto_key(key))
+    assert json.loads(jwe.plaintext) == REPLY_METADATA
+    assert json.loads(decrypt_reply_metadata(key, encrypted)) == REPLY_METADATA
+
+
+def test_encrypt_reply_metadata_uses_new_iv() -> None:
+    _, key = derive_reply_keys(REPLY_MESSAGE_ID)
+    first = encrypt_reply_metadata(key, REPLY_METADATA)
+    assert encrypt_reply_metadata(key, REPLY_METADATA) != first
+
+
+def test_decrypt_reply_metadata_wrong_key_raises() -> None:
+    _, other_key = derive_reply_keys(b"<other@test.com>")
+    with pytest.raises(jwcrypto.jwe.InvalidJWEData):
+        decrypt_reply_metadata(other_key, JWCRYPTO_REPLY_METADATA)
@@ -14,8 +14,10 @@ from uuid import uuid4
 
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
 from django.http import HttpResponse
+from django.template.loader import render_to_string
 from django.test import Client, SimpleTestCase, TestCase, override_settings
 
 import pytest
@@ -24,7 +26,7 @@ from botocore.exceptions import ClientError
 from markus.main import MetricsRecord
 from markus.testing import MetricsMock
 from model_bakery import baker
-from waffle.testutils import override_flag
+from waffle.testutils import override_flag, override_sample
 
 from emails.models import (
     DeletedAddress,
@@ -33,7 +35,7 @@ from emails.models import (
     Reply,
     address_hash,
 )
-from emails.policy import relay_policy
+from emails.policy import RelayHeaderRegistry, relay_policy
 from emails.types import AWS_SNSMessageJSON, OutgoingHeaders
 from emails.utils import (
     InvalidFromHeader,
@@ -48,6 +50,8 @@ from emails.utils import (
 from emails.views import (
     EmailDroppedReason,
     RawComplaintData,
+    RecipientContext,
+    ReplyContext,
     ReplyHeadersNotFound,
     _build_disabled_mask_for_spam_email,
     _build_reply_requires_premium_email,
@@ -56,8 +60,10 @@ from emails.views import (
     _get_address,
     _get_address_if_exists,
     _get_complaint_data,
-    _get_keys_from_headers,
     _get_mask_by_metrics_id,
+    _get_recipient,
+    _get_reply_from_headers,
+    _get_wrapped_email_fragments,
     _record_receipt_verdicts,
     _replace_headers,
     _set_forwarded_first_reply,
@@ -66,6 +72,7 @@ from emails.views import (
     log_email_dropped,
     reply_requires_premium_test,
     validate_sns_arn_and_type,
+    wrap_html_email,
     wrapped_email_test,
 )
 from privaterelay.ftl_bundles import main
@@ -79,6 +86,7 @@ from privaterelay.tests.utils import (
     make_premium_test_user,
     upgrade_test_user_to_premium,
 )
+from privaterelay.utils import get_subplat_upgrade_link_by_language
 
 # Load the sns json fixtures from files
 real_abs_cwd = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
@@ -398,7 +406,9 @@ class SNSNotificationTestBase(TestCase):
         source = self.mock_send_raw_email.call_args[1]["Source"]
         destinations = self.mock_send_raw_email.call_args[1]["Destinations"]
         assert len(destinations) == 1
-        raw_message = self.mock_send_raw_email.call_args[1]["RawMessage"]["Data"]
+        raw_data = self.mock_send_raw_email.call_args[1]["RawMessage"]["Data"]
+        assert isinstance(raw_data, bytes)
+        raw_message = raw_data.decode()
         assert "\n\n" in raw_message, "Never found message body!"
         if expected_source is not None:
             assert source == expected_source
@@ -731,6 +741,7 @@ class SNSNotificationIncomingTest(SNSNotificationTestBase):
         )
         mock_logger.info.assert_not_called()
 
+    @override_sample("header_defect_sample", active=True)
     @patch("emails.views.info_logger")
     def test_invalid_message_id_is_forwarded(self, mock_logger: Mock) -> None:
         email_text = EMAIL_INCOMING["message_id_in_brackets"]
@@ -1004,7 +1015,8 @@ class SNSNotificationRepliesTest(SNSNotificationTestBase):
         response = _sns_notification(EMAIL_SNS_BODIES["s3_stored_replies"])
         assert response.status_code == 200
         self.mock_send_raw_email.assert_called_once()
-        raw_message = self.mock_send_raw_email.call_args[1]["RawMessage"]["Data"]
+        raw_data = self.mock_send_raw_email.call_args[1]["RawMessage"]["Data"]
+        raw_message = raw_data.decode()
         assert "source@sender.com" not in raw_message.lower()
         assert "a1b2c3d4@test.com" in raw_message
 
@@ -1344,7 +1356,8 @@ class ComplaintHandlingTest(TestCase):
         call = self.mock_ses_client.send_raw_email.call_args
         assert call.kwargs["Source"] == settings.RELAY_FROM_ADDRESS
         assert call.kwargs["Destinations"] == [self.user.email]
-        msg_without_newlines = call.kwargs["RawMessage"]["Data"].replace("\n", "")
+        raw_message = call.kwargs["RawMessage"]["Data"].decode()
+        msg_without_newlines = raw_message.replace("\n", "")
         assert "This mask has been deactivated" in msg_without_newlines
         assert self.ra.full_address in msg_without_newlines
 
@@ -2101,19 +2114,19 @@ class SNSNotificationRemoveEmailsInS3Test(TestCase):
         assert response.content == b"noreply address is not supported."
 
     @override_settings(STATSD_ENABLED=True)
-    @patch("emails.views._get_keys_from_headers")
+    @patch("emails.views._get_reply_from_headers")
     def test_noreply_headers_reply_email_in_s3_deleted(
-        self, mocked_get_keys: Mock
+        self, mocked_get_reply: Mock
     ) -> None:
         """
         If replies@... email has no "In-Reply-To" header, delete email, return 400.
         """
-        mocked_get_keys.side_effect = ReplyHeadersNotFound()
+        mocked_get_reply.side_effect = ReplyHeadersNotFound()
 
         with MetricsMock() as mm:
             response = _sns_notification(EMAIL_SNS_BODIES["s3_stored_replies"])
         mm.assert_incr_once("reply_email_header_error", tags=["detail:no-header"])
-        mocked_get_keys.assert_called_once()
+        mocked_get_reply.assert_called_once()
         self.mock_remove_message_from_s3.assert_called_once_with(self.bucket, self.key)
         assert response.status_code == 400
 
@@ -2134,34 +2147,32 @@ class SNSNotificationRemoveEmailsInS3Test(TestCase):
         assert response.status_code == 400
 
     @override_settings(STATSD_ENABLED=True)
-    @patch("emails.views._get_reply_record_from_lookup_key")
+    @patch("emails.views._get_reply_from_headers")
     def test_no_reply_record_reply_email_in_s3_deleted(
-        self, mocked_get_record: Mock
+        self, mocked_get_reply: Mock
     ) -> None:
         """If no DB match for In-Reply-To header, delete email, return 404."""
-        mocked_get_record.side_effect = Reply.DoesNotExist()
+        mocked_get_reply.side_effect = Reply.DoesNotExist()
 
         with MetricsMock() as mm:
             response = _sns_notification(EMAIL_SNS_BODIES["s3_stored_replies"])
         mm.assert_incr_once("reply_email_header_error", tags=["detail:no-reply-record"])
-        mocked_get_record.assert_called_once()
+        mocked_get_reply.assert_called_once()
         self.mock_remove_message_from_s3.assert_called_once_with(self.bucket, self.key)
         assert response.status_code == 404
 
     @override_settings(STATSD_ENABLED=True)
-    @patch("emails.views._get_keys_from_headers")
-    @patch("emails.views._get_reply_record_from_lookup_key")
+    @patch("emails.views._get_reply_from_headers")
     def test_no_reply_record_reply_email_not_in_s3_deleted_ignored(
-        self, mocked_get_record: Mock, mocked_get_keys: Mock
+        self, mocked_get_reply: Mock
     ) -> None:
         """If no DB match for In-Reply-To header, return 404."""
-        mocked_get_keys.return_value = ("lookup", "encryption")
-        mocked_get_record.side_effect = Reply.DoesNotExist()
+        mocked_get_reply.side_effect = Reply.DoesNotExist()
 
         with MetricsMock() as mm:
             response = _sns_notification(EMAIL_SNS_BODIES["replies"])
         mm.assert_incr_once("reply_email_header_error", tags=["detail:no-reply-record"])
-        mocked_get_record.assert_called_once()
+        mocked_get_reply.assert_called_once()
         self.mock_remove_message_from_s3.assert_called_once_with(None, None)
         assert response.status_code == 404
 
@@ -2300,9 +2311,9 @@ class SNSNotificationValidUserEmailsInS3Test(TestCase):
         self.assert_log_incoming_email_dropped(caplog, "user_deactivated")
 
     @patch("emails.views._reply_allowed")
-    @patch("emails.views._get_reply_record_from_lookup_key")
+    @patch("emails.views._get_reply_from_headers")
     def test_reply_not_allowed_email_in_s3_deleted(
-        self, mocked_reply_record: Mock, mocked_reply_allowed: Mock
+        self, mocked_get_reply: Mock, mocked_reply_allowed: Mock
     ) -> None:
         # external user sending a reply to Relay user
         # where the replies were being exchanged but now the user
@@ -2312,7 +2323,7 @@ class SNSNotificationValidUserEmailsInS3Test(TestCase):
         # Mock the reply record to have the same user as the address (MPP-4633 fix)
         mock_reply = Mock()
         mock_reply.address = self.address
-        mocked_reply_record.return_value = mock_reply
+        mocked_get_reply.return_value = ReplyContext(mock_reply, b"encryption_key")
 
         with self.assertLogs(INFO_LOG) as caplog:
             response = _sns_notification(EMAIL_SNS_BODIES["s3_stored"])
@@ -2467,11 +2478,8 @@ class SNSNotificationValidUserEmailsInS3Test(TestCase):
             tags=["dmarcPolicy:reject", "dmarcVerdict:FAIL"],
         )
 
-    @patch("emails.views._get_keys_from_headers")
-    @patch("emails.views._get_reply_record_from_lookup_key")
-    def test_cross_account_reply_bypass_blocked(
-        self, mocked_reply_record: Mock, mocked_get_keys: Mock
-    ) -> None:
+    @patch("emails.views._get_reply_from_headers")
+    def test_cross_account_reply_bypass_blocked(self, mocked_get_reply: Mock) -> None:
         """
         Security test for MPP-4633: Verify that reply records from a different user
         cannot be used to bypass victim mask policies.
@@ -2492,8 +2500,7 @@ class SNSNotificationValidUserEmailsInS3Test(TestCase):
         self.address.enabled = False
         self.address.save()
         # Mock the reply lookup to return the attacker's reply record
-        mocked_get_keys.return_value = ("lookup_key", "encryption_key")
-        mocked_reply_record.return_value = attacker_reply
+        mocked_get_reply.return_value = ReplyContext(attacker_reply, b"encryption_key")
 
         # Send email to victim's mask with attacker's Message-ID in In-Reply-To
         with self.assertLogs(GLEAN_LOG) as caplog, MetricsMock() as mm:
@@ -2714,6 +2721,39 @@ class GetAddressTest(TestCase):
             _get_address("unknown@subdomain.test.com", create=False)
         assert DomainAddress.objects.filter(user=self.user).count() == 1
 
+    def test_existing_domain_address_does_not_lock_profile(self) -> None:
+        cache.delete("subdomain_user:subdomain")
+        with patch.object(
+            Profile.objects,
+            "select_for_update",
+            wraps=Profile.objects.select_for_update,
+        ) as mock_select_for_update:
+            for _ in range(2):
+                assert _get_address("domain@subdomain.test.com") == self.domain_address
+        mock_select_for_update.assert_not_called()
+        assert cache.get("subdomain_user:subdomain") == self.user.id
+        self.domain_address.refresh_from_db()
+        assert self.domain_address.last_used_at is not None
+
+    def test_existing_domain_address_with_stale_subdomain_user(self) -> None:
+        other_user = make_premium_test_user()
+        other_user.profile.subdomain = "other"
+        other_user.profile.save()
+        baker.make(DomainAddress, user=other_user, address="domain")
+        cache.set("subdomain_user:subdomain", other_user.id)
+        assert _get_address("domain@subdomain.test.com") == self.domain_address
+        assert cache.get("subdomain_user:subdomain") == self.user.id
+
+    def test_unknown_domain_address_locks_profile(self) -> None:
+        with patch.object(
+            Profile.objects,
+            "select_for_update",
+            wraps=Profile.objects.select_for_update,
+        ) as mock_select_for_update:
+            address = _get_address("unknown@subdomain.test.com")
+        assert address.address == "unknown"
+        mock_select_for_update.assert_called_once_with()
+
     def test_uppercase_local_part_of_unknown_domain_address(self) -> None:
         """
         Uppercase letters are allowed in the local part of a new domain address.
@@ -2756,6 +2796,60 @@ class GetAddressTest(TestCase):
         assert DomainAddress.objects.filter(user=self.user).count() == 1
 
 
+class GetRecipientTest(TestCase):
+    """Tests for _get_recipient, with a query budget for the email pipeline"""
+
+    def setUp(self) -> None:
+        self.user = make_premium_test_user()
+        self.user.profile.subdomain = "subdomain"
+        self.user.profile.save()
+        self.relay_address = baker.make(
+            RelayAddress, user=self.user, address="relay123"
+        )
+        self.domain_address = baker.make(
+            DomainAddress, user=self.user, address="domain"
+        )
+
+    def assert_no_queries_for_user_data(self, recipient: RecipientContext) -> None:
+        with self.assertNumQueries(0):
+            profile = recipient.profile
+            assert recipient.address.user is profile.user
+            assert profile.user == self.user
+            assert profile.fxa is not None
+            assert profile.has_premium
+            assert profile.language == "en"
+            assert profile.user.is_active
+
+    def test_relay_address_loaded_in_two_queries(self) -> None:
+        with self.assertNumQueries(2):
+            recipient = _get_recipient("relay123@test.com")
+        assert recipient.address == self.relay_address
+        self.assert_no_queries_for_user_data(recipient)
+
+    def test_domain_address_loaded_in_three_queries(self) -> None:
+        """The address with the profile, last_used_at, and the Mozilla account"""
+        cache.clear()
+        for _ in range(2):  # Without and with the cached subdomain user
+            with self.assertNumQueries(3):
+                recipient = _get_recipient("domain@subdomain.test.com")
+            assert recipient.address == self.domain_address
+            self.assert_no_queries_for_user_data(recipient)
+
+    def test_get_address_does_not_load_account(self) -> None:
+        """Only _get_recipient loads the Mozilla account, for the email pipeline"""
+        with self.assertNumQueries(1):
+            _get_address("relay123@test.com", create=False)
+
+    def test_created_domain_address_loads_user_data(self) -> None:
+        recipient = _get_recipient("new@subdomain.test.com")
+        assert recipient.address.address == "new"
+        self.assert_no_queries_for_user_data(recipient)
+
+    def test_unknown_relay_address_raises(self) -> None:
+        with pytest.raises(RelayAddress.DoesNotExist):
+            _get_recipient("unknown@test.com")
+
+
 @override_settings(SITE_ORIGIN="https://test.com", STATSD_ENABLED=True)
 class GetAddressIfExistsTest(TestCase):
     def setUp(self):
@@ -3073,6 +3167,127 @@ def test_wrapped_email_test(
         assert "/tracker-report/#" not in no_space_html
 
 
+@pytest.mark.parametrize(
+    "original_html",
+    (
+        "<p>Hello</p>",
+        "",
+        "\n\n  <p>Blank lines</p>\n \t\n<p>Indented</p>  \n\n",
+        "<p>Windows</p>\r\n\r\n<p>line endings</p>\r",
+        "<p>Other\x0bline\x85breaks</p>",
+    ),
+)
+@pytest.mark.parametrize("has_premium", (True, False))
+@pytest.mark.django_db
+def test_wrap_html_email_same_as_template(
+    original_html: str, has_premium: bool
+) -> None:
+    _get_wrapped_email_fragments.cache_clear()
+    email_context = {
+        "original_html": original_html,
+        "language": "en",
+        "has_premium": has_premium,
+        "subplat_upgrade_link": get_subplat_upgrade_link_by_language("en"),
+        "display_email": "mask<span>@</span>test.com",
+        "tracker_report_link": "https://test.com/tracker-report/#{}",
+        "num_level_one_email_trackers_removed": 2,
+        "SITE_ORIGIN": settings.SITE_ORIGIN,
+    }
+    content = render_to_string("emails/wrapped_email.html", email_context)
+    expected = "\n".join(line for line in content.splitlines() if line.strip()) + "\n"
+
+    for _ in range(2):
+        wrapped = wrap_html_email(
+            original_html,
+            "en",
+            has_premium,
+            "mask<span>@</span>test.com",
+            num_level_one_email_trackers_removed=2,
+            tracker_report_link="https://test.com/tracker-report/#{}",
+        )
+        assert wrapped == expected
+    assert _get_wrapped_email_fragments.cache_info().hits == 1
+
+
+@pytest.mark.django_db
+def test_wrap_html_email_holiday_promo() -> None:
+    _get_wrapped_email_fragments.cache_clear()
+    wrapped = wrap_html_email("<p>Hello</p>", "en", False, "mask@test.com")
+    assert "HOLIDAY20" not in wrapped
+    with override_flag("holiday_promo_2023", active=True):
+        wrapped = wrap_html_email("<p>Hello</p>", "en", False, "mask@test.com")
+    assert "HOLIDAY20" in wrapped
+
+
+@pytest.mark.parametrize(
+    "display_email",
+    ("other<span>@</span>test.com", 'a&b"<c><span>@</span>test.com'),
+)
+@pytest.mark.parametrize(
+    "num_removed,tracker_report_link",
+    (
+        (None, None),
+        (0, ""),
+        (0, 'https://test.com/tracker-report/#{"trackers": {}}'),
+        (1, 'https://test.com/tracker-report/#{"trackers": {"a.com": 1}}'),
+        (3, 'https://test.com/tracker-report/#{"trackers": {"a.com": 3}}'),
+    ),
+)
+@pytest.mark.django_db
+def test_wrap_html_email_values_same_as_template(
+    display_email: str, num_removed: int | None, tracker_report_link: str | None
+) -> None:
+    email_context = {
+        "original_html": "<p>Hello</p>",
+        "language": "en",
+        "has_premium": True,
+        "subplat_upgrade_link": get_subplat_upgrade_link_by_language("en"),
+        "display_email": display_email,
+        "tracker_report_link": tracker_report_link,
+        "num_level_one_email_trackers_removed": num_removed,
+        "SITE_ORIGIN": settings.SITE_ORIGIN,
+    }
+    content = render_to_string("emails/wrapped_email.html", email_context)
+    expected = "\n".join(line for line in content.splitlines() if line.strip()) + "\n"
+    wrapped = wrap_html_email(
+        "<p>Hello</p>",
+        "en",
+        True,
+        display_email,
+        num_level_one_email_trackers_removed=num_removed,
+        tracker_report_link=tracker_report_link,
+    )
+    assert wrapped == expected
+
+
+@pytest.mark.django_db
+def test_wrap_html_email_cached_for_other_masks() -> None:
+    """The cached header and footer are used for other masks and report links."""
+    _get_wrapped_email_fragments.cache_clear()
+    first = wrap_html_email(
+        "<p>Hello</p>",
+        "en",
+        False,
+        "first<span>@</span>test.com",
+        num_level_one_email_trackers_removed=1,
+        tracker_report_link="https://test.com/tracker-report/#1",
+    )
+    second = wrap_html_email(
+        "<p>Hello</p>",
+        "en",
+        False,
+        "second<span>@</span>test.com",
+        num_level_one_email_trackers_removed=2,
+        tracker_report_link="https://test.com/tracker-report/#2",
+    )
+    assert _get_wrapped_email_fragments.cache_info().hits == 1
+    assert "first@test.com" in first
+    assert "tracker-report/#1" in first
+    assert "second@test.com" in second
+    assert "tracker-report/#2" in second
+    assert "first" not in second
+
+
 @pytest.mark.parametrize("forwarded", ("False", "True"))
 @pytest.mark.parametrize("content_type", ("text/plain", "text/html"))
 @pytest.mark.django_db
@@ -3281,45 +3496,69 @@ def test_check_email_from_list(headers, expected):
     assert _check_email_from_list(headers) is expected
 
 
-def test_get_keys_from_headers_no_reply_headers(settings):
+def test_get_reply_from_headers_no_reply_headers(settings):
     """If no reply headers, raise ReplyHeadersNotFound."""
     msg_id = "<msg-id-123@email.com>"
     headers = [{"name": "Message-Id", "value": msg_id}]
     settings.STATSD_ENABLED = True
     with MetricsMock() as mm, pytest.raises(ReplyHeadersNotFound):
-        _get_keys_from_headers(headers)
+        _get_reply_from_headers(headers)
     mm.assert_incr_once("mail_to_replies_without_reply_headers")
 
 
-def test_get_keys_from_headers_in_reply_to():
-    """If In-Reply-To header, get keys from it."""
+@pytest.mark.django_db
+def test_get_reply_from_headers_in_reply_to():
+    """If In-Reply-To header, get the Reply and encryption key from it."""
     msg_id = "<msg-id-123@email.com>"
     msg_id_bytes = get_message_id_bytes(msg_id)
     lookup_key, encryption_key = derive_reply_keys(msg_id_bytes)
+    reply = baker.make(Reply, lookup=b64_lookup_key(lookup_key))
     headers = [{"name": "In-Reply-To", "value": msg_id}]
-    lookup_key_from_header, encryption_key_from_header = _get_keys_from_headers(headers)
-    assert lookup_key == lookup_key_from_header
-    assert encryption_key == encryption_key_from_header
+    assert _get_reply_from_headers(headers) == ReplyContext(reply, encryption_key)
+
+
+@pytest.mark.django_db
+def test_get_reply_from_headers_in_reply_to_reply_dne():
+    """If no Reply record for the In-Reply-To header, raise Reply.DoesNotExist."""
+    headers = [{"name": "In-Reply-To", "value": "<msg-id-123@email.com>"}]
+    with pytest.raises(Reply.DoesNotExist):
+        _get_reply_from_headers(headers)
 
 
 @pytest.mark.django_db
-def test_get_keys_from_headers_references_reply():
+def test_get_reply_from_headers_references_reply(django_assert_num_queries):
     """
-    If no In-Reply-To header, get keys from References header.
+    If no In-Reply-To header, get the Reply from the References header in one query.
     """
     msg_id = "<msg-id-456@email.com"
     msg_id_bytes = get_message_id_bytes(msg_id)
     lookup_key, encryption_key = derive_reply_keys(msg_id_bytes)
-    baker.make(Reply, lookup=b64_lookup_key(lookup_key))
+    user = make_premium_test_user()
+    address = baker.make(RelayAddress, user=user)
+    baker.make(Reply, lookup=b64_lookup_key(lookup_key), relay_address=address)
     msg_ids = f"<msg-id-123@email.com> {msg_id} <msg-id-789@email.com>"
     headers = [{"name": "References", "value": msg_ids}]
-    lookup_key_from_header, encryption_key_from_header = _get_keys_from_headers(headers)
-    assert lookup_key == lookup_key_from_header
-    assert encryption_key == encryption_key_from_header
+    # One query for the Reply, mask, user, and profile, and one for the FxA account
+    with django_assert_num_queries(2):
+        reply, encryption_key_from_header = _get_reply_from_headers(headers)
+        assert reply.owner_has_premium
+    assert reply.lookup == b64_lookup_key(lookup_key)
+    assert encryption_key_from_header == encryption_key
 
 
 @pytest.mark.django_db
-def test_get_keys_from_headers_references_reply_dne():
+def test_get_reply_from_headers_references_first_reply():
+    """If several References have a Reply record, the first message ID is used."""
+    msg_ids = ["<msg-id-123@email.com>", "<msg-id-456@email.com>"]
+    keys = [derive_reply_keys(get_message_id_bytes(msg_id)) for msg_id in msg_ids]
+    baker.make(Reply, lookup=b64_lookup_key(keys[1][0]))
+    first_reply = baker.make(Reply, lookup=b64_lookup_key(keys[0][0]))
+    headers = [{"name": "References", "value": " ".join(msg_ids)}]
+    assert _get_reply_from_headers(headers) == ReplyContext(first_reply, keys[0][1])
+
+
+@pytest.mark.django_db
+def test_get_reply_from_headers_references_reply_dne():
     """
     If no In-Reply-To header,
     and no Reply record for any values in the References header,
@@ -3328,7 +3567,7 @@ def test_get_keys_from_headers_references_reply_dne():
     msg_ids = "<msg-id-123@email.com> <msg-id-456@email.com> <msg-id-789@email.com>"
     headers = [{"name": "References", "value": msg_ids}]
     with pytest.raises(Reply.DoesNotExist):
-        _get_keys_from_headers(headers)
+        _get_reply_from_headers(headers)
 
 
 def test_replace_headers_read_error_is_handled() -> None:
@@ -3394,6 +3633,40 @@ def test_replace_headers_read_error_is_handled() -> None:
         assert email[name] == value
 
 
+@pytest.mark.parametrize("check_dropped_headers", (True, False))
+def test_replace_headers_check_dropped_headers(check_dropped_headers: bool) -> None:
+    """Dropped headers are only parsed for defects when check_dropped_headers=True."""
+    email_text = EMAIL_INCOMING["message_id_in_brackets"]
+    email = message_from_string(email_text, policy=relay_policy)
+    assert isinstance(email, EmailMessage)
+    new_headers: OutgoingHeaders = {
+        "Subject": "Dropped Header Test",
+        "From": "from@example.com",
+        "To": "to@example.com",
+    }
+
+    with patch.object(
+        RelayHeaderRegistry,
+        "__call__",
+        autospec=True,
+        side_effect=RelayHeaderRegistry.__call__,
+    ) as mock_parse:
+        issues = _replace_headers(
+            email, new_headers, check_dropped_headers=check_dropped_headers
+        )
+
+    parsed = {call.args[1] for call in mock_parse.call_args_list}
+    if check_dropped_headers:
+        assert "Message-ID" in parsed
+        assert [issue["header"] for issue in issues] == ["Message-ID"]
+    else:
+        assert "Message-ID" not in parsed
+        assert issues == []
+    assert "Message-ID" not in email
+    for name, value in new_headers.items():
+        assert email[name] == value
+
+
 @pytest.mark.django_db
 def test_opt_out_user_has_minimal_email_dropped_log(caplog):
     user = baker.make(User, email="opt-out@example.com")
@@ -4,16 +4,17 @@ import base64
 import contextlib
 import json
 import logging
+import os
 import pathlib
 import re
 import zlib
-from collections.abc import Callable
+from collections.abc import Callable, Iterable, Sequence
 from email.errors import HeaderParseError, InvalidHeaderDefect
 from email.headerregistry import Address, AddressHeader
 from email.message import EmailMessage
 from email.utils import formataddr, parseaddr
-from functools import cache
-from typing import Any, Literal, TypeVar, cast
+from functools import cache, lru_cache
+from typing import Any, Literal, NamedTuple, TypeVar, cast
 from urllib.parse import quote_plus, urlparse
 
 from django.conf import settings
@@ -22,13 +23,16 @@ from django.template.defaultfilters import linebreaksbr, urlize
 from django.template.loader import render_to_string
 from django.utils.text import Truncator
 
+import jwcrypto.common
 import jwcrypto.jwe
 import jwcrypto.jwk
 import markus
 import requests
 from allauth.socialaccount.models import SocialAccount
 from botocore.exceptions import ClientError
+from cryptography.exceptions import InvalidTag
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.primitives.kdf.hkdf import HKDFExpand
 from mypy_boto3_ses.type_defs import ContentTypeDef, SendRawEmailResponseTypeDef
 
@@ -36,6 +40,7 @@ from privaterelay.sp3_plans import get_sp3_country_language_mapping
 from privaterelay.utils import get_countries_info_from_lang_and_mapping
 
 from .apps import s3_client, ses_client
+from .passthrough import message_as_bytes
 
 logger = logging.getLogger("events")
 info_logger = logging.getLogger("eventsinfo")
@@ -66,7 +71,7 @@ def get_domains_from_settings() -> (
     }
 
 
-def get_trackers(level):
+def get_trackers(level, path=None):
     category = "Email"
     tracker_list_name = "level-one-trackers"
     if level == 2:
@@ -76,11 +81,13 @@ def get_trackers(level):
     trackers = []
     file_name = f"{tracker_list_name}.json"
     try:
-        with open(TRACKER_FOLDER_PATH / file_name) as f:
+        with open((path or TRACKER_FOLDER_PATH) / file_name) as f:
             trackers = json.load(f)
     except FileNotFoundError:
-        trackers = download_trackers(shavar_prod_lists_url, category)
-        store_trackers(trackers, TRACKER_FOLDER_PATH, file_name)
+        # Lists are fetched by get_latest_email_tracker_lists, not on the email path
+        logger.warning(
+            "tracker_list_missing", extra={"file_name": file_name, "category": category}
+        )
     return trackers
 
 
@@ -102,14 +109,12 @@ def store_trackers(trackers, path, file_name):
         json.dump(trackers, f, indent=4)
 
 
-@cache
-def general_trackers():
-    return get_trackers(level=1)
+def general_trackers() -> tuple[str, ...]:
+    return tracker_index().general
 
 
-@cache
-def strict_trackers():
-    return get_trackers(level=2)
+def strict_trackers() -> tuple[str, ...]:
+    return tracker_index().strict
 
 
 _TimedFunction = TypeVar("_TimedFunction", bound=Callable[..., Any])
@@ -233,7 +238,7 @@ def ses_send_raw_email(
     if not settings.AWS_SES_CONFIGSET:
         raise ValueError("settings.AWS_SES_CONFIGSET must have a value")
 
-    data = message.as_string()
+    data = message_as_bytes(message)
     try:
         ses_response = client.send_raw_email(
             Source=source_address,
@@ -338,20 +343,51 @@ def derive_reply_keys(message_id: bytes) -> tuple[bytes, bytes]:
     return (lookup_key, encryption_key)
 
 
+# The protected header of the reply metadata JWE, which is also the AAD
+_REPLY_METADATA_JWE_HEADER = jwcrypto.common.base64url_encode(
+    json.dumps({"alg": "dir", "enc": "A256GCM"})
+)
+_REPLY_METADATA_JWE_AAD = _REPLY_METADATA_JWE_HEADER.encode("ascii")
+
+
 def encrypt_reply_metadata(key: bytes, payload: dict[str, str]) -> str:
-    """Encrypt the given payload into a JWE, using the given key."""
-    # This is a bit dumb, we have to base64-encode the key in order to load it :-/
-    k = jwcrypto.jwk.JWK(
-        kty="oct", k=base64.urlsafe_b64encode(key).rstrip(b"=").decode("ascii")
+    """
+    Encrypt the given payload into a JWE, using the given key.
+
+    This is the compact serialization of a JWE with direct AES-256-GCM
+    encryption, as generated by jwcrypto, without building the JWK and JWE
+    objects for each email.
+    """
+    iv = os.urandom(12)
+    # AESGCM appends the 16-byte authentication tag to the ciphertext
+    sealed = AESGCM(key).encrypt(
+        iv, json.dumps(payload).encode(), _REPLY_METADATA_JWE_AAD
     )
-    e = jwcrypto.jwe.JWE(
-        json.dumps(payload), json.dumps({"alg": "dir", "enc": "A256GCM"}), recipient=k
+    return ".".join(
+        (
+            _REPLY_METADATA_JWE_HEADER,
+            "",
+            jwcrypto.common.base64url_encode(iv),
+            jwcrypto.common.base64url_encode(sealed[:-16]),
+            jwcrypto.common.base64url_encode(sealed[-16:]),
+        )
     )
-    return cast(str, e.serialize(compact=True))
 
 
-def decrypt_reply_metadata(key, jwe):
+def decrypt_reply_metadata(key: bytes, jwe: str) -> bytes:
     """Decrypt the given JWE into a json payload, using the given key."""
+    parts = jwe.split(".")
+    if len(parts) != 5 or parts[:2] != [_REPLY_METADATA_JWE_HEADER, ""]:
+        # Not generated by encrypt_reply_metadata, use the full JWE implementation
+        return _decrypt_reply_metadata_jwe(key, jwe)
+    iv, ciphertext, tag = (jwcrypto.common.base64url_decode(p) for p in parts[2:])
+    try:
+        return AESGCM(key).decrypt(iv, ciphertext + tag, _REPLY_METADATA_JWE_AAD)
+    except InvalidTag as e:
+        raise jwcrypto.jwe.InvalidJWEData("Failed to decrypt message", e)
+
+
+def _decrypt_reply_metadata_jwe(key: bytes, jwe: str) -> bytes:
     # This is a bit dumb, we have to base64-encode the key in order to load it :-/
     k = jwcrypto.jwk.JWK(
         kty="oct", k=base64.urlsafe_b64encode(key).rstrip(b"=").decode("ascii")
@@ -359,7 +395,7 @@ def decrypt_reply_metadata(key, jwe):
     e = jwcrypto.jwe.JWE()
     e.deserialize(jwe)
     e.decrypt(k)
-    return e.plaintext
+    return cast(bytes, e.plaintext)
 
 
 def _get_bucket_and_key_from_s3_json(message_json):
@@ -445,22 +481,189 @@ def convert_domains_to_regex_patterns(domain_pattern):
     return r"""(["'])(\S*://(\S*\.)*""" + re.escape(domain_pattern) + r"\S*)\1"
 
 
-def count_tracker(html_content, trackers):
+@cache
+def _tracker_regex(tracker: str) -> re.Pattern[str]:
+    return re.compile(convert_domains_to_regex_patterns(tracker))
+
+
+_WHITESPACE_RE = re.compile(r"\s")
+_DOMAIN_START_RE = re.compile(r"://|\.")
+
+
+class TrackerMatcher:
+    """
+    Find the tracker domains that could be in the links of an HTML body.
+
+    The tracker pattern only matches a domain that follows "://" or "." in a
+    run of non-whitespace containing "://". One scan of the content collects the
+    domains in those positions, so the per-tracker regular expressions only run
+    for trackers that can match.
+    """
+
+    def __init__(self, *tracker_lists: Iterable[str]) -> None:
+        domains: set[str] = set()
+        irregular: set[str] = set()
+        for trackers in tracker_lists:
+            for tracker in trackers:
+                if not tracker or _WHITESPACE_RE.search(tracker):
+                    # The scan can not find these, always check them
+                    irregular.add(tracker)
+                else:
+                    domains.add(tracker)
+        self.domains = frozenset(domains)
+        self.irregular = frozenset(irregular)
+        self.lengths = tuple(sorted({len(domain) for domain in domains}))
+
+    def find(self, html_content: str) -> set[str]:
+        found = set(self.irregular)
+        pos = html_content.find("://")
+        while pos != -1:
+            space = _WHITESPACE_RE.search(html_content, pos)
+            end = space.start() if space else len(html_content)
+            for domain_start in _DOMAIN_START_RE.finditer(html_content, pos, end):
+                start = domain_start.end()
+                for length in self.lengths:
+                    domain = html_content[start : start + length]
+                    if domain in self.domains:
+                        found.add(domain)
+            pos = html_content.find("://", end)
+        return found
+
+
+@lru_cache(maxsize=8)
+def _build_tracker_matcher(*tracker_lists: tuple[str, ...]) -> TrackerMatcher:
+    return TrackerMatcher(*tracker_lists)
+
+
+class TrackerIndex(NamedTuple):
+    """The tracker lists, and the matcher built from them."""
+
+    general: tuple[str, ...]
+    strict: tuple[str, ...]
+    matcher: TrackerMatcher
+    # Identifies the loaded index file, None if not loaded from the file
+    file_key: tuple[int, int, int] | None = None
+
+
+TRACKER_INDEX_FILE_NAME = "tracker-index.json"
+_tracker_index: TrackerIndex | None = None
+
+
+def _tracker_index_file_key(path: pathlib.Path) -> tuple[int, int, int] | None:
+    try:
+        stat = os.stat(path / TRACKER_INDEX_FILE_NAME)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def store_tracker_index(
+    general: Sequence[str], strict: Sequence[str], path: pathlib.Path
+) -> None:
+    """Write the tracker index, replacing the old index in one step."""
+    index_path = path / TRACKER_INDEX_FILE_NAME
+    tmp_path = index_path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(
+            {"general": list(general), "strict": list(strict)},
+            f,
+            separators=(",", ":"),
+        )
+    os.replace(tmp_path, index_path)
+
+
+def build_tracker_index(path: pathlib.Path) -> TrackerIndex:
+    """Build the tracker index from the stored tracker lists, and store it."""
+    general = tuple(get_trackers(level=1, path=path))
+    strict = tuple(get_trackers(level=2, path=path))
+    store_tracker_index(general, strict, path)
+    return TrackerIndex(
+        general, strict, TrackerMatcher(general, strict), _tracker_index_file_key(path)
+    )
+
+
+def load_tracker_index(path: pathlib.Path) -> TrackerIndex:
+    """
+    Load the stored tracker index.
+
+    Without a stored index, the index is built in memory from the stored tracker
+    lists. This never downloads the lists.
+    """
+    file_key = _tracker_index_file_key(path)
+    if file_key is None:
+        general = tuple(get_trackers(level=1, path=path))
+        strict = tuple(get_trackers(level=2, path=path))
+        return TrackerIndex(general, strict, TrackerMatcher(general, strict))
+    with open(path / TRACKER_INDEX_FILE_NAME) as f:
+        data = json.load(f)
+    general = tuple(data["general"])
+    strict = tuple(data["strict"])
+    return TrackerIndex(general, strict, TrackerMatcher(general, strict), file_key)
+
+
+def tracker_index() -> TrackerIndex:
+    """
+    Get the tracker index, loading it again if the index file was replaced.
+
+    The index is loaded when the emails app is ready. Checking for a new index
+    file is a stat call, and a new index is swapped in as a whole.
+    """
+    global _tracker_index
+    index = _tracker_index
+    if index is None:
+        index = _tracker_index = load_tracker_index(TRACKER_FOLDER_PATH)
+    else:
+        file_key = _tracker_index_file_key(TRACKER_FOLDER_PATH)
+        if file_key is not None and file_key != index.file_key:
+            index = _tracker_index = load_tracker_index(TRACKER_FOLDER_PATH)
+    return index
+
+
+def _replace_trackers(
+    html_content: str,
+    trackers: Iterable[str],
+    matcher: TrackerMatcher,
+    candidates: set[str],
+    repl: str | Callable[[re.Match[str]], str],
+) -> tuple[str, int, dict[str, int]]:
+    """
+    Apply the tracker patterns in list order, like one re.subn per tracker.
+
+    Only trackers in candidates are run. A substitution changes the content, so
+    the candidates are found again for the following trackers.
+    """
     tracker_total = 0
     details = {}
-    # html_content needs to be str for count()
     for tracker in trackers:
-        pattern = convert_domains_to_regex_patterns(tracker)
-        html_content, count = re.subn(pattern, "", html_content)
+        if tracker not in candidates:
+            continue
+        html_content, count = _tracker_regex(tracker).subn(repl, html_content)
         if count:
             tracker_total += count
             details[tracker] = count
+            candidates = matcher.find(html_content)
+    return html_content, tracker_total, details
+
+
+def count_tracker(html_content, trackers, matcher=None, candidates=None):
+    if matcher is None:
+        matcher = _build_tracker_matcher(tuple(trackers))
+    if candidates is None:
+        candidates = matcher.find(html_content)
+    # html_content needs to be str for count()
+    _, tracker_total, details = _replace_trackers(
+        html_content, trackers, matcher, candidates, ""
+    )
     return {"count": tracker_total, "trackers": details}
 
 
 def count_all_trackers(html_content):
-    general_detail = count_tracker(html_content, general_trackers())
-    strict_detail = count_tracker(html_content, strict_trackers())
+    # Read once, so the lists and the matcher are from the same index file
+    index = tracker_index()
+    general, strict, matcher = index.general, index.strict, index.matcher
+    candidates = matcher.find(html_content)
+    general_detail = count_tracker(html_content, general, matcher, candidates)
+    strict_detail = count_tracker(html_content, strict, matcher, candidates)
 
     incr_if_enabled("tracker.general_count", general_detail["count"])
     incr_if_enabled("tracker.strict_count", strict_detail["count"])
@@ -471,31 +674,29 @@ def count_all_trackers(html_content):
 
 
 def remove_trackers(html_content, from_address, datetime_now, level="general"):
-    trackers = general_trackers() if level == "general" else strict_trackers()
-    tracker_removed = 0
-    changed_content = html_content
-
-    for tracker in trackers:
-        pattern = convert_domains_to_regex_patterns(tracker)
-
-        def convert_to_tracker_warning_link(matchobj):
-            quote, original_link, _ = matchobj.groups()
-            tracker_link_details = {
-                "sender": from_address,
-                "received_at": datetime_now,
-                "original_link": original_link,
-            }
-            anchor = quote_plus(json.dumps(tracker_link_details, separators=(",", ":")))
-            url = f"{settings.SITE_ORIGIN}/contains-tracker-warning/#{anchor}"
-            return f"{quote}{url}{quote}"
-
-        changed_content, matched = re.subn(
-            pattern, convert_to_tracker_warning_link, changed_content
-        )
-        tracker_removed += matched
+    # Read once, so the lists and the matcher are from the same index file
+    index = tracker_index()
+    general, strict, matcher = index.general, index.strict, index.matcher
+    trackers = general if level == "general" else strict
+    candidates = matcher.find(html_content)
+
+    def convert_to_tracker_warning_link(matchobj):
+        quote, original_link, _ = matchobj.groups()
+        tracker_link_details = {
+            "sender": from_address,
+            "received_at": datetime_now,
+            "original_link": original_link,
+        }
+        anchor = quote_plus(json.dumps(tracker_link_details, separators=(",", ":")))
+        url = f"{settings.SITE_ORIGIN}/contains-tracker-warning/#{anchor}"
+        return f"{quote}{url}{quote}"
+
+    changed_content, tracker_removed, _ = _replace_trackers(
+        html_content, trackers, matcher, candidates, convert_to_tracker_warning_link
+    )
 
-    level_one_detail = count_tracker(html_content, general_trackers())
-    level_two_detail = count_tracker(html_content, strict_trackers())
+    level_one_detail = count_tracker(html_content, general, matcher, candidates)
+    level_two_detail = count_tracker(html_content, strict, matcher, candidates)
 
     tracker_details = {
         "tracker_removed": tracker_removed,
@@ -72,13 +72,19 @@ def check_user_can_make_domain_address(user: User) -> None:
 
 def valid_address(address: str, domain: str, subdomain: str | None = None) -> bool:
     """Return if the given address parts make a valid Relay email."""
+    from .address_filter import address_filter_enabled, might_be_used
     from .models import DeletedAddress, address_hash
 
     address_pattern_valid = valid_address_pattern(address)
     address_contains_badword = has_bad_words(address)
-    address_already_deleted = DeletedAddress.objects.filter(
-        address_hash=address_hash(address, domain=domain, subdomain=subdomain)
-    ).count()
+    hash_ = address_hash(address, domain=domain, subdomain=subdomain)
+    if address_filter_enabled() and not might_be_used(hash_):
+        # The Bloom filter has every deleted address
+        address_already_deleted = 0
+    else:
+        address_already_deleted = DeletedAddress.objects.filter(
+            address_hash=hash_
+        ).count()
     if (
         address_already_deleted > 0
         or address_contains_badword
@@ -6,8 +6,9 @@ import shlex
 from datetime import UTC, datetime
 from email import message_from_bytes
 from email.iterators import _structure
-from email.message import EmailMessage
+from email.message import EmailMessage, Message
 from email.utils import parseaddr
+from functools import lru_cache
 from io import StringIO
 from json import JSONDecodeError
 from textwrap import dedent
@@ -17,20 +18,23 @@ from uuid import uuid4
 
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
 from django.db import transaction
 from django.db.models import prefetch_related_objects
 from django.http import HttpRequest, HttpResponse
 from django.shortcuts import render
+from django.template import defaultfilters
 from django.template.loader import render_to_string
-from django.utils.html import escape
+from django.utils.html import conditional_escape, escape
 from django.views.decorators.csrf import csrf_exempt
 
+import django_ftl
 from botocore.exceptions import ClientError
 from codetiming import Timer
 from decouple import strtobool
 from markus.utils import generate_tag
-from sentry_sdk import capture_message
+from sentry_sdk import capture_exception, capture_message
 from waffle import get_waffle_flag_model, sample_is_active
 
 from privaterelay.ftl_bundles import main as ftl_bundle
@@ -41,6 +45,16 @@ from privaterelay.utils import (
     glean_logger,
 )
 
+from .address_filter import (
+    address_filter_enabled,
+    find_missing_address,
+    remember_missing_address,
+)
+from .counters import (
+    flush_statistics_if_due,
+    record_statistics,
+    write_behind_enabled,
+)
 from .exceptions import CannotMakeAddressException
 from .models import (
     DeletedAddress,
@@ -50,8 +64,15 @@ from .models import (
     address_hash,
     get_domain_numerical,
 )
+from .passthrough import message_from_bytes_with_passthrough
 from .policy import relay_policy
+from .reply_buffer import (
+    buffer_reply_record,
+    flush_reply_records_if_due,
+    reply_write_behind_enabled,
+)
 from .sns import SUPPORTED_SNS_TYPES, verify_from_sns
+from .templatetags.email_extras import convert_fsi_to_span
 from .types import (
     AWS_MailJSON,
     AWS_SNSMessageJSON,
@@ -200,20 +221,107 @@ def wrap_html_email(
     tracker_report_link: str | None = None,
 ) -> str:
     """Add Relay banners, surveys, etc. to an HTML email"""
-    subplat_upgrade_link = get_subplat_upgrade_link_by_language(language)
+    show_tracker_report_link = bool(
+        num_level_one_email_trackers_removed and tracker_report_link
+    )
+    fragments = _get_wrapped_email_fragments(
+        language=language,
+        has_premium=has_premium,
+        subplat_upgrade_link=get_subplat_upgrade_link_by_language(language),
+        show_tracker_report_link=show_tracker_report_link,
+        holiday_promo_2023=flag_is_active_in_task("holiday_promo_2023", None),
+        site_origin=settings.SITE_ORIGIN,
+    )
+    with django_ftl.override(language):
+        trackers_removed = ftl_bundle.format(
+            "relay-email-trackers-removed",
+            {"number": num_level_one_email_trackers_removed},
+        )
+    # Same escaping as wrapped_email.html
+    mask_address = defaultfilters.striptags(display_email)
+    mask_url = conditional_escape(defaultfilters.urlencode(mask_address))
+    email_values = {
+        f"/accounts/profile/#{_DISPLAY_EMAIL_MARKER}": f"/accounts/profile/#{mask_url}",
+        _DISPLAY_EMAIL_MARKER: conditional_escape(mask_address),
+        _TRACKER_REPORT_LINK_MARKER: conditional_escape(tracker_report_link or ""),
+        _TRACKERS_REMOVED_MARKER: conditional_escape(
+            convert_fsi_to_span(trackers_removed)
+        ),
+    }
+    header, footer = fragments.header, fragments.footer
+    for marker, value in email_values.items():
+        header = header.replace(marker, value)
+        footer = footer.replace(marker, value)
+    return header + _remove_empty_lines(original_html, fragments.indent) + footer
+
+
+class WrappedEmailFragments(NamedTuple):
+    """The parts of wrapped_email.html around the original HTML, without empty lines"""
+
+    header: str
+    indent: str
+    footer: str
+
+
+# Rendered in place of the original HTML, to find the header and footer
+_ORIGINAL_HTML_MARKER = f"relay-original-html-{uuid4().hex}"
+# Rendered in place of the values that are different for each email
+_DISPLAY_EMAIL_MARKER = f"relay-display-email-{uuid4().hex}"
+_TRACKER_REPORT_LINK_MARKER = f"relay-tracker-report-link-{uuid4().hex}"
+_TRACKERS_REMOVED_MARKER = f"relay-trackers-removed-{uuid4().hex}"
+
+
+@lru_cache(maxsize=256)
+def _get_wrapped_email_fragments(
+    language: str,
+    has_premium: bool,
+    subplat_upgrade_link: str,
+    show_tracker_report_link: bool,
+    holiday_promo_2023: bool,
+    site_origin: str,
+) -> WrappedEmailFragments:
+    """
+    Render the header and footer of wrapped_email.html.
+
+    The original HTML is added to the cached header and footer, rather than
+    rendered with the template and scanned for empty lines with them. The mask
+    address, the tracker report link, and the text with the number of removed
+    trackers are markers, replaced for each email by wrap_html_email().
+    """
     email_context = {
-        "original_html": original_html,
+        "original_html": _ORIGINAL_HTML_MARKER,
         "language": language,
         "has_premium": has_premium,
         "subplat_upgrade_link": subplat_upgrade_link,
-        "display_email": display_email,
-        "tracker_report_link": tracker_report_link,
-        "num_level_one_email_trackers_removed": num_level_one_email_trackers_removed,
-        "SITE_ORIGIN": settings.SITE_ORIGIN,
+        "display_email": _DISPLAY_EMAIL_MARKER,
+        "tracker_report_link": (
+            _TRACKER_REPORT_LINK_MARKER if show_tracker_report_link else ""
+        ),
+        "num_level_one_email_trackers_removed": int(show_tracker_report_link),
+        "num_level_one_email_trackers_removed_text": _TRACKERS_REMOVED_MARKER,
+        "holiday_promo_2023": holiday_promo_2023,
+        "SITE_ORIGIN": site_origin,
     }
     content = render_to_string("emails/wrapped_email.html", email_context)
-    # Remove empty lines
-    content_lines = [line for line in content.splitlines() if line.strip()]
+    before, after = content.split(_ORIGINAL_HTML_MARKER)
+    header, _, indent = before.rpartition("\n")
+    if indent.strip() or not after.startswith("\n"):
+        raise ValueError("original_html must be on a line by itself")
+    return WrappedEmailFragments(
+        header=_remove_empty_lines(header),
+        indent=indent,
+        footer=_remove_empty_lines(after),
+    )
+
+
+def _remove_empty_lines(text: str, indent: str = "") -> str:
+    """Remove empty lines, end the rest with newlines, and indent the first line."""
+    lines = text.splitlines()
+    if lines and indent:
+        lines[0] = indent + lines[0]
+    content_lines = [line for line in lines if line.strip()]
+    if not content_lines:
+        return ""
     return "\n".join(content_lines) + "\n"
 
 
@@ -359,6 +467,9 @@ def _store_reply_record(
     lookup_key, encryption_key = derive_reply_keys(message_id_bytes)
     lookup = b64_lookup_key(lookup_key)
     encrypted_metadata = encrypt_reply_metadata(encryption_key, reply_metadata)
+    if reply_write_behind_enabled():
+        buffer_reply_record(lookup, encrypted_metadata, address)
+        return mail
     reply_create_args: dict[str, Any] = {
         "lookup": lookup,
         "encrypted_metadata": encrypted_metadata,
@@ -388,7 +499,30 @@ def sns_inbound(request):
         logger.error("validate_sns_arn_and_type_error", extra=error_details)
         return HttpResponse(error_details["error"], status=400)
 
-    return _sns_inbound_logic(topic_arn, message_type, verified_json_body)
+    response = _sns_inbound_logic(topic_arn, message_type, verified_json_body)
+    _flush_buffers_if_due()
+    return response
+
+
+def _flush_buffers_if_due() -> None:
+    """
+    Write the statistics and Reply records buffered by the web workers, if due.
+
+    process_emails_from_sqs flushes on a timer, but emails sent to the SNS
+    endpoint may be the only ones. A failed flush is retried later, so it does
+    not fail the request, which SNS would send again.
+    """
+    flushes = []
+    if write_behind_enabled():
+        flushes.append((flush_statistics_if_due, "email statistics"))
+    if reply_write_behind_enabled():
+        flushes.append((flush_reply_records_if_due, "Reply records"))
+    for flush, buffer_name in flushes:
+        try:
+            flush()
+        except Exception as e:
+            capture_exception(e)
+            logger.exception(f"Unable to flush {buffer_name}")
 
 
 def validate_sns_arn_and_type(
@@ -641,12 +775,7 @@ def _handle_received(message_json: AWS_SNSMessageJSON) -> HttpResponse:
         incr_if_enabled("email_for_noreply_address", 1)
         return HttpResponse("noreply address is not supported.")
     try:
-        # FIXME: this ambiguous return of either
-        # RelayAddress or DomainAddress types makes the Rustacean in me throw
-        # up a bit.
-        address = _get_address(to_address)
-        prefetch_related_objects([address.user], "socialaccount_set", "profile")
-        user_profile = address.user.profile
+        recipient = _get_recipient(to_address)
     except (
         ObjectDoesNotExist,
         CannotMakeAddressException,
@@ -658,6 +787,11 @@ def _handle_received(message_json: AWS_SNSMessageJSON) -> HttpResponse:
             response = HttpResponse("Address does not exist", status=404)
         return response
 
+    # FIXME: this ambiguous type of either
+    # RelayAddress or DomainAddress types makes the Rustacean in me throw
+    # up a bit.
+    address = recipient.address
+    user_profile = recipient.profile
     _record_receipt_verdicts(receipt, "valid_user")
     # if this is spam and the user is set to auto-block spam, early return
     if user_profile.auto_block_spam and _get_verdict(receipt, "spam") == "FAIL":
@@ -689,8 +823,7 @@ def _handle_received(message_json: AWS_SNSMessageJSON) -> HttpResponse:
 
     # check if this is a reply from an external sender to a Relay user
     try:
-        lookup_key, _ = _get_keys_from_headers(mail["headers"])
-        reply_record = _get_reply_record_from_lookup_key(lookup_key)
+        reply_record = _get_reply_from_headers(mail["headers"]).reply
 
         # SECURITY: Verify the reply record belongs to the same user as the recipient
         # This prevents cross-account authorization bypass where an attacker could use
@@ -724,11 +857,8 @@ def _handle_received(message_json: AWS_SNSMessageJSON) -> HttpResponse:
     # if address is set to block, early return
     if not address.enabled:
         incr_if_enabled("email_for_disabled_address", 1)
-        address.num_blocked += 1
-        address.save(update_fields=["num_blocked"])
+        _record_blocked_email(address, user_profile)
         _record_receipt_verdicts(receipt, "disabled_alias")
-        user_profile.last_engagement = datetime.now(UTC)
-        user_profile.save()
         glean_logger().log_email_blocked(mask=address, reason="block_all")
         return HttpResponse("Address is temporarily disabled.")
 
@@ -743,10 +873,7 @@ def _handle_received(message_json: AWS_SNSMessageJSON) -> HttpResponse:
         and _check_email_from_list(mail["headers"])
     ):
         incr_if_enabled("list_email_for_address_blocking_lists", 1)
-        address.num_blocked += 1
-        address.save(update_fields=["num_blocked"])
-        user_profile.last_engagement = datetime.now(UTC)
-        user_profile.save()
+        _record_blocked_email(address, user_profile)
         glean_logger().log_email_blocked(mask=address, reason="block_promotional")
         return HttpResponse("Address is not accepting list emails.")
 
@@ -805,6 +932,7 @@ def _handle_received(message_json: AWS_SNSMessageJSON) -> HttpResponse:
         "Resent-From": from_address,
     }
     sample_trackers = bool(sample_is_active("tracker_sample"))
+    sample_header_defects = bool(sample_is_active("header_defect_sample"))
     # TODO MPP-4465: Retire tracker_removal flag as enabled
     tracker_removal_flag = flag_is_active_in_task("tracker_removal", address.user)
     remove_level_one_trackers = bool(
@@ -825,6 +953,7 @@ def _handle_received(message_json: AWS_SNSMessageJSON) -> HttpResponse:
         has_premium=user_profile.has_premium,
         sample_trackers=sample_trackers,
         remove_level_one_trackers=remove_level_one_trackers,
+        sample_header_defects=sample_header_defects,
     )
     if has_html:
         incr_if_enabled("email_with_html_content", 1)
@@ -853,6 +982,45 @@ def _handle_received(message_json: AWS_SNSMessageJSON) -> HttpResponse:
     user_profile.update_abuse_metric(
         email_forwarded=True, forwarded_email_size=len(incoming_email_bytes)
     )
+    _record_forwarded_email(address, user_profile, level_one_trackers_removed)
+    glean_logger().log_email_forwarded(mask=address, is_reply=False)
+    return HttpResponse("Sent email to final recipient.", status=200)
+
+
+def _record_blocked_email(
+    address: RelayAddress | DomainAddress, user_profile: Profile
+) -> None:
+    """Count a blocked email for the mask, and record the user engagement."""
+    if write_behind_enabled():
+        now = datetime.now(UTC)
+        record_statistics(address, {"num_blocked": 1}, now=now)
+        record_statistics(user_profile, timestamps=["last_engagement"], now=now)
+        return
+    address.num_blocked += 1
+    address.save(update_fields=["num_blocked"])
+    user_profile.last_engagement = datetime.now(UTC)
+    user_profile.save()
+
+
+def _record_forwarded_email(
+    address: RelayAddress | DomainAddress,
+    user_profile: Profile,
+    level_one_trackers_removed: int,
+) -> None:
+    """Count a forwarded email for the mask, and record the user engagement."""
+    if write_behind_enabled():
+        now = datetime.now(UTC)
+        record_statistics(user_profile, timestamps=["last_engagement"], now=now)
+        record_statistics(
+            address,
+            {
+                "num_forwarded": 1,
+                "num_level_one_trackers_blocked": level_one_trackers_removed,
+            },
+            timestamps=["last_used_at"],
+            now=now,
+        )
+        return
     user_profile.last_engagement = datetime.now(UTC)
     user_profile.save()
     address.num_forwarded += 1
@@ -869,8 +1037,6 @@ def _handle_received(message_json: AWS_SNSMessageJSON) -> HttpResponse:
             "num_level_one_trackers_blocked",
         ]
     )
-    glean_logger().log_email_forwarded(mask=address, is_reply=False)
-    return HttpResponse("Sent email to final recipient.", status=200)
 
 
 class DeveloperModeAction(NamedTuple):
@@ -917,33 +1083,54 @@ def _get_message_id_from_headers(headers):
     return message_id
 
 
-def _get_keys_from_headers(headers):
-    in_reply_to = None
-    for header in headers:
-        if header["name"].lower() == "in-reply-to":
-            in_reply_to = header["value"]
-            message_id_bytes = get_message_id_bytes(in_reply_to)
-            return derive_reply_keys(message_id_bytes)
-
-        if header["name"].lower() == "references":
-            message_ids = header["value"]
-            for message_id in message_ids.split(" "):
-                message_id_bytes = get_message_id_bytes(message_id)
-                lookup_key, encryption_key = derive_reply_keys(message_id_bytes)
-                try:
-                    # FIXME: calling code is likely to duplicate this query
-                    _get_reply_record_from_lookup_key(lookup_key)
-                    return lookup_key, encryption_key
-                except Reply.DoesNotExist:
-                    pass
-            raise Reply.DoesNotExist
-    incr_if_enabled("mail_to_replies_without_reply_headers", 1)
-    raise ReplyHeadersNotFound
+class ReplyContext(NamedTuple):
+    """The Reply record for the reply headers of an email, and its encryption key."""
 
+    reply: Reply
+    encryption_key: bytes
 
-def _get_reply_record_from_lookup_key(lookup_key):
-    lookup = b64_lookup_key(lookup_key)
-    return Reply.objects.get(lookup=lookup)
+
+def _get_reply_from_headers(headers: list[dict[str, str]]) -> ReplyContext:
+    """
+    Find the Reply record for the In-Reply-To or References header.
+
+    The first of the two headers is used. The References header can have several
+    message IDs, and the first with a Reply record is used. The Reply records for all
+    the message IDs are loaded with one query, along with the mask, user, and profile.
+
+    Raises ReplyHeadersNotFound if there are no reply headers, or Reply.DoesNotExist
+    if no message ID has a Reply record.
+    """
+    message_ids: list[str] | None = None
+    for header in headers:
+        header_name = header["name"].lower()
+        if header_name == "in-reply-to":
+            message_ids = [header["value"]]
+            break
+        if header_name == "references":
+            message_ids = header["value"].split(" ")
+            break
+    if message_ids is None:
+        incr_if_enabled("mail_to_replies_without_reply_headers", 1)
+        raise ReplyHeadersNotFound
+
+    encryption_keys: dict[str, bytes] = {}
+    for message_id in message_ids:
+        lookup_key, encryption_key = derive_reply_keys(get_message_id_bytes(message_id))
+        encryption_keys.setdefault(b64_lookup_key(lookup_key), encryption_key)
+    replies = {
+        reply.lookup: reply
+        for reply in Reply.objects.filter(lookup__in=encryption_keys)
+        .select_related("relay_address__user__profile", "domain_address__user__profile")
+        .prefetch_related(
+            "relay_address__user__socialaccount_set",
+            "domain_address__user__socialaccount_set",
+        )
+    }
+    for lookup, encryption_key in encryption_keys.items():
+        if lookup in replies:
+            return ReplyContext(replies[lookup], encryption_key)
+    raise Reply.DoesNotExist
 
 
 def _strip_localpart_tag(address):
@@ -1036,6 +1223,7 @@ def _convert_to_forwarded_email(
     sample_trackers: bool,
     remove_level_one_trackers: bool,
     now: datetime | None = None,
+    sample_header_defects: bool = True,
 ) -> tuple[EmailMessage, EmailForwardingIssues, int, bool, bool]:
     """
     Convert an email (as bytes) to a forwarded email.
@@ -1047,7 +1235,12 @@ def _convert_to_forwarded_email(
     - has_html - True if the email has an HTML representation
     - has_text - True if the email has a plain text representation
     """
-    email = message_from_bytes(incoming_email_bytes, policy=relay_policy)
+    if settings.EMAIL_PASSTHROUGH_PART_SIZE:
+        email: Message = message_from_bytes_with_passthrough(
+            incoming_email_bytes, settings.EMAIL_PASSTHROUGH_PART_SIZE
+        )
+    else:
+        email = message_from_bytes(incoming_email_bytes, policy=relay_policy)
     # python/typeshed issue 2418
     # The Python 3.2 default was Message, 3.6 uses policy.message_factory, and
     # policy.default.message_factory is EmailMessage
@@ -1055,7 +1248,9 @@ def _convert_to_forwarded_email(
         raise TypeError("email must be type EmailMessage")
 
     # Replace headers in the original email
-    header_issues = _replace_headers(email, headers)
+    header_issues = _replace_headers(
+        email, headers, check_dropped_headers=sample_header_defects
+    )
 
     # Find and replace text content
     text_body = email.get_body("plain")
@@ -1119,7 +1314,7 @@ def _convert_to_forwarded_email(
 
 
 def _replace_headers(
-    email: EmailMessage, headers: OutgoingHeaders
+    email: EmailMessage, headers: OutgoingHeaders, check_dropped_headers: bool = True
 ) -> EmailHeaderIssues:
     """
     Replace the headers in email with new headers.
@@ -1134,14 +1329,30 @@ def _replace_headers(
     support 40 MB emails someday. Modern servers may be OK with this, but it would be
     nice to handle the non-compliant headers without crashing before we add a source of
     memory-related crashes.
+
+    Parsing a header to find defects is slow, and an email can have dozens of
+    Received and DKIM-Signature headers that are dropped. If check_dropped_headers is
+    False, only the headers that are forwarded or replaced are checked.
     """
     # Look for headers to drop
-    to_drop: list[str] = []
+    to_drop: dict[str, str] = {}
     replacements: set[str] = {_k.lower() for _k in headers.keys()}
     issues: EmailHeaderIssues = []
 
+    # Collect headers that will not be forwarded
+    for header in email.keys():
+        header_lower = header.lower()
+        if (
+            header_lower not in replacements
+            and header_lower != "mime-version"
+            and not header_lower.startswith("content-")
+        ):
+            to_drop.setdefault(header_lower, header)
+
     # Detect non-compliant headers in incoming emails
     for header in email.keys():
+        if not check_dropped_headers and header.lower() in to_drop:
+            continue
         try:
             value = email[header]
         except Exception as e:
@@ -1170,18 +1381,8 @@ def _replace_headers(
                 }
             )
 
-    # Collect headers that will not be forwarded
-    for header in email.keys():
-        header_lower = header.lower()
-        if (
-            header_lower not in replacements
-            and header_lower != "mime-version"
-            and not header_lower.startswith("content-")
-        ):
-            to_drop.append(header)
-
-    # Drop headers that should be dropped
-    for header in to_drop:
+    # Drop headers that should be dropped. This drops all headers with the name.
+    for header in to_drop.values():
         del email[header]
 
     # Replace the requested headers
@@ -1434,13 +1635,10 @@ def _handle_reply(
     """
     mail = message_json["mail"]
     try:
-        lookup_key, encryption_key = _get_keys_from_headers(mail["headers"])
+        reply_record, encryption_key = _get_reply_from_headers(mail["headers"])
     except ReplyHeadersNotFound:
         incr_if_enabled("reply_email_header_error", 1, tags=["detail:no-header"])
         return HttpResponse("No In-Reply-To header", status=400)
-
-    try:
-        reply_record = _get_reply_record_from_lookup_key(lookup_key)
     except Reply.DoesNotExist:
         incr_if_enabled("reply_email_header_error", 1, tags=["detail:no-reply-record"])
         return HttpResponse("Unknown or stale In-Reply-To header", status=404)
@@ -1487,7 +1685,7 @@ def _handle_reply(
 
     # Convert to a reply email
     # TODO: Issue #1747 - Remove wrapper / prefix in replies
-    _replace_headers(email, headers)
+    _replace_headers(email, headers, check_dropped_headers=False)
     _replace_reply_email_in_body(email, address.user.email, outbound_from_address)
 
     try:
@@ -1500,15 +1698,59 @@ def _handle_reply(
         log_email_dropped(reason="error_sending", mask=address, is_reply=True)
         return HttpResponse("SES client error", status=400)
 
-    reply_record.increment_num_replied()
     profile = address.user.profile
-    profile.update_abuse_metric(replied=True)
-    profile.last_engagement = datetime.now(UTC)
-    profile.save()
+    if write_behind_enabled():
+        now = datetime.now(UTC)
+        record_statistics(address, {"num_replied": 1}, ["last_used_at"], now)
+        profile.update_abuse_metric(replied=True)
+        record_statistics(profile, timestamps=["last_engagement"], now=now)
+    else:
+        reply_record.increment_num_replied()
+        profile.update_abuse_metric(replied=True)
+        profile.last_engagement = datetime.now(UTC)
+        profile.save()
     glean_logger().log_email_forwarded(mask=address, is_reply=True)
     return HttpResponse("Sent email to final recipient.", status=200)
 
 
+def _subdomain_user_key(subdomain: str) -> str:
+    return f"subdomain_user:{subdomain}"
+
+
+def _find_domain_address(
+    subdomain: str, local_portion: str, domain_numerical: int
+) -> DomainAddress | None:
+    """
+    Find an existing DomainAddress without locking the profile.
+
+    The user ID of a subdomain is cached. A cached user is checked against the
+    profile loaded with the address, so a stale entry only misses the address.
+    """
+    domain_addresses = DomainAddress.objects.select_related("user__profile").filter(
+        address=local_portion, domain=domain_numerical
+    )
+    user_id = cache.get(_subdomain_user_key(subdomain))
+    if user_id is None:
+        domain_address = domain_addresses.filter(
+            user__profile__subdomain=subdomain
+        ).first()
+        if domain_address is not None:
+            _remember_subdomain_user(subdomain, domain_address.user_id)
+        return domain_address
+    domain_address = domain_addresses.filter(user_id=user_id).first()
+    if domain_address is None or domain_address.user.profile.subdomain != subdomain:
+        return None
+    return domain_address
+
+
+def _remember_subdomain_user(subdomain: str, user_id: int) -> None:
+    cache.set(
+        _subdomain_user_key(subdomain),
+        user_id,
+        timeout=settings.SUBDOMAIN_USER_CACHE_SECONDS,
+    )
+
+
 def _get_domain_address(
     local_portion: str, domain_portion: str, create: bool = True
 ) -> DomainAddress:
@@ -1528,12 +1770,27 @@ def _get_domain_address(
         if create:
             incr_if_enabled("email_for_not_supported_domain", 1)
         raise ObjectDoesNotExist("Address does not exist")
+    domain_numerical = get_domain_numerical(address_domain)
+
+    # Most emails are for existing addresses, which do not need the profile lock
+    domain_address = _find_domain_address(
+        address_subdomain, local_portion, domain_numerical
+    )
+    if domain_address is not None:
+        now = datetime.now(UTC)
+        domain_address.last_used_at = now
+        if write_behind_enabled():
+            record_statistics(domain_address, timestamps=["last_used_at"], now=now)
+        else:
+            DomainAddress.objects.filter(id=domain_address.id).update(last_used_at=now)
+        return domain_address
+
     try:
         with transaction.atomic():
             locked_profile = Profile.objects.select_for_update().get(
                 subdomain=address_subdomain
             )
-            domain_numerical = get_domain_numerical(address_domain)
+            _remember_subdomain_user(address_subdomain, locked_profile.user_id)
             # filter DomainAddress because it may not exist
             # which will throw an error with get()
             domain_address = DomainAddress.objects.filter(
@@ -1586,29 +1843,64 @@ def _get_address(address: str, create: bool = True) -> RelayAddress | DomainAddr
         return _get_domain_address(local_address, domain, create)
 
     # the domain is the site's 'top' relay domain, so look up the RelayAddress
+    local_address_hash = address_hash(local_address, domain=domain)
+    use_address_filter = address_filter_enabled()
+    if use_address_filter and (
+        missing_reason := find_missing_address(local_address_hash)
+    ):
+        if create:
+            if missing_reason == "deleted":
+                incr_if_enabled("email_for_deleted_address", 1)
+            else:
+                incr_if_enabled("email_for_unknown_address", 1)
+        raise RelayAddress.DoesNotExist("RelayAddress matching query does not exist.")
     try:
         domain_numerical = get_domain_numerical(domain)
-        relay_address = RelayAddress.objects.get(
+        relay_address = RelayAddress.objects.select_related("user__profile").get(
             address=local_address, domain=domain_numerical
         )
         return relay_address
     except RelayAddress.DoesNotExist as e:
         if not create:
             raise e
+        missing_reason = "deleted"
         try:
-            DeletedAddress.objects.get(
-                address_hash=address_hash(local_address, domain=domain)
-            )
+            DeletedAddress.objects.get(address_hash=local_address_hash)
             incr_if_enabled("email_for_deleted_address", 1)
             # TODO: create a hard bounce receipt rule in SES
         except DeletedAddress.DoesNotExist:
+            missing_reason = "unknown"
             incr_if_enabled("email_for_unknown_address", 1)
         except DeletedAddress.MultipleObjectsReturned:
             # not sure why this happens on stage but let's handle it
             incr_if_enabled("email_for_deleted_address_multiple", 1)
+        if use_address_filter:
+            remember_missing_address(local_address_hash, missing_reason)
         raise e
 
 
+class RecipientContext(NamedTuple):
+    """The mask of an incoming email, and the profile to forward it."""
+
+    address: RelayAddress | DomainAddress
+    profile: Profile
+
+
+def _get_recipient(address: str) -> RecipientContext:
+    """
+    Find or create the mask for an email address, with the owner's profile.
+
+    This raises the same exceptions as _get_address. The user, profile, and
+    Mozilla account are loaded with the mask, so profile properties like
+    has_premium, language, and fxa do not query the database.
+    """
+    mask = _get_address(address)
+    if "user" not in mask._state.fields_cache:
+        mask.user = User.objects.select_related("profile").get(id=mask.user_id)
+    prefetch_related_objects([mask.user], "profile", "socialaccount_set")
+    return RecipientContext(address=mask, profile=mask.user.profile)
+
+
 def _get_address_if_exists(address: str) -> RelayAddress | DomainAddress | None:
     """Get the matching RelayAddress or DomainAddress, or None if it doesn't exist."""
     try:
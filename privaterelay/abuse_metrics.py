@@ -0,0 +1,96 @@
+"""
+Daily abuse metric counters kept in the cache.
+
+With ABUSE_METRICS_BACKEND set to "cache", Profile.update_abuse_metric counts
+with atomic cache increments instead of locking the user's AbuseMetrics row for
+every forwarded email, reply, and new mask. The counters expire after the day is
+over. The counts are stored in AbuseMetrics when the user is flagged, and at
+most once every ABUSE_METRICS_SNAPSHOT_SECONDS otherwise.
+
+The cache must be shared by all processes (Redis in production) for the counts
+to be accurate.
+"""
+
+from __future__ import annotations
+
+from datetime import datetime, time, timedelta
+from typing import TYPE_CHECKING
+
+from django.conf import settings
+from django.core.cache import cache
+
+if TYPE_CHECKING:
+    from django.contrib.auth.models import User
+
+ABUSE_METRIC_FIELDS = (
+    "num_address_created_per_day",
+    "num_replies_per_day",
+    "num_email_forwarded_per_day",
+    "forwarded_email_size_per_day",
+)
+# Counters expire after the UTC day is over, with a margin for clock skew
+COUNTER_TIMEOUT = int(timedelta(days=1, hours=1).total_seconds())
+# Largest value of a PositiveSmallIntegerField in all supported databases
+SMALL_INTEGER_MAX = 32767
+
+
+def _cache_key(user_id: int, day: str, name: str) -> str:
+    return f"abuse_metrics:{user_id}:{day}:{name}"
+
+
+def _incr(key: str, delta: int) -> int:
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        # The key does not exist yet, or expired
+        if cache.add(key, delta, timeout=COUNTER_TIMEOUT):
+            return delta
+        return cache.incr(key, delta)
+
+
+def increment_abuse_metrics(
+    user_id: int, increments: dict[str, int], now: datetime
+) -> dict[str, int]:
+    """Add to the user's counters for today, and return all of today's counters."""
+    day = now.date().isoformat()
+    metrics = {
+        name: _incr(_cache_key(user_id, day, name), delta)
+        for name, delta in increments.items()
+        if delta
+    }
+    others = [name for name in ABUSE_METRIC_FIELDS if name not in metrics]
+    if others:
+        stored = cache.get_many([_cache_key(user_id, day, name) for name in others])
+        for name in others:
+            metrics[name] = int(stored.get(_cache_key(user_id, day, name), 0))
+    return metrics
+
+
+def should_snapshot(user_id: int, now: datetime) -> bool:
+    """Return True at most once per snapshot period for each user."""
+    key = _cache_key(user_id, now.date().isoformat(), "snapshot")
+    return bool(cache.add(key, 1, timeout=settings.ABUSE_METRICS_SNAPSHOT_SECONDS))
+
+
+def store_abuse_metrics(user: User, metrics: dict[str, int], now: datetime) -> None:
+    """Store today's counters in the user's AbuseMetrics row."""
+    from emails.models import AbuseMetrics
+
+    values = {
+        name: (
+            metrics[name]
+            if name == "forwarded_email_size_per_day"
+            else min(metrics[name], SMALL_INTEGER_MAX)
+        )
+        for name in ABUSE_METRIC_FIELDS
+    }
+    midnight_utc_today = datetime.combine(now.date(), time.min, tzinfo=now.tzinfo)
+    midnight_utc_tomorrow = midnight_utc_today + timedelta(days=1)
+    updated = AbuseMetrics.objects.filter(
+        user=user,
+        first_recorded__gte=midnight_utc_today,
+        first_recorded__lt=midnight_utc_tomorrow,
+    ).update(last_recorded=now, **values)
+    if not updated:
+        AbuseMetrics.objects.create(user=user, **values)
+        AbuseMetrics.objects.filter(first_recorded__lt=midnight_utc_today).delete()
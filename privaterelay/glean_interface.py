@@ -77,8 +77,7 @@ class UserData(NamedTuple):
             return cls(metrics_enabled=False)
 
         fxa_id = user.profile.metrics_fxa_id or None
-        n_random_masks = user.relayaddress_set.count()
-        n_domain_masks = user.domainaddress_set.count()
+        n_random_masks, n_domain_masks = user.profile.count_masks()
         n_deleted_random_masks = user.profile.num_deleted_relay_addresses
         n_deleted_domain_masks = user.profile.num_deleted_domain_addresses
         date_joined_relay = user.date_joined
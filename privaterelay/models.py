@@ -5,11 +5,12 @@ import uuid
 from collections import namedtuple
 from datetime import UTC, datetime, timedelta
 from hashlib import sha256
-from typing import TYPE_CHECKING, Literal
+from typing import TYPE_CHECKING, Any, Literal, NamedTuple, Self
 
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.db import models, transaction
+from django.utils.functional import cached_property
 from django.utils.translation.trans_real import (
     get_supported_language_variant,
     parse_accept_lang_header,
@@ -24,7 +25,7 @@ from .utils import flag_is_active_in_task
 from .validators import valid_available_subdomain
 
 if TYPE_CHECKING:
-    from collections.abc import Iterable
+    from collections.abc import Collection, Iterable
 
     from django.db.models.base import ModelBase
     from django.db.models.query import QuerySet
@@ -37,6 +38,22 @@ BounceStatus = namedtuple("BounceStatus", "paused type")
 PREMIUM_DOMAINS = ["mozilla.com", "getpocket.com", "mozillafoundation.org"]
 
 
+class MaskStats(NamedTuple):
+    """The totals for a user's masks, including the deleted masks."""
+
+    relay_addresses: int
+    domain_addresses: int
+    emails_forwarded: int
+    emails_blocked: int
+    emails_replied: int
+    level_one_trackers_blocked: int
+    at_mask_limit: bool
+
+    @property
+    def total_masks(self) -> int:
+        return self.relay_addresses + self.domain_addresses
+
+
 def hash_subdomain(subdomain: str, domain: str = settings.MOZMAIL_DOMAIN) -> str:
     return sha256(f"{subdomain}.{domain}".encode()).hexdigest()
 
@@ -96,9 +113,60 @@ class Profile(models.Model):
         # emails/migrations/0062_move_profile_and_registered_subdomain_models.py
         db_table = "emails_profile"
 
+    # Fields with values remembered from the database, for change detection
+    TRACKED_FIELDS = ("remove_level_one_email_trackers",)
+
     def __str__(self):
         return f"{self.user} Profile"
 
+    @classmethod
+    def from_db(
+        cls, db: str | None, field_names: Collection[str], values: Collection[Any]
+    ) -> Self:
+        instance = super().from_db(db, field_names, values)
+        instance._remember_loaded_values()
+        return instance
+
+    def refresh_from_db(
+        self,
+        using: str | None = None,
+        fields: Iterable[str] | None = None,
+        from_queryset: QuerySet[Profile] | None = None,
+    ) -> None:
+        if fields is not None:
+            fields = list(fields)
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        self._remember_loaded_values(fields)
+
+    def _remember_loaded_values(self, fields: Iterable[str] | None = None) -> None:
+        """Remember the database values of the tracked fields."""
+        if not hasattr(self, "_loaded_values"):
+            self._loaded_values: dict[str, Any] = {}
+        deferred = self.get_deferred_fields()
+        for name in self.TRACKED_FIELDS:
+            if name not in deferred and (fields is None or name in fields):
+                self._loaded_values[name] = getattr(self, name)
+
+    def has_changed(self, field_name: str) -> bool:
+        """
+        Return True if a tracked field differs from the database value.
+
+        The database value is remembered when the profile is loaded or saved, so
+        this does not query the database unless the field was deferred.
+        """
+        if field_name not in self.TRACKED_FIELDS:
+            raise ValueError(f"{field_name} is not a tracked field")
+        loaded_values = getattr(self, "_loaded_values", {})
+        if field_name in loaded_values:
+            loaded_value = loaded_values[field_name]
+        else:
+            loaded_value = (
+                Profile.objects.filter(id=self.id)
+                .values_list(field_name, flat=True)
+                .get()
+            )
+        return bool(getattr(self, field_name) != loaded_value)
+
     def save(
         self,
         force_insert: bool | tuple[ModelBase, ...] = False,
@@ -115,12 +183,15 @@ class Profile(models.Model):
             self.subdomain = self.subdomain.lower()
             if update_fields is not None:
                 update_fields = {"subdomain"}.union(update_fields)
+        if update_fields is not None:
+            update_fields = set(update_fields)
         super().save(
             force_insert=force_insert,
             force_update=force_update,
             using=using,
             update_fields=update_fields,
         )
+        self._remember_loaded_values(update_fields)
         # any time a profile is saved with server_storage False, delete the
         # appropriate server-stored Relay address data.
         if not self.server_storage:
@@ -187,18 +258,43 @@ class Profile(models.Model):
 
         return DomainAddress.objects.filter(user=self.user)
 
+    def count_masks(self) -> tuple[int, int]:
+        """Count the user's relay and domain masks, with one query."""
+        from emails.models import DomainAddress, RelayAddress
+
+        def count_query(
+            masks: QuerySet[RelayAddress] | QuerySet[DomainAddress], is_relay: bool
+        ) -> QuerySet[Any]:
+            return (
+                masks.order_by()
+                .values("user_id")
+                .annotate(is_relay=models.Value(is_relay), count=models.Count("id"))
+                .values_list("is_relay", "count")
+            )
+
+        counts = {True: 0, False: 0}
+        relay_count = count_query(RelayAddress.objects.filter(user=self.user), True)
+        domain_count = count_query(DomainAddress.objects.filter(user=self.user), False)
+        counts.update(relay_count.union(domain_count, all=True))
+        return counts[True], counts[False]
+
     @property
     def total_masks(self) -> int:
-        ra_count: int = self.relay_addresses.count()
-        da_count: int = self.domain_addresses.count()
-        return ra_count + da_count
+        return sum(self.count_masks())
 
     @property
     def at_mask_limit(self) -> bool:
         if self.has_premium:
             return False
         ra_count: int = self.relay_addresses.count()
-        return ra_count >= settings.MAX_NUM_FREE_ALIASES
+        return self._is_at_mask_limit(ra_count)
+
+    def _is_at_mask_limit(self, num_relay_addresses: int) -> bool:
+        """Check if a user with this many relay masks can make another one."""
+        return (
+            num_relay_addresses >= settings.MAX_NUM_FREE_ALIASES
+            and not self.has_premium
+        )
 
     def check_bounce_pause(self) -> BounceStatus:
         if self.last_hard_bounce:
@@ -340,38 +436,38 @@ class Profile(models.Model):
 
     @property
     def emails_forwarded(self) -> int:
-        return (
-            sum(ra.num_forwarded for ra in self.relay_addresses)
-            + sum(da.num_forwarded for da in self.domain_addresses)
-            + self.num_email_forwarded_in_deleted_address
-        )
+        return self.get_mask_stats().emails_forwarded
 
     @property
     def emails_blocked(self) -> int:
-        return (
-            sum(ra.num_blocked for ra in self.relay_addresses)
-            + sum(da.num_blocked for da in self.domain_addresses)
-            + self.num_email_blocked_in_deleted_address
-        )
+        return self.get_mask_stats().emails_blocked
 
     @property
     def emails_replied(self) -> int:
-        ra_sum = self.relay_addresses.aggregate(models.Sum("num_replied", default=0))
-        da_sum = self.domain_addresses.aggregate(models.Sum("num_replied", default=0))
-        return (
-            int(ra_sum["num_replied__sum"])
-            + int(da_sum["num_replied__sum"])
-            + self.num_email_replied_in_deleted_address
-        )
+        return self.get_mask_stats().emails_replied
 
     @property
     def level_one_trackers_blocked(self) -> int:
-        return (
-            sum(ra.num_level_one_trackers_blocked or 0 for ra in self.relay_addresses)
-            + sum(
-                da.num_level_one_trackers_blocked or 0 for da in self.domain_addresses
-            )
-            + (self.num_level_one_trackers_blocked_in_deleted_address or 0)
+        return self.get_mask_stats().level_one_trackers_blocked
+
+    @cached_property
+    def mask_stats(self) -> MaskStats:
+        """The mask statistics, read once for this instance."""
+        return self.get_mask_stats()
+
+    def get_mask_stats(self) -> MaskStats:
+        """Read the totals for the user's masks."""
+        from emails.mask_statistics import get_mask_statistics
+
+        stats = get_mask_statistics(self.user)
+        return MaskStats(
+            relay_addresses=stats["num_relay_addresses"],
+            domain_addresses=stats["num_domain_addresses"],
+            emails_forwarded=stats["num_forwarded"],
+            emails_blocked=stats["num_blocked"],
+            emails_replied=stats["num_replied"],
+            level_one_trackers_blocked=stats["num_level_one_trackers_blocked"],
+            at_mask_limit=self._is_at_mask_limit(stats["num_relay_addresses"]),
         )
 
     @property
@@ -429,6 +525,10 @@ class Profile(models.Model):
     ) -> datetime | None:
         if self.user.email in settings.ALLOWED_ACCOUNTS:
             return None
+        if settings.ABUSE_METRICS_BACKEND == "cache":
+            return self._update_abuse_metric_in_cache(
+                address_created, replied, email_forwarded, forwarded_email_size
+            )
 
         with transaction.atomic():
             # look for abuse metrics created on the same UTC date, regardless of time.
@@ -464,50 +564,89 @@ class Profile(models.Model):
             abuse_metric.last_recorded = datetime.now(UTC)
             abuse_metric.save()
 
-            # check user should be flagged for abuse
-            hit_max_create = False
-            hit_max_replies = False
-            hit_max_forwarded = False
-            hit_max_forwarded_email_size = False
-
-            hit_max_create = (
-                abuse_metric.num_address_created_per_day
-                >= settings.MAX_ADDRESS_CREATION_PER_DAY
-            )
-            hit_max_replies = (
-                abuse_metric.num_replies_per_day >= settings.MAX_REPLIES_PER_DAY
-            )
-            hit_max_forwarded = (
-                abuse_metric.num_email_forwarded_per_day
-                >= settings.MAX_FORWARDED_PER_DAY
-            )
-            hit_max_forwarded_email_size = (
-                abuse_metric.forwarded_email_size_per_day
-                >= settings.MAX_FORWARDED_EMAIL_SIZE_PER_DAY
-            )
-            if (
-                hit_max_create
-                or hit_max_replies
-                or hit_max_forwarded
-                or hit_max_forwarded_email_size
-            ):
-                self.last_account_flagged = datetime.now(UTC)
-                self.save()
-                data = {
-                    "uid": self.fxa.uid if self.fxa else None,
-                    "flagged": self.last_account_flagged.timestamp(),
-                    "replies": abuse_metric.num_replies_per_day,
-                    "addresses": abuse_metric.num_address_created_per_day,
-                    "forwarded": abuse_metric.num_email_forwarded_per_day,
-                    "forwarded_size_in_bytes": (
+            self._flag_if_abusive(
+                {
+                    "num_address_created_per_day": (
+                        abuse_metric.num_address_created_per_day
+                    ),
+                    "num_replies_per_day": abuse_metric.num_replies_per_day,
+                    "num_email_forwarded_per_day": (
+                        abuse_metric.num_email_forwarded_per_day
+                    ),
+                    "forwarded_email_size_per_day": (
                         abuse_metric.forwarded_email_size_per_day
                     ),
                 }
-                # log for further secops review
-                abuse_logger.info("Abuse flagged", extra=data)
+            )
+
+        return self.last_account_flagged
+
+    def _update_abuse_metric_in_cache(
+        self,
+        address_created: bool,
+        replied: bool,
+        email_forwarded: bool,
+        forwarded_email_size: int,
+    ) -> datetime | None:
+        """Count with cache increments, see privaterelay/abuse_metrics.py"""
+        from .abuse_metrics import (
+            increment_abuse_metrics,
+            should_snapshot,
+            store_abuse_metrics,
+        )
 
+        now = datetime.now(UTC)
+        metrics = increment_abuse_metrics(
+            self.user.id,
+            {
+                "num_address_created_per_day": int(address_created),
+                "num_replies_per_day": int(replied),
+                "num_email_forwarded_per_day": int(email_forwarded),
+                "forwarded_email_size_per_day": max(forwarded_email_size, 0),
+            },
+            now,
+        )
+        flagged = self._flag_if_abusive(metrics)
+        if flagged or should_snapshot(self.user.id, now):
+            store_abuse_metrics(self.user, metrics, now)
         return self.last_account_flagged
 
+    def _flag_if_abusive(self, metrics: dict[str, int]) -> bool:
+        """Flag the account if a daily abuse metric reached its limit."""
+        hit_max_create = (
+            metrics["num_address_created_per_day"]
+            >= settings.MAX_ADDRESS_CREATION_PER_DAY
+        )
+        hit_max_replies = metrics["num_replies_per_day"] >= settings.MAX_REPLIES_PER_DAY
+        hit_max_forwarded = (
+            metrics["num_email_forwarded_per_day"] >= settings.MAX_FORWARDED_PER_DAY
+        )
+        hit_max_forwarded_email_size = (
+            metrics["forwarded_email_size_per_day"]
+            >= settings.MAX_FORWARDED_EMAIL_SIZE_PER_DAY
+        )
+        if not (
+            hit_max_create
+            or hit_max_replies
+            or hit_max_forwarded
+            or hit_max_forwarded_email_size
+        ):
+            return False
+
+        self.last_account_flagged = datetime.now(UTC)
+        self.save()
+        data = {
+            "uid": self.fxa.uid if self.fxa else None,
+            "flagged": self.last_account_flagged.timestamp(),
+            "replies": metrics["num_replies_per_day"],
+            "addresses": metrics["num_address_created_per_day"],
+            "forwarded": metrics["num_email_forwarded_per_day"],
+            "forwarded_size_in_bytes": metrics["forwarded_email_size_per_day"],
+        }
+        # log for further secops review
+        abuse_logger.info("Abuse flagged", extra=data)
+        return True
+
     @property
     def is_flagged(self):
         if not self.last_account_flagged:
@@ -472,6 +472,13 @@ MAX_FORWARDED_EMAIL_SIZE_PER_DAY: int = config(
 PREMIUM_FEATURE_PAUSED_DAYS: int = config(
     "ACCOUNT_PREMIUM_FEATURE_PAUSED_DAYS", 1, cast=int
 )
+# "cache" counts abuse metrics in the cache, see privaterelay/abuse_metrics.py
+ABUSE_METRICS_BACKEND = config(
+    "ABUSE_METRICS_BACKEND", "database", cast=Choices(["database", "cache"], cast=str)
+)
+ABUSE_METRICS_SNAPSHOT_SECONDS: int = config(
+    "ABUSE_METRICS_SNAPSHOT_SECONDS", 300, cast=int
+)
 
 SOFT_BOUNCE_ALLOWED_DAYS: int = config("SOFT_BOUNCE_ALLOWED_DAYS", 1, cast=int)
 HARD_BOUNCE_ALLOWED_DAYS: int = config("HARD_BOUNCE_ALLOWED_DAYS", 30, cast=int)
@@ -508,6 +515,29 @@ elif RELAY_CHANNEL == "local":
             "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
         }
     }
+# Buffer mask and profile statistics in Redis, flushed by process_emails_from_sqs.
+# Run rebuild_mask_statistics --rebuild before enabling it.
+EMAIL_STATISTICS_WRITE_BEHIND = bool(REDIS_URL) and config(
+    "EMAIL_STATISTICS_WRITE_BEHIND", False, cast=bool
+)
+# Buffer Reply records in Redis, written in batches by process_emails_from_sqs
+REPLY_RECORD_WRITE_BEHIND = bool(REDIS_URL) and config(
+    "REPLY_RECORD_WRITE_BEHIND", False, cast=bool
+)
+REPLY_RECORD_FLUSH_BATCH_SIZE = config("REPLY_RECORD_FLUSH_BATCH_SIZE", 500, cast=int)
+# Drop emails for unknown and deleted masks with a Redis Bloom filter and cache.
+# Run build_address_filter after enabling, and after changing the size.
+ADDRESS_FILTER_ENABLED = bool(REDIS_URL) and config(
+    "ADDRESS_FILTER_ENABLED", False, cast=bool
+)
+ADDRESS_FILTER_BITS = config("ADDRESS_FILTER_BITS", 2**27, cast=int)
+ADDRESS_FILTER_MISSING_CACHE_SECONDS = config(
+    "ADDRESS_FILTER_MISSING_CACHE_SECONDS", 60 * 60, cast=int
+)
+# Forward non-text parts at least this large as the original bytes (0 disables)
+EMAIL_PASSTHROUGH_PART_SIZE = config("EMAIL_PASSTHROUGH_PART_SIZE", 0, cast=int)
+# Cache the user of a subdomain, to find existing domain masks without a lock
+SUBDOMAIN_USER_CACHE_SECONDS = config("SUBDOMAIN_USER_CACHE_SECONDS", 60 * 60, cast=int)
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -938,6 +968,15 @@ PROCESS_EMAIL_DELETE_FAILED_MESSAGES = config(
 PROCESS_EMAIL_HEALTHCHECK_PATH = config(
     "PROCESS_EMAIL_HEALTHCHECK_PATH", os.path.join(TMP_DIR, "healthcheck.json")
 )
+PROCESS_EMAIL_HEALTHCHECK_INTERVAL = config(
+    "PROCESS_EMAIL_HEALTHCHECK_INTERVAL", 5, cast=int
+)
+PROCESS_EMAIL_QUEUE_METRICS_INTERVAL = config(
+    "PROCESS_EMAIL_QUEUE_METRICS_INTERVAL", 30, cast=int
+)
+PROCESS_EMAIL_STATISTICS_FLUSH_INTERVAL = config(
+    "PROCESS_EMAIL_STATISTICS_FLUSH_INTERVAL", 10, cast=int
+)
 PROCESS_EMAIL_MAX_SECONDS = config("PROCESS_EMAIL_MAX_SECONDS", 0, cast=int) or None
 PROCESS_EMAIL_VERBOSITY = config(
     "PROCESS_EMAIL_VERBOSITY", 1, cast=Choices(range(0, 4), cast=int)
@@ -954,6 +993,14 @@ PROCESS_EMAIL_MAX_SECONDS_PER_MESSAGE = config(
     PROCESS_EMAIL_MAX_SECONDS or 120.0,
     cast=float,
 )
+PROCESS_EMAIL_CONCURRENCY = config(
+    "PROCESS_EMAIL_CONCURRENCY", 1, cast=Choices(range(1, 11), cast=int)
+)
+PROCESS_EMAIL_PREFETCH = config("PROCESS_EMAIL_PREFETCH", False, cast=bool)
+PROCESS_EMAIL_WORKER_MAX_TASKS = config("PROCESS_EMAIL_WORKER_MAX_TASKS", 100, cast=int)
+PROCESS_EMAIL_WORKER_MAX_RSS_MB = (
+    config("PROCESS_EMAIL_WORKER_MAX_RSS_MB", 0, cast=int) or None
+)
 
 # Django 3.2 switches default to BigAutoField
 DEFAULT_AUTO_FIELD = "django.db.models.AutoField"
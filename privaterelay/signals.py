@@ -10,6 +10,7 @@ from django.http import HttpRequest
 from allauth.account.signals import user_logged_in, user_signed_up
 from rest_framework.authtoken.models import Token
 
+from emails.models import MaskStatistics
 from emails.utils import incr_if_enabled, set_user_group
 
 from .models import Profile
@@ -46,6 +47,8 @@ def create_user_profile(
     if created:
         set_user_group(instance)
         Profile.objects.create(user=instance)
+        # A new user has no masks, so the totals start at 0
+        MaskStatistics.objects.get_or_create(user=instance)
 
 
 @receiver(pre_save, sender=Profile, dispatch_uid="measure_feature_usage")
@@ -55,14 +58,9 @@ def measure_feature_usage(
     if instance._state.adding:
         # if newly created Profile ignore the signal
         return
-    curr_profile = Profile.objects.get(id=instance.id)
 
     # measure tracker removal usage
-    changed_tracker_removal_setting = (
-        instance.remove_level_one_email_trackers
-        != curr_profile.remove_level_one_email_trackers
-    )
-    if changed_tracker_removal_setting:
+    if instance.has_changed("remove_level_one_email_trackers"):
         if instance.remove_level_one_email_trackers:
             incr_if_enabled("tracker_removal_enabled")
         if not instance.remove_level_one_email_trackers:
@@ -5,6 +5,7 @@ from uuid import uuid4
 
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.test import TestCase, override_settings
 
 import pytest
@@ -14,7 +15,7 @@ from model_bakery import baker
 from emails.models import AbuseMetrics, DomainAddress, RelayAddress
 
 from ..exceptions import CannotMakeSubdomainException
-from ..models import Profile
+from ..models import MaskStats, Profile
 from .utils import (
     make_free_test_user,
     phone_subscription,
@@ -364,6 +365,14 @@ class ProfileTotalMasksTest(ProfileTestCase):
             baker.make(DomainAddress, user=self.profile.user, address=f"mask{i}")
         assert self.profile.total_masks == num_relay_addresses + num_domain_addresses
 
+    def test_total_masks_one_query(self) -> None:
+        self.upgrade_to_premium()
+        self.profile.add_subdomain("onequery")
+        baker.make(RelayAddress, user=self.profile.user, _quantity=2)
+        baker.make(DomainAddress, user=self.profile.user, address="counted")
+        with self.assertNumQueries(1):
+            assert self.profile.count_masks() == (2, 1)
+
 
 class ProfileAtMaskLimitTest(ProfileTestCase):
     """Tests for Profile.at_mask_limit"""
@@ -386,6 +395,7 @@ class ProfileAtMaskLimitTest(ProfileTestCase):
             _quantity=settings.MAX_NUM_FREE_ALIASES,
         )
         assert self.profile.at_mask_limit is True
+        assert self.profile.get_mask_stats().at_mask_limit is True
 
 
 class ProfileAddSubdomainTest(ProfileTestCase):
@@ -685,6 +695,72 @@ class ProfileEmailsRepliedTest(ProfileTestCase):
         assert self.profile.emails_replied == 8
 
 
+class ProfileGetMaskStatsTest(ProfileTestCase):
+    """Tests for Profile.get_mask_stats()"""
+
+    def test_new_user(self) -> None:
+        assert self.profile.get_mask_stats() == MaskStats(
+            relay_addresses=0,
+            domain_addresses=0,
+            emails_forwarded=0,
+            emails_blocked=0,
+            emails_replied=0,
+            level_one_trackers_blocked=0,
+            at_mask_limit=False,
+        )
+
+    def test_totals_of_all_masks(self) -> None:
+        self.upgrade_to_premium()
+        self.profile.subdomain = "test"
+        self.profile.num_email_forwarded_in_deleted_address = 1
+        self.profile.num_email_blocked_in_deleted_address = 2
+        self.profile.num_email_replied_in_deleted_address = 3
+        self.profile.num_level_one_trackers_blocked_in_deleted_address = 4
+        self.profile.save()
+        baker.make(
+            RelayAddress,
+            user=self.profile.user,
+            num_forwarded=10,
+            num_blocked=20,
+            num_replied=30,
+            num_level_one_trackers_blocked=None,
+            _quantity=2,
+        )
+        baker.make(
+            DomainAddress,
+            user=self.profile.user,
+            address="domain",
+            num_forwarded=100,
+            num_blocked=200,
+            num_replied=300,
+            num_level_one_trackers_blocked=400,
+        )
+
+        with self.assertNumQueries(1):
+            mask_stats = self.profile.get_mask_stats()
+        assert mask_stats == MaskStats(
+            relay_addresses=2,
+            domain_addresses=1,
+            emails_forwarded=121,
+            emails_blocked=242,
+            emails_replied=363,
+            level_one_trackers_blocked=404,
+            at_mask_limit=False,
+        )
+        assert mask_stats.total_masks == 3
+        assert self.profile.emails_forwarded == 121
+        assert self.profile.emails_blocked == 242
+        assert self.profile.level_one_trackers_blocked == 404
+
+    def test_free_user_at_mask_limit(self) -> None:
+        baker.make(
+            RelayAddress,
+            user=self.profile.user,
+            _quantity=settings.MAX_NUM_FREE_ALIASES,
+        )
+        assert self.profile.get_mask_stats().at_mask_limit is True
+
+
 class ProfileUpdateAbuseMetricTest(ProfileTestCase):
     """Tests for Profile.update_abuse_metric()"""
 
@@ -759,6 +835,71 @@ class ProfileUpdateAbuseMetricTest(ProfileTestCase):
         assert self.profile.last_account_flagged == self.expected_now
 
 
+@override_settings(ABUSE_METRICS_BACKEND="cache", ABUSE_METRICS_SNAPSHOT_SECONDS=300)
+class ProfileUpdateAbuseMetricCacheTest(ProfileTestCase):
+    """Tests for Profile.update_abuse_metric() with counters in the cache"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        cache.clear()
+        self.addCleanup(cache.clear)
+        patcher_logger = patch("privaterelay.models.abuse_logger.info")
+        self.mocked_abuse_info = patcher_logger.start()
+        self.addCleanup(patcher_logger.stop)
+
+    def test_counts_without_row_per_call(self) -> None:
+        self.profile.update_abuse_metric(email_forwarded=True, forwarded_email_size=10)
+        # The first update of the day stores a snapshot
+        abuse_metric = AbuseMetrics.objects.get(user=self.profile.user)
+        assert abuse_metric.num_email_forwarded_per_day == 1
+
+        with self.assertNumQueries(0):
+            self.profile.update_abuse_metric(
+                email_forwarded=True, forwarded_email_size=10
+            )
+            self.profile.update_abuse_metric(replied=True)
+        abuse_metric.refresh_from_db()
+        assert abuse_metric.num_email_forwarded_per_day == 1
+        assert self.profile.last_account_flagged is None
+        self.mocked_abuse_info.assert_not_called()
+
+    @override_settings(MAX_REPLIES_PER_DAY=3)
+    def test_flags_profile_and_stores_metrics_when_threshold_met(self) -> None:
+        self.profile.update_abuse_metric(email_forwarded=True)
+        self.profile.update_abuse_metric(replied=True)
+        self.profile.update_abuse_metric(replied=True)
+        assert self.profile.last_account_flagged is None
+
+        flagged = self.profile.update_abuse_metric(replied=True)
+
+        assert flagged is not None
+        assert self.profile.last_account_flagged == flagged
+        self.mocked_abuse_info.assert_called_once_with(
+            "Abuse flagged",
+            extra={
+                "uid": None,
+                "flagged": flagged.timestamp(),
+                "replies": 3,
+                "addresses": 0,
+                "forwarded": 1,
+                "forwarded_size_in_bytes": 0,
+            },
+        )
+        abuse_metric = AbuseMetrics.objects.get(user=self.profile.user)
+        assert abuse_metric.num_replies_per_day == 3
+        assert abuse_metric.num_email_forwarded_per_day == 1
+
+    def test_snapshot_removes_old_metrics(self) -> None:
+        old_metric = baker.make(AbuseMetrics, user=self.profile.user)
+        AbuseMetrics.objects.filter(id=old_metric.id).update(
+            first_recorded=datetime.now(UTC) - timedelta(days=2)
+        )
+        self.profile.update_abuse_metric(address_created=True)
+        abuse_metric = AbuseMetrics.objects.get(user=self.profile.user)
+        assert abuse_metric.id != old_metric.id
+        assert abuse_metric.num_address_created_per_day == 1
+
+
 class ProfileMetricsEnabledTest(ProfileTestCase):
     def test_no_fxa_means_metrics_enabled(self) -> None:
         assert not self.profile.fxa
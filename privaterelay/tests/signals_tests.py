@@ -4,10 +4,12 @@ from unittest.mock import Mock, patch
 
 from django.contrib.auth.models import User
 from django.contrib.sessions.middleware import SessionMiddleware
+from django.db import connection
 from django.http.request import HttpRequest
 from django.http.response import HttpResponse
 from django.test import TestCase
 from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
 
 import pytest
 from model_bakery import baker
@@ -105,6 +107,35 @@ class MeasureFeatureUsageSignalTest(TestCase):
         self.mocked_incr.assert_not_called()
         self.mocked_events_info.assert_not_called()
 
+    def test_remove_level_one_email_trackers_changed_twice(self) -> None:
+        self.profile.remove_level_one_email_trackers = True
+        self.profile.save()
+        self.profile.remove_level_one_email_trackers = False
+        self.profile.save()
+        assert [call.args for call in self.mocked_incr.call_args_list] == [
+            ("tracker_removal_enabled",),
+            ("tracker_removal_disabled",),
+        ]
+
+    def test_loaded_profile_save_does_not_reload_profile(self) -> None:
+        profile = Profile.objects.get(id=self.profile.id)
+        profile.remove_level_one_email_trackers = True
+        with CaptureQueriesContext(connection) as queries:
+            profile.save(update_fields={"remove_level_one_email_trackers"})
+        profile_selects = [
+            query["sql"]
+            for query in queries
+            if query["sql"].startswith('SELECT "emails_profile"')
+        ]
+        assert profile_selects == []
+        self.mocked_incr.assert_called_once_with("tracker_removal_enabled")
+
+    def test_deferred_tracked_field_is_read_from_database(self) -> None:
+        profile = Profile.objects.only("id").get(id=self.profile.id)
+        profile.remove_level_one_email_trackers = True
+        profile.save()
+        self.mocked_incr.assert_called_once_with("tracker_removal_enabled")
+
     def test_profile_created_does_not_emit_metric_and_logs(self) -> None:
         self.mocked_incr.assert_not_called()
         self.mocked_events_info.assert_not_called()
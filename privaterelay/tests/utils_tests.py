@@ -19,6 +19,7 @@ from waffle.utils import get_cache as get_waffle_cache
 from ..country_utils import AcceptLanguageError, guess_country_from_accept_lang
 from ..sp3_plans import get_sp3_country_language_mapping
 from ..utils import (
+    _cached_subplat_upgrade_link,
     flag_is_active_in_task,
     get_countries_info_from_request_and_mapping,
     get_subplat_upgrade_link_by_language,
@@ -662,6 +663,18 @@ def test_get_subplat_upgrade_link_by_language_invalid_header() -> None:
     assert link == expected_url
 
 
+def test_get_subplat_upgrade_link_by_language_cached() -> None:
+    _cached_subplat_upgrade_link.cache_clear()
+    with patch(
+        "privaterelay.utils.guess_country_from_accept_lang",
+        wraps=guess_country_from_accept_lang,
+    ) as mock_guess:
+        link = get_subplat_upgrade_link_by_language("de-DE")
+        assert get_subplat_upgrade_link_by_language("de-DE") == link
+        assert get_subplat_upgrade_link_by_language("de-DE", "monthly") != link
+    assert mock_guess.call_count == 2
+
+
 @pytest.mark.parametrize(
     "relay_client_platform, expected_os_platform",
     (
@@ -5,7 +5,7 @@ import logging
 import random
 from collections.abc import Callable
 from decimal import Decimal
-from functools import cache, wraps
+from functools import cache, lru_cache, wraps
 from pathlib import Path
 from typing import TYPE_CHECKING, ParamSpec, TypedDict, TypeVar, cast
 
@@ -116,6 +116,12 @@ def get_countries_info_from_lang_and_mapping(
 def get_subplat_upgrade_link_by_language(
     accept_language: str, period: PeriodStr = "yearly"
 ) -> str:
+    return _cached_subplat_upgrade_link(accept_language, period)
+
+
+@lru_cache(maxsize=1024)
+def _cached_subplat_upgrade_link(accept_language: str, period: PeriodStr) -> str:
+    """Get the upgrade link for a language, cached like the plan mapping."""
     try:
         country_str = guess_country_from_accept_lang(accept_language)
         country = cast(CountryStr, country_str)